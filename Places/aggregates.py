@@ -0,0 +1,309 @@
+"""
+Инкрементальное обновление агрегатов мест (PlaceStats)
+"""
+import math
+from datetime import datetime
+from typing import Iterable, Optional
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Count, Max, Q
+from django.utils import timezone
+from Places.models import Place, Rating, Accept, PlaceImage, PlaceStats, PlaceChange, PendingRatingChange, \
+    RATING_VALUES, accept_type_by_cnt
+from Places import events, tiles, detail_cache
+from Places.geo import cell_of
+from Places.utils import chunked
+
+# Начало отсчета времени для трендов, чтобы ключи трендов оставались небольшими числами
+TREND_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def bayesian_score(rating_sum: int, rating_cnt: int) -> float:
+    """
+    Байесовское среднее рейтинга: оценка стягивается к априорному среднему, пока оценок мало
+    """
+    prior_mean, prior_weight = settings.PLACES_RATING_PRIOR_MEAN, settings.PLACES_RATING_PRIOR_WEIGHT
+    return (prior_mean * prior_weight + rating_sum) / (prior_weight + rating_cnt)
+
+
+def trend_decay_rate() -> float:
+    """
+    Скорость затухания трендов в 1/с
+    """
+    return math.log(2) / (settings.PLACES_TRENDING_HALF_LIFE_HOURS * 3600)
+
+
+def trend_event_key(when: datetime) -> float:
+    """
+    Вклад одного события в ключ тренда: ln(e^(lambda * t))
+    """
+    return trend_decay_rate() * (when - TREND_EPOCH).total_seconds()
+
+
+def trend_add(key: Optional[float], event_key: float) -> float:
+    """
+    Добавление события к ключу тренда, ln(e^key + e^event_key) без переполнений
+    """
+    if key is None:
+        return event_key
+    hi, lo = max(key, event_key), min(key, event_key)
+    return hi + math.log1p(math.exp(lo - hi))
+
+
+def trend_score(key: Optional[float], now: datetime = None) -> float:
+    """
+    Текущая затухшая сумма событий по ключу тренда
+    """
+    if key is None:
+        return 0.0
+    now = now or timezone.now()
+    return math.exp(key - trend_event_key(now))
+
+
+def _refresh_derived(stats: PlaceStats):
+    stats.rating_avg = stats.rating_sum / stats.rating_cnt if stats.rating_cnt else None
+    stats.score = bayesian_score(stats.rating_sum, stats.rating_cnt)
+
+
+def _touch(stats: PlaceStats, when: Optional[datetime]):
+    if when is not None and (stats.last_activity_dt is None or when > stats.last_activity_dt):
+        stats.last_activity_dt = when
+
+
+def _rating_counts() -> dict:
+    # Гистограмма оценок одним сгруппированным запросом: условный COUNT на каждое значение
+    return {f'r{value}': Count('id', filter=Q(rating=value)) for value in RATING_VALUES}
+
+
+def _set_ratings(stats: PlaceStats, ratings: dict):
+    stats.rating_sum, stats.rating_cnt = ratings['s'] or 0, ratings['c']
+    for value in RATING_VALUES:
+        setattr(stats, f'rating_{value}_cnt', ratings[f'r{value}'])
+
+
+def _compute(place: Place) -> PlaceStats:
+    """
+    Полный пересчет агрегатов одного места по дочерним таблицам
+    """
+    ratings = Rating.objects.filter(place_id=place.id).aggregate(s=Sum('rating'), c=Count('id'),
+                                                                 last=Max('updated_dt'), **_rating_counts())
+    accepts = Accept.objects.filter(place_id=place.id).aggregate(c=Count('id'), last=Max('created_dt'))
+    images = PlaceImage.objects.filter(place_id=place.id).aggregate(c=Count('id'), last=Max('created_dt'))
+    row, col = cell_of(place.latitude, place.longitude)
+    stats = PlaceStats(place_id=place.id, accepts_cnt=accepts['c'], images_cnt=images['c'], cell_row=row,
+                       cell_col=col)
+    _set_ratings(stats, ratings)
+    for when in (ratings['last'], accepts['last'], images['last']):
+        _touch(stats, when)
+    for when in _event_times([place.id]).get(place.id, ()):
+        stats.trend_key = trend_add(stats.trend_key, trend_event_key(when))
+    _refresh_derived(stats)
+    return stats
+
+
+def _event_times(place_ids: Iterable[int]) -> dict:
+    times = {}
+    for model in (Rating, Accept):
+        rows = model.objects.filter(place_id__in=place_ids).values_list('place_id', 'created_dt')
+        for place_id, when in rows.iterator():
+            times.setdefault(place_id, []).append(when)
+    return times
+
+
+def _locked_stats(place_id: int) -> (PlaceStats, bool):
+    """
+    Строка агрегатов места под блокировкой (вызывать внутри транзакции)
+    Если строки еще нет, она создается полным пересчетом, который уже учитывает текущее событие
+    :return: Агрегаты и флаг того, что они только что посчитаны с нуля
+    """
+    stats = PlaceStats.objects.select_for_update().filter(place_id=place_id).first()
+    if stats is not None:
+        return stats, False
+    stats = _compute(Place.objects.with_deleted().get(id=place_id))
+    try:
+        with transaction.atomic():
+            stats.save(force_insert=True)
+        return stats, True
+    except IntegrityError:
+        return PlaceStats.objects.select_for_update().get(place_id=place_id), False
+
+
+def place_saved(place: Place, created: bool):
+    """
+    Создание строки агрегатов для нового места или обновление ячейки сетки для измененного
+    """
+    row, col = cell_of(place.latitude, place.longitude)
+    if created:
+        PlaceStats.objects.get_or_create(place_id=place.id, defaults={
+            'cell_row': row, 'cell_col': col, 'score': bayesian_score(0, 0),
+        })
+        if not place.deleted_flg:
+            events.publish(place.id, (row, col), created=True, name=place.name, address=place.address,
+                           latitude=place.latitude, longitude=place.longitude, rating=None,
+                           accept_type=accept_type_by_cnt(0))
+    else:
+        PlaceStats.objects.filter(place_id=place.id).exclude(cell_row=row, cell_col=col)\
+            .update(cell_row=row, cell_col=col)
+
+
+def rating_changed(place_id: int, old_rating: Optional[int], new_rating: Optional[int],
+                   when: datetime = None) -> PlaceStats:
+    """
+    Учет изменения рейтинга пользователя: None в old_rating -- новая оценка, None в new_rating -- удаление оценки
+    """
+    with transaction.atomic():
+        stats, fresh = _locked_stats(place_id)
+        old_avg = stats.rating_avg
+        if not fresh:
+            stats.rating_sum += (new_rating or 0) - (old_rating or 0)
+            stats.rating_cnt += (new_rating is not None) - (old_rating is not None)
+            if old_rating is not None:
+                field = f'rating_{old_rating}_cnt'
+                setattr(stats, field, getattr(stats, field) - 1)
+            if new_rating is not None:
+                field = f'rating_{new_rating}_cnt'
+                setattr(stats, field, getattr(stats, field) + 1)
+                when = when or timezone.now()
+                stats.trend_key = trend_add(stats.trend_key, trend_event_key(when))
+                _touch(stats, when)
+        _refresh_derived(stats)
+        stats.save()
+        if fresh or stats.rating_avg != old_avg:
+            PlaceChange.objects.record(place_id, PlaceChange.RATING)
+            events.publish(place_id, (stats.cell_row, stats.cell_col), rating=stats.rating_avg,
+                           rating_cnt=stats.rating_cnt)
+    return stats
+
+
+def flush_rating_changes(place_id: int = None, created_by: int = None, due_only: bool = True) -> int:
+    """
+    Закрытие окон склейки оценок: одно изменение агрегатов от учтенной оценки к последней
+    :param due_only: Только изменения, окно которых закрылось (см. PendingRatingChangesManager.due)
+    :return: Сколько изменений учтено
+    """
+    pending = PendingRatingChange.objects.due() if due_only else PendingRatingChange.objects.all()
+    if place_id is not None:
+        pending = pending.filter(place_id=place_id)
+    if created_by is not None:
+        pending = pending.filter(created_by=created_by)
+    ids = pending.order_by('updated_dt').values_list('id', flat=True)
+    flushed = 0
+    for pending_id in ids:
+        with transaction.atomic():
+            # Строка перечитывается под блокировкой: оценку могли поменять или изменение уже учли
+            change = PendingRatingChange.objects.select_for_update().filter(id=pending_id).first()
+            if change is None:
+                continue
+            if change.old_rating != change.rating:
+                rating_changed(change.place_id, change.old_rating, change.rating, change.updated_dt)
+            change.delete()
+        flushed += 1
+    return flushed
+
+
+def accepts_changed(place_id: int, delta: int, when: datetime = None) -> PlaceStats:
+    """
+    Учет добавления (delta > 0) или удаления (delta < 0) подтверждений места
+    """
+    with transaction.atomic():
+        stats, fresh = _locked_stats(place_id)
+        old_type = stats.accept_type
+        if not fresh:
+            stats.accepts_cnt += delta
+            if delta > 0:
+                when = when or timezone.now()
+                stats.trend_key = trend_add(stats.trend_key, trend_event_key(when))
+                _touch(stats, when)
+        stats.save()
+        # Подписчикам интересен уровень проверенности, а не каждое подтверждение
+        if fresh or stats.accept_type != old_type:
+            PlaceChange.objects.record(place_id, PlaceChange.ACCEPT)
+            events.publish(place_id, (stats.cell_row, stats.cell_col), accept_type=stats.accept_type,
+                           accepts_cnt=stats.accepts_cnt)
+        else:
+            # Запись в журнал сбрасывает кэши сама (см. Places.signals), а accepts_cnt есть и в тайлах, и в месте;
+            # подтверждения через API (Accept.objects.insert_or_ignore) сигналов Accept не отправляют
+            tiles.invalidate_place(place_id)
+            detail_cache.invalidate(place_id)
+    return stats
+
+
+def images_changed(place_id: int, delta: int, when: datetime = None) -> PlaceStats:
+    """
+    Учет добавления (delta > 0) или удаления (delta < 0) картинок места
+    """
+    with transaction.atomic():
+        stats, fresh = _locked_stats(place_id)
+        if not fresh:
+            stats.images_cnt += delta
+            if delta > 0:
+                _touch(stats, when or timezone.now())
+        stats.save()
+    return stats
+
+
+def rating_stats(place_ids: Iterable[int]) -> dict:
+    """
+    Агрегаты рейтинга существующих мест по id: из PlaceStats, а для мест без строки агрегатов -- одним запросом
+    GROUP BY place_id, rating (такие строки не сохраняются)
+    """
+    place_ids = list(place_ids)
+    result = {stats.place_id: stats for stats in PlaceStats.objects.filter(place_id__in=place_ids)}
+    missing = [place_id for place_id in place_ids if place_id not in result]
+    if not missing:
+        return result
+    for place_id in missing:
+        result[place_id] = PlaceStats(place_id=place_id)
+    rows = Rating.objects.filter(place_id__in=missing).values_list('place_id', 'rating')\
+        .annotate(c=Count('id')).order_by()
+    for place_id, rating, cnt in rows:
+        stats = result[place_id]
+        setattr(stats, f'rating_{rating}_cnt', cnt)
+        stats.rating_sum += rating * cnt
+        stats.rating_cnt += cnt
+    for place_id in missing:
+        _refresh_derived(result[place_id])
+    return result
+
+
+def rebuild(place_ids: Iterable[int] = None, chunk_size: int = 1000) -> int:
+    """
+    Полный пересчет агрегатов пачками для указанных или всех мест
+    :return: Сколько мест пересчитано
+    """
+    places = Place.objects.with_deleted().order_by('id')
+    if place_ids is not None:
+        places = places.filter(id__in=list(place_ids))
+    total = 0
+    rows = places.values_list('id', 'latitude', 'longitude').iterator(chunk_size=chunk_size)
+    for chunk in chunked(rows, chunk_size):
+        ids = [place_id for place_id, _, _ in chunk]
+        ratings = {r['place_id']: r for r in Rating.objects.filter(place_id__in=ids).values('place_id')
+                   .annotate(s=Sum('rating'), c=Count('id'), last=Max('updated_dt'), **_rating_counts()).order_by()}
+        accepts, images = [
+            {r['place_id']: r for r in model.objects.filter(place_id__in=ids).values('place_id')
+             .annotate(c=Count('id'), last=Max('created_dt')).order_by()}
+            for model in (Accept, PlaceImage)
+        ]
+        no_ratings = {'s': 0, 'c': 0, 'last': None, **{f'r{value}': 0 for value in RATING_VALUES}}
+        no_rows = {'c': 0, 'last': None}
+        times = _event_times(ids)
+        new_stats = []
+        for place_id, lat, long in chunk:
+            row, col = cell_of(lat, long)
+            r, a, i = ratings.get(place_id, no_ratings), accepts.get(place_id, no_rows), images.get(place_id, no_rows)
+            stats = PlaceStats(place_id=place_id, accepts_cnt=a['c'], images_cnt=i['c'], cell_row=row, cell_col=col)
+            _set_ratings(stats, r)
+            for when in (r['last'], a['last'], i['last']):
+                _touch(stats, when)
+            for when in times.get(place_id, ()):
+                stats.trend_key = trend_add(stats.trend_key, trend_event_key(when))
+            _refresh_derived(stats)
+            new_stats.append(stats)
+        with transaction.atomic():
+            PlaceStats.objects.filter(place_id__in=ids).delete()
+            PlaceStats.objects.bulk_create(new_stats)
+            # Пересчет уже учитывает текущие оценки
+            PendingRatingChange.objects.filter(place_id__in=ids).delete()
+        total += len(chunk)
+    return total
@@ -0,0 +1,215 @@
+"""
+Сценарии замеров производительности для manage.py benchmark
+"""
+import os
+import subprocess
+import sys
+import time
+from importlib import import_module
+from typing import Callable, Dict, List
+from django.core.handlers.base import BaseHandler
+from django.core.signals import request_started, request_finished
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from django.test import RequestFactory, override_settings
+from django.urls import path
+from rest_framework.renderers import JSONRenderer
+from Places.models import Place, Rating
+from Places.renderers import FastJSONRenderer, PinsRenderer, MsgPackPinsRenderer, HAS_MSGPACK, orjson
+from Places.serializers import PlaceListSerializer, RatingSerializer, place_list_row_builder
+from PlacesService.middleware import brotli, compress
+
+SCENARIOS = {}
+
+
+def scenario(name: str, iterations: int = 1000):
+    """
+    Регистрация сценария замера: функция принимает число итераций и возвращает строки результатов measure
+    :param iterations: Число итераций по умолчанию
+    """
+    def decorator(func: Callable[[int], List[Dict]]):
+        func.default_iterations = iterations
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def measure(case: str, func: Callable[[], None], iterations: int, warmup: int = None) -> Dict:
+    """
+    Время выполнения func: среднее и перцентили в миллисекундах после прогрева
+    """
+    warmup = min(iterations // 10, 100) if warmup is None else warmup
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'case': case,
+        'iterations': iterations,
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+        'max_ms': timings[-1],
+    }
+
+
+def _request_cycle(connection):
+    # Как в настоящем запросе: обработчики request_started/request_finished закрывают или проверяют соединение
+    request_started.send(sender=__name__)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    request_finished.send(sender=__name__)
+
+
+@scenario('connections')
+def connections_overhead(iterations: int) -> List[Dict]:
+    """
+    Накладные расходы на соединение с БД в запросе: новое (или взятое из пула) соединение против постоянного
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+    per_request = 'pooled' if connection.settings_dict.get('POOL') else 'reconnect'
+    results = []
+    try:
+        for case, max_age in ((per_request, 0), ('persistent', None)):
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            results.append(measure(case, lambda: _request_cycle(connection), iterations))
+    finally:
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+    return results
+
+
+# Сколько мест берется в слой карты в сценариях с ответами API
+PAGE_SIZE = 1000
+
+
+@scenario('pins', iterations=20)
+def pins_payload(iterations: int) -> List[Dict]:
+    """
+    Время сборки и размер слоя карты из PAGE_SIZE мест: JSON через PlaceListSerializer против бинарных форматов,
+    собранных из values_list
+    """
+    places = Place.objects.order_by('id')
+    pins = places.values_list('id', 'latitude', 'longitude', 'stats__rating_avg')
+    cases = [
+        ('json', lambda: JSONRenderer().render(PlaceListSerializer(places[:PAGE_SIZE], many=True).data)),
+        ('pins', lambda: PinsRenderer().render(list(pins[:PAGE_SIZE]))),
+    ]
+    if HAS_MSGPACK:
+        cases.append(('msgpack', lambda: MsgPackPinsRenderer().render(list(pins[:PAGE_SIZE]))))
+    results = []
+    for case, func in cases:
+        result = measure(case, func, iterations)
+        result['bytes'] = len(func())
+        results.append(result)
+    return results
+
+
+@scenario('json', iterations=20)
+def json_responses(iterations: int) -> List[Dict]:
+    """
+    CPU на ответ и байты в сети для страниц из PAGE_SIZE мест и оценок: стандартный JSONRenderer против
+    FastJSONRenderer, без сжатия, gzip и brotli (если установлен)
+    """
+    pages = {
+        'places': PlaceListSerializer(Place.objects.order_by('id')[:PAGE_SIZE], many=True).data,
+        'ratings': RatingSerializer(Rating.objects.select_related('place__stats').order_by('id')[:PAGE_SIZE],
+                                    many=True).data,
+    }
+    renderers = [('json', JSONRenderer())] + ([('orjson', FastJSONRenderer())] if orjson is not None else [])
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    results = []
+    for page, data in pages.items():
+        for name, renderer in renderers:
+            for encoding in encodings:
+                if encoding == 'identity':
+                    func = lambda renderer=renderer, data=data: renderer.render(data)
+                else:
+                    func = lambda renderer=renderer, data=data, encoding=encoding: compress(renderer.render(data),
+                                                                                    encoding)
+                result = measure(f'{page}/{name}/{encoding}', func, iterations)
+                result['bytes'] = len(func())
+                results.append(result)
+    return results
+
+
+@scenario('places_list', iterations=20)
+def places_list(iterations: int) -> List[Dict]:
+    """
+    Пропускная способность спискового представления страницы из PAGE_SIZE мест с агрегатами:
+    PlaceListSerializer против сборки словарей из values_list
+    """
+    places = Place.objects.with_aggregates().order_by('id')
+    fields = tuple(name for name, field in PlaceListSerializer().fields.items() if not field.write_only)
+    columns, build = place_list_row_builder(fields)
+    cases = [
+        ('serializer', lambda: PlaceListSerializer(places[:PAGE_SIZE], many=True).data),
+        ('values', lambda: build(places.values_list(*columns)[:PAGE_SIZE])),
+    ]
+    results = []
+    for case, func in cases:
+        result = measure(case, func, iterations)
+        result['places_per_s'] = round(len(func()) / result['mean_ms'] * 1000) if result['mean_ms'] else 0
+        results.append(result)
+    return results
+
+
+def _ping(request):
+    return JsonResponse({'ok': True})
+
+
+# URL для замера накладных расходов middleware: ответ без БД и обращений к другим сервисам
+urlpatterns = [
+    path('api/benchmark/', _ping),
+]
+
+# Профили настроек: полный (с админкой) и только для API
+SETTINGS_PROFILES = ('PlacesService.settings', 'PlacesService.settings_api')
+
+
+@scenario('middleware', iterations=2000)
+def middleware_overhead(iterations: int) -> List[Dict]:
+    """
+    Накладные расходы стека middleware на запрос к /api/ в полном профиле настроек и в профиле только для API
+    """
+    results = []
+    for profile in SETTINGS_PROFILES:
+        handler = BaseHandler()
+        with override_settings(MIDDLEWARE=import_module(profile).MIDDLEWARE):
+            handler.load_middleware()
+
+        def request():
+            handler.get_response(RequestFactory().get('/api/benchmark/'))
+        with override_settings(ALLOWED_HOSTS=['testserver'], ROOT_URLCONF=__name__):
+            results.append(measure(profile, request, iterations))
+    return results
+
+
+# Запуск процесса до готовности обслужить первый запрос: WSGI-приложение и URL со всеми вьюхами
+STARTUP_CODE = 'from PlacesService.wsgi import application; from django.urls import get_resolver; ' \
+               'get_resolver().url_patterns'
+
+
+@scenario('startup', iterations=5)
+def startup_time(iterations: int) -> List[Dict]:
+    """
+    Время запуска процесса до готовности обслужить первый запрос и число загруженных модулей
+    для каждого профиля настроек
+    """
+    command = [sys.executable, '-c', f'import sys; {STARTUP_CODE}; print(len(sys.modules))']
+    results = []
+    for profile in SETTINGS_PROFILES:
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+
+        def start():
+            return subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE).stdout
+        result = measure(profile, start, iterations, warmup=1)
+        result['modules'] = int(start())
+        results.append(result)
+    return results
@@ -0,0 +1,126 @@
+"""
+WebSocket-подписка на изменения мест вместо опроса /api/places/<id>/
+"""
+import asyncio
+import time
+from collections import deque
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from Places.events import place_group, cell_group
+from Places.geo import cell_of
+
+
+class PlaceUpdatesConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Подписка на изменения мест по id или по сектору карты
+    Клиент присылает {"action": "subscribe", "ids": [...]} или
+    {"action": "subscribe", "bbox": {"lat1": ..., "long1": ..., "lat2": ..., "long2": ...}} и {"action": "unsubscribe"};
+    сектор учитывается с точностью до ячейки сетки cell_of
+    Изменения одного места склеиваются и отправляются пачкой {"type": "updates", "places": [...]} не чаще раза
+    в PLACES_REALTIME_FLUSH_SECONDS; сообщений от клиента -- не больше PLACES_REALTIME_MAX_MESSAGES
+    за PLACES_REALTIME_WINDOW_SECONDS
+    """
+    async def connect(self):
+        self.groups_joined = set()
+        self.pending = {}
+        self.flush_task = None
+        self.last_flush = time.monotonic()
+        self.received = deque()
+        await self.accept()
+
+    async def disconnect(self, code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.leave_groups()
+
+    async def receive_json(self, content, **kwargs):
+        if not self.allow_message():
+            await self.send_error('Слишком много сообщений, попробуйте позже')
+            return
+        action = content.get('action', None) if isinstance(content, dict) else None
+        if action == 'unsubscribe':
+            await self.leave_groups()
+            await self.send_json({'type': 'unsubscribed'})
+        elif action == 'subscribe':
+            try:
+                groups, ids, cells = self.get_subscription(content)
+            except ValueError as e:
+                await self.send_error(str(e))
+                return
+            await self.leave_groups()
+            for group in groups:
+                await self.channel_layer.group_add(group, self.channel_name)
+            self.groups_joined = groups
+            await self.send_json({'type': 'subscribed', 'ids': ids, 'cells': cells})
+        else:
+            await self.send_error('action должен быть subscribe или unsubscribe')
+
+    def allow_message(self) -> bool:
+        now = time.monotonic()
+        while self.received and now - self.received[0] > settings.PLACES_REALTIME_WINDOW_SECONDS:
+            self.received.popleft()
+        if len(self.received) >= settings.PLACES_REALTIME_MAX_MESSAGES:
+            return False
+        self.received.append(now)
+        return True
+
+    @staticmethod
+    def get_subscription(content: dict) -> (set, list, int):
+        """
+        Группы слоя каналов для подписки
+        :return: Группы, id мест и количество ячеек сетки
+        """
+        ids, bbox = content.get('ids', None) or [], content.get('bbox', None)
+        if not ids and not bbox:
+            raise ValueError('Для подписки нужны ids или bbox')
+        try:
+            ids = list(dict.fromkeys(int(x) for x in ids))
+        except (ValueError, TypeError):
+            raise ValueError('ids должен быть списком чисел')
+        if len(ids) > settings.PLACES_REALTIME_MAX_IDS:
+            raise ValueError(f'Можно подписаться не больше чем на {settings.PLACES_REALTIME_MAX_IDS} мест')
+        groups = {place_group(place_id) for place_id in ids}
+        cells = 0
+        if bbox:
+            try:
+                lat1, long1, lat2, long2 = (float(bbox[key]) for key in ('lat1', 'long1', 'lat2', 'long2'))
+            except (KeyError, ValueError, TypeError):
+                raise ValueError('bbox должен содержать числа lat1, long1, lat2, long2')
+            row_min, col_min = cell_of(min(lat1, lat2), min(long1, long2))
+            row_max, col_max = cell_of(max(lat1, lat2), max(long1, long2))
+            cells = (row_max - row_min + 1) * (col_max - col_min + 1)
+            if cells > settings.PLACES_REALTIME_MAX_CELLS:
+                raise ValueError('Слишком большой сектор карты, уменьшите bbox')
+            groups |= {cell_group((row, col)) for row in range(row_min, row_max + 1)
+                       for col in range(col_min, col_max + 1)}
+        return groups, ids, cells
+
+    async def leave_groups(self):
+        for group in self.groups_joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups_joined = set()
+        self.pending = {}
+
+    async def send_error(self, detail: str):
+        await self.send_json({'type': 'error', 'detail': detail})
+
+    async def place_changed(self, event: dict):
+        """
+        Изменение места из Places.events: копится до ближайшей отправки
+        """
+        place = event['place']
+        if place_group(place['id']) not in self.groups_joined and \
+                cell_group(event['cell']) not in self.groups_joined:
+            return
+        self.pending.setdefault(place['id'], {}).update(place)
+        if self.flush_task is None:
+            delay = max(0.0, self.last_flush + settings.PLACES_REALTIME_FLUSH_SECONDS - time.monotonic())
+            self.flush_task = asyncio.ensure_future(self.flush_later(delay))
+
+    async def flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self.flush_task = None
+        pending, self.pending = self.pending, {}
+        self.last_flush = time.monotonic()
+        if pending:
+            await self.send_json({'type': 'updates', 'places': list(pending.values())})
@@ -0,0 +1,105 @@
+"""
+Поиск дубликатов мест
+"""
+import re
+from collections import defaultdict
+from typing import FrozenSet, List, Tuple
+from django.conf import settings
+from Places.models import Place
+from Places.geo import SpatialGrid, degrees_for_meters, haversine_m
+
+_SPACES_RE = re.compile(r'\s+')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+
+
+def normalize_name(name: str) -> str:
+    """
+    Нормализация названия места для сравнения: регистр, пунктуация, лишние пробелы и ё
+    """
+    name = _PUNCT_RE.sub(' ', name.casefold().replace('ё', 'е'))
+    return _SPACES_RE.sub(' ', name).strip()
+
+
+def trigrams(name: str) -> FrozenSet[str]:
+    """
+    Множество триграмм нормализованного названия
+    """
+    padded = f'  {normalize_name(name)} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigram_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """
+    Коэффициент Дайса по триграммам, от 0 до 1
+    """
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def name_similarity(a: str, b: str) -> float:
+    """
+    Похожесть двух названий мест, от 0 до 1
+    """
+    return trigram_similarity(trigrams(a), trigrams(b))
+
+
+def find_duplicate_candidates(name: str, latitude: float, longitude: float, radius_m: float = None,
+                              threshold: float = None, exclude_id: int = None) -> List[Tuple[Place, float, float]]:
+    """
+    Места в радиусе radius_m с похожим названием, по возрастанию расстояния
+    :return: Список троек (место, расстояние в метрах, похожесть названия)
+    """
+    radius_m = settings.PLACES_DUPLICATE_RADIUS_M if radius_m is None else radius_m
+    threshold = settings.PLACES_DUPLICATE_NAME_SIMILARITY if threshold is None else threshold
+    d_lat, d_long = degrees_for_meters(radius_m)
+    nearby = Place.objects.filter(latitude__gte=latitude - d_lat, latitude__lte=latitude + d_lat,
+                                  longitude__gte=longitude - d_long, longitude__lte=longitude + d_long)
+    if exclude_id is not None:
+        nearby = nearby.exclude(id=exclude_id)
+    name_grams = trigrams(name)
+    candidates = []
+    for place in nearby:
+        distance = haversine_m(latitude, longitude, place.latitude, place.longitude)
+        if distance > radius_m:
+            continue
+        similarity = trigram_similarity(name_grams, trigrams(place.name))
+        if similarity >= threshold:
+            candidates.append((place, distance, similarity))
+    return sorted(candidates, key=lambda x: x[1])
+
+
+def find_duplicate_clusters(radius_m: float = None, threshold: float = None,
+                            chunk_size: int = 5000) -> List[List[int]]:
+    """
+    Поиск групп дубликатов по всей таблице мест
+    Места раскладываются по сетке с ячейкой в radius_m, и каждое сравнивается только с соседями по сетке,
+    поэтому время почти линейно по количеству мест, а не O(n^2)
+    :return: Список групп id мест, в каждой группе больше одного места
+    """
+    radius_m = settings.PLACES_DUPLICATE_RADIUS_M if radius_m is None else radius_m
+    threshold = settings.PLACES_DUPLICATE_NAME_SIMILARITY if threshold is None else threshold
+    grid = SpatialGrid(max(radius_m, 1))
+    parent = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    rows = Place.objects.order_by('id').values_list('id', 'name', 'latitude', 'longitude')
+    for place_id, name, lat, long in rows.iterator(chunk_size=chunk_size):
+        grams = trigrams(name)
+        parent[place_id] = place_id
+        for (other_id, other_grams), _ in grid.nearby(lat, long, radius_m):
+            if trigram_similarity(grams, other_grams) >= threshold:
+                a, b = find(place_id), find(other_id)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        grid.add(lat, long, (place_id, grams))
+
+    clusters = defaultdict(list)
+    for place_id in parent:
+        clusters[find(place_id)].append(place_id)
+    return sorted((ids for ids in clusters.values() if len(ids) > 1), key=lambda ids: ids[0])
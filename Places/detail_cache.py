@@ -0,0 +1,114 @@
+"""
+Внутрипроцессный кэш детальных представлений мест без полей конкретного пользователя
+Запись кэша помечается версией места из общего для процессов кэша Django (Redis по REDIS_URL, см. CACHES); любое
+изменение места, его оценок или подтверждений увеличивает версию после коммита (см. Places.signals
+и aggregates.accepts_changed), и записи со старой версией во всех процессах перестают использоваться
+Без REDIS_URL версии хранятся в памяти процесса, и изменение в одном процессе не сбрасывает записи других
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(place_id: int) -> str:
+    return f'places:detail:version:{place_id}'
+
+
+class DetailCache:
+    """
+    LRU-кэш словарей по id места размером до max_size со временем жизни записи ttl секунд
+    """
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._stale = 0
+
+    def get_or_build(self, place_id: int, build: Callable[[], dict]) -> dict:
+        """
+        Представление места из кэша или собранное build; исключение build пробрасывается и ничего не кэширует
+        Версия читается до build, поэтому изменение во время сборки только сделает запись устаревшей
+        """
+        version = cache.get(version_key(place_id), 0)
+        data = self._get(place_id, version)
+        if data is not None:
+            return data
+        data = build()
+        self._put(place_id, version, data)
+        return data
+
+    def _get(self, place_id: int, version: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(place_id, None)
+            if entry is not None:
+                entry_version, expires_at, data = entry
+                if entry_version == version and expires_at > self.clock():
+                    self._entries.move_to_end(place_id)
+                    self._hits += 1
+                    return data
+                del self._entries[place_id]
+                self._stale += 1
+            self._misses += 1
+            return None
+
+    def _put(self, place_id: int, version: int, data: dict):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[place_id] = (version, self.clock() + self.ttl, data)
+            self._entries.move_to_end(place_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits_total': self._hits,
+                'misses_total': self._misses,
+                'hit_ratio': self._hits / requests if requests else None,
+                'evictions_total': self._evictions,
+                'stale_total': self._stale,
+            }
+
+
+def invalidate(place_id: int):
+    """
+    Увеличение версии места после коммита текущей транзакции
+    """
+    def bump():
+        key = version_key(place_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+    transaction.on_commit(bump)
+
+
+_detail_cache = None
+
+
+def get_detail_cache() -> DetailCache:
+    """
+    Кэш текущего процесса с размером и временем жизни из настроек
+    """
+    global _detail_cache
+    if _detail_cache is None:
+        _detail_cache = DetailCache(settings.PLACES_DETAIL_CACHE_SIZE, settings.PLACES_DETAIL_CACHE_SECONDS)
+    return _detail_cache
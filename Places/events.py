@@ -0,0 +1,38 @@
+"""
+Публикация изменений мест подписчикам по WebSocket (Places.consumers) через слой каналов
+Сообщения отправляются в группу места и в группу ячейки сетки (cell_of), в которой оно находится
+"""
+import logging
+from typing import Tuple
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def place_group(place_id: int) -> str:
+    return f'places.place.{place_id}'
+
+
+def cell_group(cell: Tuple[int, int]) -> str:
+    return f'places.cell.{cell[0]}.{cell[1]}'
+
+
+def publish(place_id: int, cell: Tuple[int, int], **changes):
+    """
+    Отправка изменений места после коммита текущей транзакции; без слоя каналов ничего не делает
+    Ошибка слоя каналов не должна ломать уже закоммиченную запись, поэтому только логируется
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    message = {'type': 'place.changed', 'cell': list(cell), 'place': dict(changes, id=place_id)}
+
+    def send():
+        try:
+            for group in (place_group(place_id), cell_group(cell)):
+                async_to_sync(layer.group_send)(group, message)
+        except Exception:
+            logger.exception('Не удалось опубликовать изменение места %s', place_id)
+    transaction.on_commit(send)
@@ -0,0 +1,156 @@
+"""
+Гео-утилиты для мест
+"""
+import math
+from collections import defaultdict
+from typing import Any, Iterator, Tuple
+
+# Границы Москвы, в которые должно попадать любое место (см. lat_msk_constraint и long_msk_constraint)
+MSK_LAT_MIN = 55.515174
+MSK_LAT_MAX = 56.106229
+MSK_LONG_MIN = 36.994695
+MSK_LONG_MAX = 37.956703
+
+# Примерное кол-во метров в одном градусе широты
+METERS_PER_LAT_DEGREE = 111320.0
+
+
+def in_msk_bounds(latitude: float, longitude: float) -> bool:
+    """
+    Попадает ли точка в границы Москвы
+    """
+    return MSK_LAT_MIN <= latitude <= MSK_LAT_MAX and MSK_LONG_MIN <= longitude <= MSK_LONG_MAX
+
+
+def clamp_to_msk(latitude: float, longitude: float) -> (float, float):
+    """
+    Прижатие точки к границам Москвы
+    """
+    return min(max(latitude, MSK_LAT_MIN), MSK_LAT_MAX), min(max(longitude, MSK_LONG_MIN), MSK_LONG_MAX)
+
+
+# Размер ячейки грубой сетки, по которой фильтруются рейтинги мест по сектору карты
+CELL_DEGREES = 0.01
+
+
+def cell_of(latitude: float, longitude: float) -> (int, int):
+    """
+    Ячейка грубой сетки (строка, столбец), в которую попадает точка
+    """
+    return int(math.floor(latitude / CELL_DEGREES)), int(math.floor(longitude / CELL_DEGREES))
+
+
+# Средняя широта Москвы -- для перевода метров в градусы долготы
+MSK_LAT_MID = (MSK_LAT_MIN + MSK_LAT_MAX) / 2
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """
+    Расстояние между двумя точками в метрах
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(long2 - long1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def degrees_for_meters(meters: float) -> (float, float):
+    """
+    Сколько градусов широты и долготы примерно составляют meters метров в Москве
+    """
+    d_lat = meters / METERS_PER_LAT_DEGREE
+    return d_lat, d_lat / math.cos(math.radians(MSK_LAT_MID))
+
+
+class SpatialGrid:
+    """
+    Равномерная сетка в памяти для поиска соседних точек, ячейка примерно cell_m на cell_m метров
+    """
+    def __init__(self, cell_m: float):
+        self.cell_m = cell_m
+        self.cell_lat, self.cell_long = degrees_for_meters(cell_m)
+        self.cells = defaultdict(list)
+
+    def cell_of(self, latitude: float, longitude: float) -> (int, int):
+        return int(latitude // self.cell_lat), int(longitude // self.cell_long)
+
+    def add(self, latitude: float, longitude: float, item: Any):
+        self.cells[self.cell_of(latitude, longitude)].append((latitude, longitude, item))
+
+    def nearby(self, latitude: float, longitude: float, radius_m: float) -> Iterator[Tuple[Any, float]]:
+        """
+        Все элементы не дальше radius_m метров от точки вместе с расстоянием до них
+        """
+        row, col = self.cell_of(latitude, longitude)
+        rings = math.ceil(radius_m * 1.01 / self.cell_m)
+        for r in range(row - rings, row + rings + 1):
+            for c in range(col - rings, col + rings + 1):
+                for lat, long, item in self.cells.get((r, c), ()):
+                    distance = haversine_m(latitude, longitude, lat, long)
+                    if distance <= radius_m:
+                        yield item, distance
+
+
+# Зум web-mercator, на котором считается ключ тайла места: тайл около 2,4 м
+TILE_KEY_ZOOM = 24
+
+
+def tile_of(latitude: float, longitude: float, zoom: int) -> (int, int):
+    """
+    Тайл web-mercator (x, y), в который попадает точка на зуме zoom
+    """
+    n = 1 << zoom
+    lat = math.radians(latitude)
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> (float, float, float, float):
+    """
+    Границы тайла: (мин. широта, макс. широта, мин. долгота, макс. долгота)
+    """
+    n = 1 << zoom
+
+    def latitude(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return latitude(y + 1), latitude(y), x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+
+
+def _interleave(x: int, y: int) -> int:
+    key = 0
+    for bit in range(TILE_KEY_ZOOM):
+        key |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def tile_key(latitude: float, longitude: float) -> int:
+    """
+    Ключ тайла точки: номер тайла на зуме TILE_KEY_ZOOM по кривой Мортона (биты x и y через один)
+    Все точки тайла любого меньшего зума попадают в непрерывный диапазон ключей, см. tile_key_range
+    """
+    return _interleave(*tile_of(latitude, longitude, TILE_KEY_ZOOM))
+
+
+def tile_key_range(zoom: int, x: int, y: int) -> (int, int):
+    """
+    Диапазон ключей [от, до) точек тайла
+    """
+    shift = 2 * (TILE_KEY_ZOOM - zoom)
+    start = _interleave(x, y) << shift
+    return start, start + (1 << shift)
+
+
+def tile_ancestors(key: int, max_zoom: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    Тайлы (zoom, x, y) зумов от 0 до max_zoom, в которые попадает точка с ключом key
+    """
+    x = y = 0
+    for bit in range(TILE_KEY_ZOOM):
+        x |= ((key >> (2 * bit)) & 1) << bit
+        y |= ((key >> (2 * bit + 1)) & 1) << bit
+    for zoom in range(max_zoom + 1):
+        shift = TILE_KEY_ZOOM - zoom
+        yield zoom, x >> shift, y >> shift
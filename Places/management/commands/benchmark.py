@@ -0,0 +1,32 @@
+import json
+from django.core.management.base import BaseCommand
+from Places.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = 'Замер производительности по сценарию из Places.benchmarks'
+    timing_keys = ('case', 'iterations', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS), help='Сценарий замера')
+        parser.add_argument('--iterations', type=int, default=None,
+                            help='Сколько раз повторить замер, по умолчанию -- свое для каждого сценария')
+        parser.add_argument('--json', action='store_true', help='Результаты JSON-строками вместо таблицы')
+
+    def handle(self, *args, **options):
+        func = SCENARIOS[options['scenario']]
+        results = func(options['iterations'] or func.default_iterations)
+        if options['json']:
+            for row in results:
+                self.stdout.write(json.dumps(row))
+            return
+        # Дополнительные метрики сценария (например, размер ответа) выводятся после времени
+        extra = [key for key in results[0] if key not in self.timing_keys] if results else []
+        widths = {key: max(12, len(key) + 2) for key in extra}
+        case_width = max([24] + [len(row['case']) + 2 for row in results])
+        self.stdout.write(f'{"case":<{case_width}}{"iterations":>12}{"mean, ms":>12}{"p50, ms":>12}{"p95, ms":>12}'
+                          f'{"max, ms":>12}' + ''.join(f'{key:>{widths[key]}}' for key in extra))
+        for row in results:
+            self.stdout.write(f'{row["case"]:<{case_width}}{row["iterations"]:>12}{row["mean_ms"]:>12.3f}'
+                              f'{row["p50_ms"]:>12.3f}{row["p95_ms"]:>12.3f}{row["max_ms"]:>12.3f}'
+                              + ''.join(f'{row[key]:>{widths[key]}}' for key in extra))
@@ -0,0 +1,116 @@
+import time
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, DatabaseError
+from django.utils import timezone
+from Places.models import Accept, Rating, PlaceImage, ArchivedAccept, ArchivedRating, ArchivedPlaceImage
+
+# Живая модель и ее архив по имени для --only
+ARCHIVES = {
+    'accepts': (Accept, ArchivedAccept),
+    'ratings': (Rating, ArchivedRating),
+    'images': (PlaceImage, ArchivedPlaceImage),
+}
+
+
+def table_size(table: str) -> Optional[int]:
+    """
+    Размер таблицы вместе с индексами в байтах или None, если СУБД его не отдает
+    """
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_total_relation_size(%s)', [connection.ops.quote_name(table)])
+            elif connection.vendor == 'sqlite':
+                # dbstat есть не во всех сборках SQLite
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                               '(SELECT name FROM sqlite_master WHERE tbl_name = %s)', [table])
+            else:
+                return None
+            return cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+
+
+def format_size(size: Optional[int]) -> str:
+    return '?' if size is None else f'{size / 2 ** 20:.1f} МБ'
+
+
+class Command(BaseCommand):
+    help = 'Перенос мягко удаленных подтверждений, оценок и картинок старше срока хранения в архивные таблицы ' \
+           'пачками с паузами; запросы с with_deleted=true читают живые и архивные строки вместе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=float, default=settings.PLACES_ARCHIVE_RETENTION_DAYS,
+                            help='Сколько дней удаленные строки остаются в живых таблицах')
+        parser.add_argument('--only', choices=list(ARCHIVES), action='append', default=None,
+                            help='Какие таблицы сжимать, по умолчанию -- все')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько строк переносить за транзакцию')
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Пауза между пачками в секундах, чтобы не мешать живой нагрузке')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='VACUUM ANALYZE сжатых таблиц после переноса (только PostgreSQL)')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать строки для переноса')
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 0 or options['chunk_size'] < 1 or options['sleep'] < 0:
+            raise CommandError('--retention-days и --sleep должны быть неотрицательными, --chunk-size -- положительным')
+        cutoff = timezone.now() - timedelta(days=options['retention_days'])
+        total_moved = total_reclaimed = 0
+        for name in options['only'] or ARCHIVES:
+            model, archive = ARCHIVES[name]
+            expired = model.objects.with_deleted().filter(deleted_flg=True, deleted_dt__lte=cutoff)
+            if options['dry_run']:
+                self.stdout.write(f'{name}: к переносу {expired.count()} строк')
+                continue
+            start = time.monotonic()
+            table = model._meta.db_table
+            size_before, rows_before = table_size(table), model.objects.with_deleted().count()
+            moved = 0
+            while True:
+                ids = list(expired.order_by().values_list('id', flat=True)[:options['chunk_size']])
+                if not ids:
+                    break
+                moved += self._move(model, archive, ids)
+                self.stdout.write(f'{name}: перенесено {moved} строк')
+                time.sleep(options['sleep'])
+            if moved and options['vacuum'] and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'VACUUM ANALYZE {connection.ops.quote_name(table)}')
+            # Место удаленных строк переиспользуется после (авто)вакуума, файл таблицы сам не уменьшается,
+            # поэтому освобожденное место оценивается по среднему размеру строки
+            reclaimed = size_before * moved // rows_before if size_before is not None and rows_before else None
+            total_moved += moved
+            total_reclaimed += reclaimed or 0
+            self.stdout.write(
+                f'{name}: перенесено {moved} из {rows_before} строк за {time.monotonic() - start:.1f} с, '
+                f'освобождается ~{format_size(reclaimed)}; размер таблицы {format_size(size_before)} -> '
+                f'{format_size(table_size(table))}, архива {format_size(table_size(archive._meta.db_table))}'
+            )
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Перенесено в архив {total_moved} строк, освобождается ~{format_size(total_reclaimed)}'
+            ))
+
+    @staticmethod
+    def _move(model, archive, ids: list) -> int:
+        """
+        Перенос удаленных строк с id из ids в архив одной транзакцией
+        :return: Сколько строк перенесено
+        """
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(field.column) for field in archive._meta.concrete_fields if field.name != 'archived_dt')
+        placeholders = ', '.join(['%s'] * len(ids))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {qn(archive._meta.db_table)} ({columns}, {qn("archived_dt")}) '
+                    f'SELECT {columns}, %s FROM {qn(model._meta.db_table)} WHERE id IN ({placeholders}) '
+                    f'AND deleted_flg = %s',
+                    [connection.ops.adapt_datetimefield_value(timezone.now()), *ids, True]
+                )
+                moved = cursor.rowcount
+            model.objects.with_deleted().filter(id__in=ids, deleted_flg=True).delete()
+        return moved
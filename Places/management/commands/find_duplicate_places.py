@@ -0,0 +1,24 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Places.models import Place
+from Places.dedup import find_duplicate_clusters
+
+
+class Command(BaseCommand):
+    help = 'Поиск групп мест-дубликатов по всей таблице (близко расположенные места с похожими названиями)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--radius', type=float, default=settings.PLACES_DUPLICATE_RADIUS_M,
+                            help='Радиус поиска дубликатов в метрах')
+        parser.add_argument('--threshold', type=float, default=settings.PLACES_DUPLICATE_NAME_SIMILARITY,
+                            help='Минимальная похожесть названий дубликатов, от 0 до 1')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        clusters = find_duplicate_clusters(radius_m=options['radius'], threshold=options['threshold'])
+        for ids in clusters:
+            names = dict(Place.objects.filter(id__in=ids).values_list('id', 'name'))
+            self.stdout.write(json.dumps({'ids': ids, 'names': [names[i] for i in ids]}, ensure_ascii=False))
+        self.stderr.write(f'Найдено {len(clusters)} групп дубликатов за {time.monotonic() - start:.1f} с')
@@ -0,0 +1,23 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Places import aggregates
+
+
+class Command(BaseCommand):
+    help = 'Учет закрывшихся окон склейки оценок (PLACES_RATING_COALESCE_SECONDS) в агрегатах мест'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Учесть и еще открытые окна')
+        parser.add_argument('--loop', action='store_true',
+                            help='Повторять каждые PLACES_RATING_COALESCE_SECONDS секунд, для отдельного процесса')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.monotonic()
+            flushed = aggregates.flush_rating_changes(due_only=not options['all'])
+            if flushed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Учтено {flushed} окон за {time.monotonic() - start:.1f} с'))
+            if not options['loop']:
+                return
+            time.sleep(max(settings.PLACES_RATING_COALESCE_SECONDS, 1))
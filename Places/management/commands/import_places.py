@@ -0,0 +1,152 @@
+import csv
+import json
+import os
+import time
+from typing import Iterator, Tuple
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from Places.models import Place, PlaceChange
+from Places.geo import SpatialGrid, in_msk_bounds, tile_key
+from Places.dedup import trigrams, trigram_similarity
+from Places.utils import chunked
+from Places import aggregates, tiles
+
+
+class RowError(Exception):
+    """
+    Ошибка валидации строки импортируемого файла
+    """
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Импорт мест из CSV или NDJSON с проверкой координат и дедупликацией по названию и расстоянию'
+
+    max_length = Place._meta.get_field('name').max_length
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу; CSV должен иметь заголовок name,address,latitude,longitude')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default=None,
+                            help='Формат файла, по умолчанию определяется по расширению')
+        parser.add_argument('--created-by', type=int, required=True, help='id пользователя-автора мест')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Размер пачки при вставке')
+        parser.add_argument('--radius', type=float, default=settings.PLACES_DUPLICATE_RADIUS_M,
+                            help='Радиус поиска дубликатов в метрах')
+        parser.add_argument('--threshold', type=float, default=settings.PLACES_DUPLICATE_NAME_SIMILARITY,
+                            help='Минимальная похожесть названий дубликатов, от 0 до 1')
+        parser.add_argument('--rejects', default=None, help='Файл для отклоненных строк, по умолчанию stderr')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не вставлять')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'ndjson', 'jsonl'):
+            raise CommandError('Не получается определить формат файла, укажите --format')
+        if options['created_by'] < 1 or options['chunk_size'] < 1 or options['radius'] < 0:
+            raise CommandError('--created-by и --chunk-size должны быть положительными, --radius -- неотрицательным')
+        self.radius = options['radius']
+        self.threshold = options['threshold']
+        self.grid = SpatialGrid(max(self.radius, 1))
+        rejects = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else self.stderr
+        start = time.monotonic()
+        self._load_existing()
+        read = imported = duplicates = rejected = 0
+        try:
+            with open(path, encoding='utf-8', newline='') as f:
+                rows = self._read_csv(f) if fmt == 'csv' else self._read_ndjson(f)
+                for chunk in chunked(rows, options['chunk_size']):
+                    new_places = []
+                    for lineno, row in chunk:
+                        read += 1
+                        try:
+                            place = self._validate(row, options['created_by'])
+                        except RowError as e:
+                            rejected += 1
+                            rejects.write(f'line {lineno}: {e}\n')
+                            continue
+                        if self._is_duplicate(place):
+                            duplicates += 1
+                            rejects.write(f'line {lineno}: дубликат места "{place.name}"\n')
+                            continue
+                        self.grid.add(place.latitude, place.longitude, trigrams(place.name))
+                        new_places.append(place)
+                    if new_places and not options['dry_run']:
+                        with transaction.atomic():
+                            last_id = Place.objects.with_deleted().order_by('-id').values_list('id', flat=True).first()
+                            Place.objects.bulk_create(new_places, batch_size=options['chunk_size'])
+                            new_ids = self._new_ids(new_places, last_id)
+                            # bulk_create обходит сигналы, поэтому агрегаты новых мест считаются здесь же
+                            aggregates.rebuild(new_ids, chunk_size=options['chunk_size'])
+                            PlaceChange.objects.record_many(new_ids, PlaceChange.CREATED)
+                            tiles.invalidate_many(place.tile_key for place in new_places)
+                    imported += len(new_places)
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(f'Обработано {read} строк, {read / elapsed if elapsed > 0 else 0:.0f} строк/с')
+        finally:
+            if rejects is not self.stderr:
+                rejects.close()
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано {imported}, дубликатов {duplicates}, отклонено {rejected} из {read} строк '
+            f'за {elapsed:.1f} с ({read / elapsed if elapsed > 0 else 0:.0f} строк/с)'
+        ))
+
+    @staticmethod
+    def _new_ids(places: list, last_id: int) -> list:
+        """
+        id вставленных мест: bulk_create проставляет их не на всех БД (например, не на SQLite), тогда берутся
+        места с id больше последнего до вставки -- лишние места из параллельных вставок ленте изменений не вредят
+        """
+        if all(place.id is not None for place in places):
+            return [place.id for place in places]
+        return list(Place.objects.with_deleted().filter(id__gt=last_id or 0).values_list('id', flat=True))
+
+    def _load_existing(self):
+        """
+        Загрузка существующих мест в сетку для дедупликации
+        """
+        existing = Place.objects.values_list('name', 'latitude', 'longitude').iterator(chunk_size=5000)
+        for name, lat, long in existing:
+            self.grid.add(lat, long, trigrams(name))
+
+    def _is_duplicate(self, place: Place) -> bool:
+        grams = trigrams(place.name)
+        return any(trigram_similarity(grams, other) >= self.threshold
+                   for other, _ in self.grid.nearby(place.latitude, place.longitude, self.radius))
+
+    @staticmethod
+    def _read_csv(f) -> Iterator[Tuple[int, dict]]:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+    @staticmethod
+    def _read_ndjson(f) -> Iterator[Tuple[int, dict]]:
+        for lineno, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield lineno, row if isinstance(row, dict) else None
+
+    def _validate(self, row, created_by: int) -> Place:
+        if row is None:
+            raise RowError('строка не является JSON-объектом')
+        name, address = row.get('name'), row.get('address')
+        for field, value in (('name', name), ('address', address)):
+            if not isinstance(value, str) or not value.strip():
+                raise RowError(f'поле {field} обязательно')
+            if len(value) > self.max_length:
+                raise RowError(f'поле {field} длиннее {self.max_length} символов')
+        try:
+            latitude, longitude = float(row.get('latitude')), float(row.get('longitude'))
+        except (TypeError, ValueError):
+            raise RowError('latitude и longitude должны быть числами')
+        if not in_msk_bounds(latitude, longitude):
+            raise RowError('координаты вне границ Москвы')
+        # bulk_create не вызывает Place.save, поэтому ключ тайла проставляется здесь
+        return Place(name=name.strip(), address=address.strip(), latitude=latitude, longitude=longitude,
+                     tile_key=tile_key(latitude, longitude), created_by=created_by)
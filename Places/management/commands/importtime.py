@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Places.benchmarks import STARTUP_CODE
+
+
+def parse_importtime(output: str) -> list:
+    """
+    Строки отчета python -X importtime: модуль, собственное и накопленное время импорта в микросекундах, глубина
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append({
+            'module': name.strip(),
+            'self_us': int(own),
+            'cumulative_us': int(cumulative),
+            'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Профиль импорта при запуске процесса (python -X importtime) до готовности обслужить первый запрос'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Сколько самых долгих модулей вывести')
+        parser.add_argument('--sort', choices=('cumulative', 'self'), default='cumulative',
+                            help='Сортировка модулей по накопленному или собственному времени импорта')
+        parser.add_argument('--json', action='store_true', help='Результаты JSON-строками вместо таблицы')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE',
+                                                                      settings.SETTINGS_MODULE))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_CODE], env=env, check=True,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        rows = parse_importtime(result.stderr)
+        total_us = sum(row['cumulative_us'] for row in rows if row['depth'] == 0)
+        # Собственное время модулей по пакетам верхнего уровня: что стоит грузить лениво
+        packages = defaultdict(int)
+        for row in rows:
+            packages[row['module'].split('.')[0]] += row['self_us']
+        top = sorted(rows, key=lambda row: row[f'{options["sort"]}_us'], reverse=True)[:options['top']]
+        top_packages = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:options['top']]
+        if options['json']:
+            self.stdout.write(json.dumps({'total_us': total_us, 'modules': len(rows), 'top': top,
+                                          'packages': dict(top_packages)}))
+            return
+        self.stdout.write(f'Импорт {len(rows)} модулей за {total_us / 1000:.1f} мс ({env["DJANGO_SETTINGS_MODULE"]})')
+        self.stdout.write(f'\n{"module":<60}{"self, ms":>12}{"cumulative, ms":>16}')
+        for row in top:
+            self.stdout.write(f'{row["module"]:<60}{row["self_us"] / 1000:>12.1f}{row["cumulative_us"] / 1000:>16.1f}')
+        self.stdout.write(f'\n{"package":<60}{"self, ms":>12}')
+        for package, own in top_packages:
+            self.stdout.write(f'{package:<60}{own / 1000:>12.1f}')
@@ -0,0 +1,16 @@
+import time
+from django.core.management.base import BaseCommand
+from Places import aggregates
+
+
+class Command(BaseCommand):
+    help = 'Полный пересчет агрегатов мест (PlaceStats) по рейтингам, подтверждениям и картинкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('place_ids', nargs='*', type=int, help='id мест, по умолчанию -- все места')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Сколько мест пересчитывать за раз')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        total = aggregates.rebuild(options['place_ids'] or None, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано {total} мест за {time.monotonic() - start:.1f} с'))
@@ -0,0 +1,203 @@
+import bisect
+import csv
+import io
+import math
+import random
+import time
+from typing import Iterable, List, Sequence, Tuple
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from Places.models import Place, Accept, Rating, PlaceImage
+from Places.geo import MSK_LAT_MIN, MSK_LAT_MAX, MSK_LONG_MIN, MSK_LONG_MAX, METERS_PER_LAT_DEGREE, \
+    in_msk_bounds, clamp_to_msk, tile_key
+from Places.utils import chunked
+from Places import aggregates
+
+
+class ZipfSampler:
+    """
+    Семплер ограниченного распределения Ципфа: P(k) ~ 1 / (k + 1)^s, k = 0..n
+    """
+    def __init__(self, n: int, s: float, rnd: random.Random):
+        self.rnd = rnd
+        self.cdf = []
+        total = 0.0
+        for k in range(n + 1):
+            total += 1.0 / (k + 1) ** s
+            self.cdf.append(total)
+        self.total = total
+
+    def sample(self) -> int:
+        return min(bisect.bisect_right(self.cdf, self.rnd.random() * self.total), len(self.cdf) - 1)
+
+
+class ClusteredPoints:
+    """
+    Генератор координат, сгруппированных в кластеры (районы) внутри границ Москвы
+    """
+    def __init__(self, clusters: int, s: float, rnd: random.Random):
+        self.rnd = rnd
+        self.centers = [(rnd.uniform(MSK_LAT_MIN, MSK_LAT_MAX), rnd.uniform(MSK_LONG_MIN, MSK_LONG_MAX),
+                         rnd.uniform(300, 3000)) for _ in range(clusters)]
+        # Районы тоже неравномерны по плотности -- самые популярные получают больше мест
+        self.sampler = ZipfSampler(clusters - 1, s, rnd)
+
+    def sample(self) -> (float, float):
+        lat, long, sigma_m = self.centers[self.sampler.sample()]
+        sigma_lat = sigma_m / METERS_PER_LAT_DEGREE
+        sigma_long = sigma_lat / math.cos(math.radians(lat))
+        for _ in range(5):
+            point = (self.rnd.gauss(lat, sigma_lat), self.rnd.gauss(long, sigma_long))
+            if in_msk_bounds(*point):
+                return point
+        return clamp_to_msk(*point)
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетических мест, подтверждений, рейтингов и картинок для нагрузочных исследований'
+    # Поля, которые генерируются явно; остальные колонки заполняются значениями по умолчанию
+    fields = {
+        Place: ['name', 'latitude', 'longitude', 'tile_key', 'address', 'created_by'],
+        Rating: ['place_id', 'created_by', 'rating'],
+        Accept: ['place_id', 'created_by'],
+        PlaceImage: ['place_id', 'created_by', 'pic_id'],
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places', type=int, default=10000, help='Сколько мест сгенерировать')
+        parser.add_argument('--users', type=int, default=100000, help='Размер пула id пользователей')
+        parser.add_argument('--max-ratings', type=int, default=500, help='Максимум рейтингов на место')
+        parser.add_argument('--max-accepts', type=int, default=300, help='Максимум подтверждений на место')
+        parser.add_argument('--max-images', type=int, default=10, help='Максимум картинок на место')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Показатель s распределения Ципфа')
+        parser.add_argument('--clusters', type=int, default=40, help='Количество кластеров координат')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Размер пачки при вставке')
+        parser.add_argument('--seed', type=int, default=None, help='Сид генератора случайных чисел')
+        parser.add_argument('--no-copy', action='store_true', help='Не использовать COPY на PostgreSQL')
+
+    def handle(self, *args, **options):
+        for opt in ('places', 'users', 'clusters', 'chunk_size'):
+            if options[opt] < 1:
+                raise CommandError(f'--{opt.replace("_", "-")} должен быть положительным')
+        if min(options['max_ratings'], options['max_accepts'], options['max_images']) < 0:
+            raise CommandError('Максимумы дочерних сущностей не могут быть отрицательными')
+        self.rnd = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.now = timezone.now()
+        users = options['users']
+        max_ratings = min(options['max_ratings'], users)
+        max_accepts = min(options['max_accepts'], users)
+
+        points = ClusteredPoints(options['clusters'], options['zipf'], self.rnd)
+        first_id = (Place.objects.with_deleted().aggregate(m=Max('id'))['m'] or 0) + 1
+
+        def places():
+            for i in range(options['places']):
+                lat, long = points.sample()
+                yield {
+                    'name': f'Место {first_id + i}',
+                    'latitude': lat,
+                    'longitude': long,
+                    'tile_key': tile_key(lat, long),
+                    'address': f'Москва, сгенерированный адрес {first_id + i}',
+                    'created_by': self.rnd.randint(1, users),
+                }
+
+        self._insert(Place, places(), 'мест')
+
+        ratings_sampler = ZipfSampler(max_ratings, options['zipf'], self.rnd)
+        accepts_sampler = ZipfSampler(max_accepts, options['zipf'], self.rnd)
+        images_sampler = ZipfSampler(options['max_images'], options['zipf'], self.rnd)
+
+        def new_place_ids():
+            return Place.objects.with_deleted().filter(id__gte=first_id).order_by('id')\
+                .values_list('id', flat=True).iterator(chunk_size=self.chunk_size)
+
+        def ratings():
+            for place_id in new_place_ids():
+                mean = self.rnd.uniform(1.5, 4.8)
+                for user in self._distinct_users(users, ratings_sampler.sample()):
+                    rating = min(max(int(round(self.rnd.gauss(mean, 1))), 0), 5)
+                    yield {'place_id': place_id, 'created_by': user, 'rating': rating}
+
+        def accepts():
+            for place_id in new_place_ids():
+                for user in self._distinct_users(users, accepts_sampler.sample()):
+                    yield {'place_id': place_id, 'created_by': user}
+
+        def images():
+            for place_id in new_place_ids():
+                for _ in range(images_sampler.sample()):
+                    yield {'place_id': place_id, 'created_by': self.rnd.randint(1, users),
+                           'pic_id': self.rnd.randint(1, 10 ** 6)}
+
+        self._insert(Rating, ratings(), 'рейтингов')
+        self._insert(Accept, accepts(), 'подтверждений')
+        self._insert(PlaceImage, images(), 'картинок')
+
+        # Вставка пачками обходит сигналы, поэтому агрегаты новых мест считаются отдельно
+        start, total = time.monotonic(), 0
+        for chunk in chunked(new_place_ids(), self.chunk_size):
+            total += aggregates.rebuild(chunk, chunk_size=self.chunk_size)
+        self.stdout.write(f'Посчитаны агрегаты {total} мест за {time.monotonic() - start:.1f} с')
+
+    def _distinct_users(self, users: int, cnt: int) -> Sequence[int]:
+        return self.rnd.sample(range(1, users + 1), cnt)
+
+    def _insert(self, model, rows: Iterable[dict], title: str):
+        """
+        Потоковая вставка строк пачками -- в памяти никогда не больше одной пачки
+        """
+        start, total = time.monotonic(), 0
+        for chunk in chunked(rows, self.chunk_size):
+            with transaction.atomic():
+                if self.use_copy:
+                    self._copy(model, chunk)
+                else:
+                    model.objects.bulk_create([model(**row) for row in chunk], batch_size=self.chunk_size)
+            total += len(chunk)
+        elapsed = time.monotonic() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        self.stdout.write(f'Вставлено {total} {title} за {elapsed:.1f} с ({rate:.0f} строк/с)')
+
+    def _default_columns(self, model) -> List[Tuple[str, object]]:
+        """
+        Колонки, которых нет в fields, с их значениями для COPY: auto_now/auto_now_add -- текущее время,
+        остальные -- default поля; колонки с default None пропускаются
+        """
+        fields = self.fields[model]
+        columns = []
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.name in fields or field.attname in fields:
+                continue
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                value = self.now.isoformat()
+            elif field.has_default():
+                value = field.get_default()
+                if value is None:
+                    continue
+            else:
+                continue
+            columns.append((field.column, value))
+        return columns
+
+    def _copy(self, model, chunk: List[dict]):
+        """
+        Вставка пачки через COPY ... FROM STDIN (только PostgreSQL)
+        """
+        fields = self.fields[model]
+        defaults = self._default_columns(model)
+        columns = [model._meta.get_field(f).column for f in fields] + [column for column, _ in defaults]
+        default_values = [value for _, value in defaults]
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in chunk:
+            writer.writerow([row[f] for f in fields] + default_values)
+        buf.seek(0)
+        qn = connection.ops.quote_name
+        sql = f'COPY {qn(model._meta.db_table)} ({", ".join(map(qn, columns))}) FROM STDIN WITH (FORMAT csv)'
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, buf)
@@ -1,4 +1,31 @@
-from django.db.models import Manager
+from datetime import timedelta
+from typing import Iterable, Optional, Tuple
+from django.conf import settings
+from django.db import connections, transaction, IntegrityError
+from django.db.models import Manager, Model, QuerySet, Q, Subquery, OuterRef, Avg, Count, FloatField, IntegerField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class PlacesQuerySet(QuerySet):
+    """
+    QuerySet мест
+    """
+    def with_aggregates(self):
+        """
+        Аннотация средним рейтингом (rating_avg) и количеством подтверждений (accepts_count), посчитанными в SQL
+        """
+        rating_model = self.model._meta.get_field('ratings').related_model
+        accept_model = self.model._meta.get_field('accepts').related_model
+        ratings = rating_model._default_manager.filter(place=OuterRef('pk')).order_by().values('place')\
+            .annotate(v=Avg('rating')).values('v')
+        accepts = accept_model._default_manager.filter(place=OuterRef('pk')).order_by().values('place')\
+            .annotate(v=Count('id')).values('v')
+        return self.annotate(
+            rating_avg=Subquery(ratings, output_field=FloatField()),
+            accepts_count=Coalesce(Subquery(accepts, output_field=IntegerField()), 0),
+        )
 
 
 class PlacesManager(Manager):
@@ -6,10 +33,13 @@ class PlacesManager(Manager):
     ORM менеджер для мест
     """
     def get_queryset(self):
-        return super().get_queryset().filter(deleted_flg=False)
+        return PlacesQuerySet(self.model, using=self._db).filter(deleted_flg=False)
 
     def with_deleted(self):
-        return super().get_queryset()
+        return PlacesQuerySet(self.model, using=self._db)
+
+    def with_aggregates(self):
+        return self.get_queryset().with_aggregates()
 
 
 class AcceptsManager(Manager):
@@ -22,6 +52,84 @@ class AcceptsManager(Manager):
     def with_deleted(self):
         return super().get_queryset()
 
+    def insert_or_ignore(self, place_id: int, created_by: int) -> Tuple[Model, bool]:
+        """
+        Вставка подтверждения места пользователем, если живого подтверждения еще нет
+        На PostgreSQL и SQLite это INSERT ... ON CONFLICT DO NOTHING по частичному уникальному индексу accept_live_unique
+        Сигналы post_save не отправляются, агрегаты места обновляет вызывающий код
+        :return: Новое или уже существующее подтверждение и флаг того, что оно новое
+        """
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            row = self._insert_or_ignore_postgresql(connection, place_id, created_by)
+        elif connection.vendor == 'sqlite':
+            row = self._insert_or_ignore_sqlite(connection, place_id, created_by)
+        else:
+            return self._insert_or_ignore_orm(place_id, created_by)
+        if row is None:
+            # Конфликтующая строка закоммичена уже после снимка нашего запроса -- читаем ее отдельно
+            return self.get_queryset().get(place_id=place_id, created_by=created_by), False
+        accept_id, created_dt, inserted = row
+        if isinstance(created_dt, str):
+            created_dt = parse_datetime(created_dt)
+        if timezone.is_naive(created_dt):
+            created_dt = timezone.make_aware(created_dt, timezone.utc)
+        instance = self.model(id=accept_id, place_id=place_id, created_by=created_by, created_dt=created_dt,
+                              deleted_flg=False)
+        instance._state.adding, instance._state.db = False, self.db
+        return instance, bool(inserted)
+
+    def _insert_or_ignore_postgresql(self, connection, place_id: int, created_by: int):
+        # Одним запросом: вставка, а при конфликте -- уже существующая живая строка
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = f"""
+            WITH ins AS (
+                INSERT INTO {table} (created_by, place_id, created_dt, deleted_flg)
+                VALUES (%(created_by)s, %(place_id)s, %(now)s, false)
+                ON CONFLICT (place_id, created_by) WHERE deleted_flg = false DO NOTHING
+                RETURNING id, created_dt
+            )
+            SELECT id, created_dt, true FROM ins
+            UNION ALL
+            SELECT id, created_dt, false FROM {table}
+            WHERE place_id = %(place_id)s AND created_by = %(created_by)s AND deleted_flg = false
+                AND NOT EXISTS (SELECT 1 FROM ins)
+        """
+        params = {'place_id': place_id, 'created_by': created_by,
+                  'now': connection.ops.adapt_datetimefield_value(timezone.now())}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    def _insert_or_ignore_sqlite(self, connection, place_id: int, created_by: int):
+        # RETURNING при DO NOTHING ничего не отдает, тогда существующая строка читается вторым запросом
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {table} (created_by, place_id, created_dt, deleted_flg) VALUES (%s, %s, %s, 0)
+                ON CONFLICT (place_id, created_by) WHERE deleted_flg = 0 DO NOTHING
+                RETURNING id, created_dt
+            """, [created_by, place_id, now])
+            row = cursor.fetchone()
+            if row is not None:
+                return row + (True, )
+            cursor.execute(f'SELECT id, created_dt FROM {table} WHERE place_id = %s AND created_by = %s '
+                           f'AND deleted_flg = 0', [place_id, created_by])
+            row = cursor.fetchone()
+            return row + (False, ) if row is not None else None
+
+    def _insert_or_ignore_orm(self, place_id: int, created_by: int):
+        # Запасной вариант для остальных СУБД: вставка без сигналов, при нарушении индекса -- чтение существующей
+        try:
+            with transaction.atomic(using=self.db):
+                instance = self.bulk_create([self.model(place_id=place_id, created_by=created_by)])[0]
+            if instance.pk is None:
+                instance = self.get_queryset().get(place_id=place_id, created_by=created_by)
+            return instance, True
+        except IntegrityError:
+            return self.get_queryset().get(place_id=place_id, created_by=created_by), False
+
 
 class RatingsManager(Manager):
     """
@@ -33,6 +141,101 @@ class RatingsManager(Manager):
     def with_deleted(self):
         return super().get_queryset()
 
+    def upsert(self, place_id: int, created_by: int, rating: int) -> Tuple[Model, Optional[int], bool]:
+        """
+        Атомарная вставка или обновление живой оценки пользователя на место с записью в историю оценок
+        На PostgreSQL и SQLite это INSERT ... ON CONFLICT по частичному уникальному индексу rating_live_unique
+        Сигналы post_save не отправляются, агрегаты места обновляет вызывающий код
+        :return: Оценка, предыдущее значение оценки (None, если оценки не было или его не удалось узнать)
+            и флаг того, что оценка новая
+        """
+        connection = connections[self.db]
+        if connection.vendor == 'postgresql':
+            rating_id, created_dt, old_rating, inserted = self._upsert_postgresql(connection, place_id, created_by,
+                                                                                  rating)
+        elif connection.vendor == 'sqlite':
+            rating_id, created_dt, old_rating, inserted = self._upsert_sqlite(connection, place_id, created_by, rating)
+        else:
+            return self._upsert_orm(place_id, created_by, rating)
+        instance = self.model(id=rating_id, place_id=place_id, created_by=created_by, rating=rating,
+                              created_dt=created_dt, updated_dt=timezone.now(), deleted_flg=False)
+        instance._state.adding, instance._state.db = False, self.db
+        return instance, old_rating, inserted
+
+    @property
+    def history_model(self):
+        return self.model._meta.apps.get_model(self.model._meta.app_label, 'RatingHistory')
+
+    def _upsert_postgresql(self, connection, place_id: int, created_by: int, rating: int):
+        # Одним запросом: старое значение, вставка или обновление и запись в историю.
+        # xmax = 0 только у только что вставленной строки
+        qn = connection.ops.quote_name
+        table, history = qn(self.model._meta.db_table), qn(self.history_model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        sql = f"""
+            WITH old AS (
+                SELECT rating FROM {table}
+                WHERE place_id = %(place_id)s AND created_by = %(created_by)s AND deleted_flg = false
+                FOR UPDATE
+            ), up AS (
+                INSERT INTO {table} (created_by, place_id, rating, created_dt, updated_dt, deleted_flg)
+                VALUES (%(created_by)s, %(place_id)s, %(rating)s, %(now)s, %(now)s, false)
+                ON CONFLICT (place_id, created_by) WHERE deleted_flg = false
+                DO UPDATE SET rating = EXCLUDED.rating, updated_dt = EXCLUDED.updated_dt
+                RETURNING id, created_dt, (xmax = 0) AS inserted
+            ), hist AS (
+                INSERT INTO {history} (created_by, place_id, rating, old_rating, created_dt)
+                SELECT %(created_by)s, %(place_id)s, %(rating)s, (SELECT rating FROM old), %(now)s FROM up
+            )
+            SELECT up.id, up.created_dt, (SELECT rating FROM old), up.inserted FROM up
+        """
+        params = {'place_id': place_id, 'created_by': created_by, 'rating': rating, 'now': now}
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    def _upsert_sqlite(self, connection, place_id: int, created_by: int, rating: int):
+        # SQLite и так пропускает только одного писателя, поэтому старое значение читается отдельно в той же транзакции
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            cursor.execute(f'SELECT rating FROM {table} WHERE place_id = %s AND created_by = %s AND deleted_flg = 0',
+                           [place_id, created_by])
+            row = cursor.fetchone()
+            old_rating = row[0] if row else None
+            cursor.execute(f"""
+                INSERT INTO {table} (created_by, place_id, rating, created_dt, updated_dt, deleted_flg)
+                VALUES (%s, %s, %s, %s, %s, 0)
+                ON CONFLICT (place_id, created_by) WHERE deleted_flg = 0
+                DO UPDATE SET rating = excluded.rating, updated_dt = excluded.updated_dt
+                RETURNING id, created_dt
+            """, [created_by, place_id, rating, now, now])
+            rating_id, created_dt = cursor.fetchone()
+            self.history_model.objects.using(self.db).bulk_create([self.history_model(
+                created_by=created_by, place_id=place_id, rating=rating, old_rating=old_rating)])
+        if isinstance(created_dt, str):
+            created_dt = parse_datetime(created_dt)
+        if timezone.is_naive(created_dt):
+            created_dt = timezone.make_aware(created_dt, timezone.utc)
+        return rating_id, created_dt, old_rating, row is None
+
+    def _upsert_orm(self, place_id: int, created_by: int, rating: int):
+        # Запасной вариант для остальных СУБД: блокировка живой оценки и обновление или вставка без сигналов
+        with transaction.atomic(using=self.db):
+            instance = self.get_queryset().select_for_update().filter(place_id=place_id, created_by=created_by)\
+                .first()
+            old_rating = instance.rating if instance is not None else None
+            if instance is None:
+                instance = self.bulk_create([self.model(place_id=place_id, created_by=created_by, rating=rating)])[0]
+                if instance.pk is None:
+                    instance = self.get_queryset().get(place_id=place_id, created_by=created_by)
+            else:
+                instance.rating, instance.updated_dt = rating, timezone.now()
+                self.filter(pk=instance.pk).update(rating=rating, updated_dt=instance.updated_dt)
+            self.history_model.objects.using(self.db).bulk_create([self.history_model(
+                created_by=created_by, place_id=place_id, rating=rating, old_rating=old_rating)])
+        return instance, old_rating, old_rating is None
+
 
 class PlaceImagesManager(Manager):
     """
@@ -43,3 +246,55 @@ class PlaceImagesManager(Manager):
 
     def with_deleted(self):
         return super().get_queryset()
+
+
+class PlaceChangesManager(Manager):
+    """
+    ORM менеджер для журнала изменений мест
+    """
+    def record(self, place_id: int, kind: str) -> Model:
+        return self.create(place_id=place_id, kind=kind)
+
+    def record_many(self, place_ids: Iterable[int], kind: str):
+        self.bulk_create([self.model(place_id=place_id, kind=kind) for place_id in place_ids])
+
+    def settled(self):
+        """
+        Изменения старше PLACES_CHANGES_SETTLE_SECONDS: id выдаются при вставке, а видны после коммита, поэтому
+        более свежие записи могут появиться с id меньше уже отданного курсора
+        """
+        return self.filter(created_dt__lte=timezone.now() - timedelta(seconds=settings.PLACES_CHANGES_SETTLE_SECONDS))
+
+
+class PendingRatingChangesManager(Manager):
+    """
+    ORM менеджер для отложенных изменений рейтинга
+    """
+    MAX_WINDOWS = 10
+
+    def add(self, place_id: int, created_by: int, old_rating: Optional[int], rating: int) -> bool:
+        """
+        Новое окно с учтенной оценкой old_rating или замена последней оценки в уже открытом окне
+        :return: Открыто ли новое окно
+        """
+        now = timezone.now()
+        pending = self.filter(place_id=place_id, created_by=created_by)
+        if pending.update(rating=rating, updated_dt=now):
+            return False
+        try:
+            with transaction.atomic():
+                self.create(place_id=place_id, created_by=created_by, old_rating=old_rating, rating=rating,
+                            updated_dt=now)
+            return True
+        except IntegrityError:
+            pending.update(rating=rating, updated_dt=now)
+            return False
+
+    def due(self):
+        """
+        Окна, в которых оценка не менялась дольше PLACES_RATING_COALESCE_SECONDS, и окна старше
+        MAX_WINDOWS таких интервалов, чтобы постоянные переоценки не откладывали учет бесконечно
+        """
+        window = timedelta(seconds=settings.PLACES_RATING_COALESCE_SECONDS)
+        now = timezone.now()
+        return self.filter(Q(updated_dt__lte=now - window) | Q(created_dt__lte=now - window * self.MAX_WINDOWS))
@@ -0,0 +1,20 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0005_auto_20200524_1118'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='updated_dt',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
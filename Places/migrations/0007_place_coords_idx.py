@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0006_place_updated_dt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['latitude', 'longitude'], name='place_coords_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0007_place_coords_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceStats',
+            fields=[
+                ('place', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='Places.Place')),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_cnt', models.PositiveIntegerField(default=0)),
+                ('rating_avg', models.FloatField(default=None, null=True)),
+                ('accepts_cnt', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField(db_index=True)),
+                ('trend_key', models.FloatField(db_index=True, default=None, null=True)),
+                ('cell_row', models.IntegerField()),
+                ('cell_col', models.IntegerField()),
+                ('updated_dt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='placestats',
+            index=models.Index(fields=['cell_row', 'cell_col'], name='place_stats_cell_idx'),
+        ),
+    ]
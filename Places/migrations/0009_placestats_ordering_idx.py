@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0008_placestats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='placestats',
+            name='accepts_cnt',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='placestats',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0010_dedupe_live_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.PositiveIntegerField()),
+                ('rating', models.PositiveIntegerField()),
+                ('old_rating', models.PositiveIntegerField(default=None, null=True)),
+                ('created_dt', models.DateTimeField(auto_now_add=True)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings_history', to='Places.Place')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ratinghistory',
+            index=models.Index(fields=['place', 'created_by'], name='rating_history_user_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_flg=False), fields=('place', 'created_by'), name='rating_live_unique'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:00
+
+from django.db import migrations, transaction
+from django.db.models import Count, Min
+
+CHUNK_SIZE = 1000
+
+
+def dedupe_live_accepts(apps, schema_editor):
+    """
+    Мягкое удаление всех живых подтверждений пользователя на место, кроме первого, пачками по CHUNK_SIZE групп
+    Агрегаты PlaceStats после этого нужно пересчитать через manage.py refresh_place_stats
+    """
+    Accept = apps.get_model('Places', 'Accept')
+    live = Accept.objects.using(schema_editor.connection.alias).filter(deleted_flg=False)
+    while True:
+        groups = list(live.values('place_id', 'created_by').annotate(c=Count('id'), first_id=Min('id'))
+                      .filter(c__gt=1).order_by()[:CHUNK_SIZE])
+        if not groups:
+            return
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for group in groups:
+                live.filter(place_id=group['place_id'], created_by=group['created_by'], id__gt=group['first_id'])\
+                    .update(deleted_flg=True)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('Places', '0011_rating_live_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_live_accepts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0012_dedupe_live_accepts'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='accept',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_flg=False), fields=('place', 'created_by'), name='accept_live_unique'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.0.4 on 2026-10-19 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0013_accept_live_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='placestats',
+            name='images_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='last_activity_dt',
+            field=models.DateTimeField(db_index=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_0_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_1_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_2_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_3_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_4_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='placestats',
+            name='rating_5_cnt',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
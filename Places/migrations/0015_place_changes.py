@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0014_placestats_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('created', 'Место создано'), ('edited', 'Место изменено'), ('deleted', 'Место удалено'), ('rating', 'Изменился средний рейтинг'), ('accept', 'Изменился уровень проверенности')], max_length=16)),
+                ('created_dt', models.DateTimeField(auto_now_add=True)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='Places.Place')),
+            ],
+        ),
+    ]
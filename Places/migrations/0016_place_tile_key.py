@@ -0,0 +1,42 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:14
+
+from django.db import migrations, models, transaction
+from Places.geo import tile_key
+
+CHUNK_SIZE = 1000
+
+
+def fill_tile_keys(apps, schema_editor):
+    """
+    Ключи тайлов существующих мест пачками по CHUNK_SIZE
+    """
+    Place = apps.get_model('Places', 'Place')
+    places = Place.objects.using(schema_editor.connection.alias)
+    last_id = 0
+    while True:
+        chunk = list(places.filter(id__gt=last_id, tile_key__isnull=True).order_by('id')
+                     .only('id', 'latitude', 'longitude')[:CHUNK_SIZE])
+        if not chunk:
+            return
+        for place in chunk:
+            place.tile_key = tile_key(place.latitude, place.longitude)
+        with transaction.atomic(using=schema_editor.connection.alias):
+            places.bulk_update(chunk, ['tile_key'])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('Places', '0015_place_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='tile_key',
+            field=models.BigIntegerField(db_index=True, default=None, null=True),
+        ),
+        migrations.RunPython(fill_tile_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0016_place_tile_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRatingChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.PositiveIntegerField()),
+                ('old_rating', models.PositiveIntegerField(default=None, null=True)),
+                ('rating', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField(auto_now_add=True)),
+                ('updated_dt', models.DateTimeField(db_index=True)),
+                ('place', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_rating_changes', to='Places.Place')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pendingratingchange',
+            constraint=models.UniqueConstraint(fields=('place', 'created_by'), name='pending_rating_unique'),
+        ),
+    ]
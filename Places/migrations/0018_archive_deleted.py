@@ -0,0 +1,173 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:24
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+# Колонки представлений *_with_archive: живая таблица, архивная таблица, общие колонки
+ARCHIVE_VIEWS = [
+    ('Places_accept', 'Places_archivedaccept', 'Places_accept_with_archive',
+     ['id', 'created_by', 'place_id', 'created_dt', 'deleted_flg', 'deleted_dt']),
+    ('Places_rating', 'Places_archivedrating', 'Places_rating_with_archive',
+     ['id', 'created_by', 'place_id', 'rating', 'created_dt', 'updated_dt', 'deleted_flg', 'deleted_dt']),
+    ('Places_placeimage', 'Places_archivedplaceimage', 'Places_placeimage_with_archive',
+     ['id', 'created_by', 'place_id', 'pic_id', 'created_dt', 'deleted_flg', 'deleted_dt']),
+]
+
+
+def fill_deleted_dt(apps, schema_editor):
+    """
+    Время удаления уже удаленных строк неизвестно: срок хранения для них отсчитывается от миграции
+    """
+    now = timezone.now()
+    for model in ('Accept', 'Rating', 'PlaceImage'):
+        apps.get_model('Places', model).objects.using(schema_editor.connection.alias)\
+            .filter(deleted_flg=True, deleted_dt__isnull=True).update(deleted_dt=now)
+
+
+def create_views_sql() -> list:
+    sql = []
+    for live, archive, view, columns in ARCHIVE_VIEWS:
+        columns = ', '.join(f'"{column}"' for column in columns)
+        sql.append(f'CREATE VIEW "{view}" AS '
+                   f'SELECT {columns} FROM "{live}" UNION ALL SELECT {columns} FROM "{archive}"')
+    return sql
+
+
+def drop_views_sql() -> list:
+    return [f'DROP VIEW "{view}"' for _, _, view, _ in ARCHIVE_VIEWS]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0017_pending_rating_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AcceptWithArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField()),
+                ('deleted_dt', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'Places_accept_with_archive',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PlaceImageWithArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.PositiveIntegerField()),
+                ('pic_id', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField()),
+                ('deleted_dt', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'Places_placeimage_with_archive',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RatingWithArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_by', models.PositiveIntegerField()),
+                ('rating', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('updated_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField()),
+                ('deleted_dt', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'Places_rating_with_archive',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAccept',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_by', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField(default=True)),
+                ('deleted_dt', models.DateTimeField(default=None, null=True)),
+                ('archived_dt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPlaceImage',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_by', models.PositiveIntegerField()),
+                ('pic_id', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField(default=True)),
+                ('deleted_dt', models.DateTimeField(default=None, null=True)),
+                ('archived_dt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedRating',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created_by', models.PositiveIntegerField()),
+                ('rating', models.PositiveIntegerField()),
+                ('created_dt', models.DateTimeField()),
+                ('updated_dt', models.DateTimeField()),
+                ('deleted_flg', models.BooleanField(default=True)),
+                ('deleted_dt', models.DateTimeField(default=None, null=True)),
+                ('archived_dt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='accept',
+            name='deleted_dt',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='placeimage',
+            name='deleted_dt',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='deleted_dt',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='accept',
+            index=models.Index(condition=models.Q(deleted_flg=True), fields=['deleted_dt'], name='accept_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='placeimage',
+            index=models.Index(condition=models.Q(deleted_flg=True), fields=['deleted_dt'], name='place_image_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(condition=models.Q(deleted_flg=True), fields=['deleted_dt'], name='rating_deleted_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedrating',
+            name='place',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Places.Place'),
+        ),
+        migrations.AddField(
+            model_name='archivedplaceimage',
+            name='place',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Places.Place'),
+        ),
+        migrations.AddField(
+            model_name='archivedaccept',
+            name='place',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Places.Place'),
+        ),
+        migrations.RunPython(fill_deleted_dt, migrations.RunPython.noop),
+        migrations.RunSQL(create_views_sql(), drop_views_sql()),
+    ]
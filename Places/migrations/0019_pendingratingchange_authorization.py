@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0018_archive_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingratingchange',
+            name='authorization',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
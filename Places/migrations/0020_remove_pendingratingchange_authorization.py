@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-19 13:50
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Places', '0019_pendingratingchange_authorization'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pendingratingchange',
+            name='authorization',
+        ),
+    ]
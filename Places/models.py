@@ -1,6 +1,44 @@
 from django.db import models
-from django.db.models import CheckConstraint, Q, Avg
-from Places.managers import PlaceImagesManager, PlacesManager, RatingsManager, AcceptsManager
+from django.utils import timezone
+from django.db.models import CheckConstraint, UniqueConstraint, Q, Avg
+from Places.managers import PlaceImagesManager, PlacesManager, RatingsManager, AcceptsManager, PlaceChangesManager, \
+    PendingRatingChangesManager
+from Places.geo import MSK_LAT_MIN, MSK_LAT_MAX, MSK_LONG_MIN, MSK_LONG_MAX, tile_key
+
+
+# Уровни проверенности места: (код, минимальное кол-во подтверждений, название)
+ACCEPT_TYPES = [
+    ('unchecked', 0, 'Непроверенное место'),
+    ('weakly_checked', 50, 'Слабо проверенное место'),
+    ('checked_by_many', 100, 'Проверенное многими место'),
+    ('checked', 200, 'Проверенное место'),
+]
+
+
+# Допустимые значения оценки места
+RATING_VALUES = range(0, 6)
+
+
+def accept_type_by_cnt(cnt: int) -> str:
+    """
+    Уровень проверенности места по количеству подтверждений
+    """
+    name = ACCEPT_TYPES[0][2]
+    for _, min_cnt, type_name in ACCEPT_TYPES:
+        if cnt >= min_cnt:
+            name = type_name
+    return name
+
+
+def accepts_cnt_range(accept_type: str) -> (int, int):
+    """
+    Диапазон количества подтверждений [от, до) для уровня проверенности, заданного кодом или названием
+    Для последнего уровня верхняя граница -- None
+    """
+    for i, (code, min_cnt, type_name) in enumerate(ACCEPT_TYPES):
+        if accept_type in (code, type_name):
+            return min_cnt, ACCEPT_TYPES[i + 1][1] if i + 1 < len(ACCEPT_TYPES) else None
+    raise KeyError(accept_type)
 
 
 class Place(models.Model):
@@ -13,43 +51,58 @@ class Place(models.Model):
     address = models.CharField(max_length=512, null=False, blank=False)
     created_by = models.PositiveIntegerField(null=False, blank=False)
     created_dt = models.DateTimeField(auto_now_add=True)
+    updated_dt = models.DateTimeField(auto_now=True, db_index=True)
     deleted_flg = models.BooleanField(default=False)
+    # Ключ тайла по координатам (Places.geo.tile_key) для выборки мест тайла карты по диапазону
+    tile_key = models.BigIntegerField(null=True, default=None, db_index=True)
 
     objects = PlacesManager()
 
+    def save(self, *args, **kwargs):
+        old_key, self.tile_key = self.tile_key, tile_key(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = list(update_fields) + ['tile_key']
+        super().save(*args, **kwargs)
+        if old_key is not None and old_key != self.tile_key:
+            # Место переехало: тайлы со старыми координатами тоже устарели
+            from Places import tiles
+            tiles.invalidate(old_key)
+
     @property
     def rating(self) -> float:
+        # Место из queryset с with_aggregates() уже содержит средний рейтинг
+        if hasattr(self, 'rating_avg'):
+            return self.rating_avg
         rating = self.ratings.filter(deleted_flg=False).aggregate(Avg('rating')).values()
         rating = list(rating)
         return 0 if len(rating) == 0 else rating[0]
 
     @property
     def accepts_cnt(self):
+        if hasattr(self, 'accepts_count'):
+            return self.accepts_count
         return self.accepts.count()
 
     @property
     def accept_type(self):
-        cnt = self.accepts_cnt
-        if cnt < 50:
-            return 'Непроверенное место'
-        elif 50 <= cnt < 100:
-            return 'Слабо проверенное место'
-        elif 100 <= cnt < 200:
-            return 'Проверенное многими место'
-        else:
-            return 'Проверенное место'
+        return accept_type_by_cnt(self.accepts_cnt)
 
     def soft_delete(self):
         self.deleted_flg = True
-        self.save(update_fields=['deleted_flg'])
+        self.save(update_fields=['deleted_flg', 'updated_dt'])
 
     def __str__(self):
         return f'Place {self.name}'
 
     class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='place_coords_idx'),
+        ]
         constraints = [
-            CheckConstraint(check=Q(latitude__gte=55.515174) & Q(latitude__lte=56.106229), name='lat_msk_constraint'),
-            CheckConstraint(check=Q(longitude__gte=36.994695) & Q(longitude__lte=37.956703), name='long_msk_constraint'),
+            CheckConstraint(check=Q(latitude__gte=MSK_LAT_MIN) & Q(latitude__lte=MSK_LAT_MAX), name='lat_msk_constraint'),
+            CheckConstraint(check=Q(longitude__gte=MSK_LONG_MIN) & Q(longitude__lte=MSK_LONG_MAX),
+                            name='long_msk_constraint'),
         ]
 
 
@@ -61,12 +114,25 @@ class Accept(models.Model):
     place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='accepts')
     created_dt = models.DateTimeField(auto_now_add=True)
     deleted_flg = models.BooleanField(default=False)
+    deleted_dt = models.DateTimeField(null=True, default=None)
 
     objects = AcceptsManager()
 
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['place', 'created_by'], condition=Q(deleted_flg=False),
+                             name='accept_live_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['deleted_dt'], condition=Q(deleted_flg=True), name='accept_deleted_idx'),
+        ]
+
     def soft_delete(self):
-        self.deleted_flg = True
-        self.save(update_fields=['deleted_flg'])
+        # Повторное удаление не должно второй раз вычитаться из агрегатов (см. Places.signals)
+        if self.deleted_flg:
+            return
+        self.deleted_flg, self.deleted_dt = True, timezone.now()
+        self.save(update_fields=['deleted_flg', 'deleted_dt'])
 
     def __str__(self):
         return f'Accept({self.id}) by {self.created_by}, on place {self.place.id}'
@@ -82,12 +148,16 @@ class Rating(models.Model):
     created_dt = models.DateTimeField(auto_now_add=True)
     updated_dt = models.DateTimeField(auto_now_add=True)
     deleted_flg = models.BooleanField(default=False)
+    deleted_dt = models.DateTimeField(null=True, default=None)
 
     objects = RatingsManager()
 
     def soft_delete(self):
-        self.deleted_flg = True
-        self.save(update_fields=['deleted_flg'])
+        # Повторное удаление не должно второй раз вычитаться из агрегатов (см. Places.signals)
+        if self.deleted_flg:
+            return
+        self.deleted_flg, self.deleted_dt = True, timezone.now()
+        self.save(update_fields=['deleted_flg', 'deleted_dt'])
 
     def __str__(self):
         return f'Rating({self.id}) {self.rating} on place {self.place}'
@@ -95,6 +165,53 @@ class Rating(models.Model):
     class Meta:
         constraints = [
             CheckConstraint(check=Q(rating__gte=0) & Q(rating__lte=5), name='rating_number_constraint'),
+            UniqueConstraint(fields=['place', 'created_by'], condition=Q(deleted_flg=False),
+                             name='rating_live_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['deleted_dt'], condition=Q(deleted_flg=True), name='rating_deleted_idx'),
+        ]
+
+
+class RatingHistory(models.Model):
+    """
+    Только дописываемая история оценок места пользователем
+    """
+    created_by = models.PositiveIntegerField(null=False, blank=False)
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='ratings_history')
+    rating = models.PositiveIntegerField(null=False, blank=False)
+    old_rating = models.PositiveIntegerField(null=True, default=None)
+    created_dt = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'RatingHistory({self.id}) {self.old_rating} -> {self.rating} on place {self.place_id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['place', 'created_by'], name='rating_history_user_idx'),
+        ]
+
+
+class PendingRatingChange(models.Model):
+    """
+    Окно склейки частых переоценок места пользователем (PLACES_RATING_COALESCE_SECONDS): оценка, уже учтенная
+    в агрегатах, и последняя оценка, которая будет учтена при закрытии окна
+    """
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='pending_rating_changes')
+    created_by = models.PositiveIntegerField(null=False, blank=False)
+    old_rating = models.PositiveIntegerField(null=True, default=None)
+    rating = models.PositiveIntegerField(null=False, blank=False)
+    created_dt = models.DateTimeField(auto_now_add=True)
+    updated_dt = models.DateTimeField(db_index=True)
+
+    objects = PendingRatingChangesManager()
+
+    def __str__(self):
+        return f'PendingRatingChange({self.id}) {self.old_rating} -> {self.rating} on place {self.place_id}'
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['place', 'created_by'], name='pending_rating_unique'),
         ]
 
 
@@ -107,12 +224,187 @@ class PlaceImage(models.Model):
     pic_id = models.PositiveIntegerField(null=False)
     created_dt = models.DateTimeField(auto_now_add=True)
     deleted_flg = models.BooleanField(default=False)
+    deleted_dt = models.DateTimeField(null=True, default=None)
 
     objects = PlaceImagesManager()
 
     def soft_delete(self):
-        self.deleted_flg = True
-        self.save(update_fields=['deleted_flg'])
+        # Повторное удаление не должно второй раз вычитаться из агрегатов (см. Places.signals)
+        if self.deleted_flg:
+            return
+        self.deleted_flg, self.deleted_dt = True, timezone.now()
+        self.save(update_fields=['deleted_flg', 'deleted_dt'])
 
     def __str__(self):
         return f'Image({self.id}) of place {self.place}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_dt'], condition=Q(deleted_flg=True), name='place_image_deleted_idx'),
+        ]
+
+
+class PlaceStats(models.Model):
+    """
+    Инкрементально поддерживаемые агрегаты места для топов, трендов и аналитики
+    """
+    place = models.OneToOneField(Place, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_cnt = models.PositiveIntegerField(default=0)
+    rating_avg = models.FloatField(null=True, default=None, db_index=True)
+    accepts_cnt = models.PositiveIntegerField(default=0, db_index=True)
+    # Байесовская оценка рейтинга
+    score = models.FloatField(db_index=True)
+    # Логарифм суммы весов событий с прямым затуханием (forward decay), порядок по нему не зависит от текущего времени
+    trend_key = models.FloatField(null=True, default=None, db_index=True)
+    # Гистограмма живых оценок
+    rating_0_cnt = models.PositiveIntegerField(default=0)
+    rating_1_cnt = models.PositiveIntegerField(default=0)
+    rating_2_cnt = models.PositiveIntegerField(default=0)
+    rating_3_cnt = models.PositiveIntegerField(default=0)
+    rating_4_cnt = models.PositiveIntegerField(default=0)
+    rating_5_cnt = models.PositiveIntegerField(default=0)
+    images_cnt = models.PositiveIntegerField(default=0)
+    # Время последней оценки, подтверждения или картинки
+    last_activity_dt = models.DateTimeField(null=True, default=None, db_index=True)
+    cell_row = models.IntegerField()
+    cell_col = models.IntegerField()
+    updated_dt = models.DateTimeField(auto_now=True)
+
+    @property
+    def histogram(self) -> list:
+        return [getattr(self, f'rating_{value}_cnt') for value in RATING_VALUES]
+
+    @property
+    def accept_type(self) -> str:
+        return accept_type_by_cnt(self.accepts_cnt)
+
+    def __str__(self):
+        return f'Stats of place {self.place_id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell_row', 'cell_col'], name='place_stats_cell_idx'),
+        ]
+
+
+class PlaceChange(models.Model):
+    """
+    Журнал изменений мест для инкрементальной синхронизации клиентов, id записи -- курсор ленты изменений
+    """
+    CREATED = 'created'
+    EDITED = 'edited'
+    DELETED = 'deleted'
+    RATING = 'rating'
+    ACCEPT = 'accept'
+    KINDS = [
+        (CREATED, 'Место создано'),
+        (EDITED, 'Место изменено'),
+        (DELETED, 'Место удалено'),
+        (RATING, 'Изменился средний рейтинг'),
+        (ACCEPT, 'Изменился уровень проверенности'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='changes')
+    kind = models.CharField(max_length=16, choices=KINDS)
+    created_dt = models.DateTimeField(auto_now_add=True)
+
+    objects = PlaceChangesManager()
+
+    def __str__(self):
+        return f'PlaceChange({self.id}) {self.kind} of place {self.place_id}'
+
+
+# Архив мягко удаленных строк (manage.py compact_deleted): строки переносятся с исходными id, поэтому в представлениях
+# *_with_archive, объединяющих живые и архивные таблицы, id остаются уникальными
+
+
+class ArchivedAccept(models.Model):
+    """
+    Подтверждение, перенесенное в архив
+    """
+    id = models.IntegerField(primary_key=True)
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='+')
+    created_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField(default=True)
+    deleted_dt = models.DateTimeField(null=True, default=None)
+    archived_dt = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedRating(models.Model):
+    """
+    Оценка, перенесенная в архив
+    """
+    id = models.IntegerField(primary_key=True)
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='+')
+    rating = models.PositiveIntegerField()
+    created_dt = models.DateTimeField()
+    updated_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField(default=True)
+    deleted_dt = models.DateTimeField(null=True, default=None)
+    archived_dt = models.DateTimeField(auto_now_add=True)
+
+
+class ArchivedPlaceImage(models.Model):
+    """
+    Картинка места, перенесенная в архив
+    """
+    id = models.IntegerField(primary_key=True)
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.CASCADE, related_name='+')
+    pic_id = models.PositiveIntegerField()
+    created_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField(default=True)
+    deleted_dt = models.DateTimeField(null=True, default=None)
+    archived_dt = models.DateTimeField(auto_now_add=True)
+
+
+class AcceptWithArchive(models.Model):
+    """
+    Подтверждения вместе с архивными, только для чтения
+    """
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    created_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField()
+    deleted_dt = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'Places_accept_with_archive'
+
+
+class RatingWithArchive(models.Model):
+    """
+    Оценки вместе с архивными, только для чтения
+    """
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    rating = models.PositiveIntegerField()
+    created_dt = models.DateTimeField()
+    updated_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField()
+    deleted_dt = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'Places_rating_with_archive'
+
+
+class PlaceImageWithArchive(models.Model):
+    """
+    Картинки мест вместе с архивными, только для чтения
+    """
+    created_by = models.PositiveIntegerField()
+    place = models.ForeignKey(Place, on_delete=models.DO_NOTHING, related_name='+', db_constraint=False)
+    pic_id = models.PositiveIntegerField()
+    created_dt = models.DateTimeField()
+    deleted_flg = models.BooleanField()
+    deleted_dt = models.DateTimeField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'Places_placeimage_with_archive'
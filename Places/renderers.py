@@ -0,0 +1,141 @@
+import csv
+import json
+import struct
+from importlib import import_module
+from importlib.util import find_spec
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# MessagePack нужен только слоям карты в этом формате: модуль загружается при первом рендеринге
+HAS_MSGPACK = find_spec('msgpack') is not None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class EchoBuffer:
+    """
+    Псевдо-буфер для csv.writer, который просто отдает записанную строку
+    """
+    def write(self, value):
+        return value
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Рендерер в NDJSON -- по JSON-объекту на строку
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.render_row(row) for row in rows).encode(self.charset)
+
+    @staticmethod
+    def render_row(row: dict) -> str:
+        return json.dumps(row, ensure_ascii=False, default=str) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Рендерер в CSV, первая строка -- заголовок
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        header = list(rows[0].keys())
+        lines = [self.render_row(header)] + [self.render_row([row.get(k) for k in header]) for row in rows]
+        return ''.join(lines).encode(self.charset)
+
+    @staticmethod
+    def render_row(values: list) -> str:
+        return csv.writer(EchoBuffer()).writerow(values)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson, если он установлен; без orjson и для ответов с отступами -- обычный JSONRenderer
+    Типы, которых orjson не знает (Decimal, ленивые строки и т.п.), кодируются как в DRF
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default)
+
+
+class PinsRenderer(BaseRenderer):
+    """
+    Рендерер точек карты в упакованный little-endian массив записей по 13 байт:
+    id uint32, широта float32, долгота float32, рейтинг uint8 (средний рейтинг * 10, 255 -- оценок нет)
+    На вход -- строки (id, широта, долгота, рейтинг); ошибки и прочие ответы отдаются JSON
+    """
+    media_type = 'application/x-places-pins'
+    format = 'pins'
+    charset = None
+    render_style = 'binary'
+    record = struct.Struct('<IffB')
+    no_rating = 255
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response', None)
+        if not isinstance(data, list) or (response is not None and response.exception):
+            return render_as_json(data, renderer_context)
+        return self.pack_rows(data)
+
+    @classmethod
+    def pack_rows(cls, rows: list) -> bytes:
+        buf = bytearray(cls.record.size * len(rows))
+        for i, (place_id, latitude, longitude, rating) in enumerate(rows):
+            cls.record.pack_into(buf, i * cls.record.size, place_id, latitude, longitude,
+                                 cls.no_rating if rating is None else round(rating * 10))
+        return bytes(buf)
+
+    @classmethod
+    def unpack(cls, payload: bytes) -> list:
+        return [(place_id, latitude, longitude, None if rating == cls.no_rating else rating / 10)
+                for place_id, latitude, longitude, rating in cls.record.iter_unpack(payload)]
+
+
+class MsgPackPinsRenderer(BaseRenderer):
+    """
+    Рендерер точек карты в MessagePack: массив [id, широта, долгота, рейтинг] на место; ошибки отдаются JSON
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        response = (renderer_context or {}).get('response', None)
+        if response is not None and response.exception:
+            return render_as_json(data, renderer_context)
+        return import_module('msgpack').packb(data, use_bin_type=True)
+
+
+def render_as_json(data, renderer_context=None) -> bytes:
+    """
+    JSON вместо бинарного формата для ответов, которые не являются списком точек (например, ошибок)
+    """
+    response = (renderer_context or {}).get('response', None)
+    if response is not None:
+        response['Content-Type'] = 'application/json'
+    return JSONRenderer().render(data, renderer_context=renderer_context)
+
+
+# Рендереры слоев точек карты: MessagePack -- только если установлен msgpack
+PIN_RENDERERS = (PinsRenderer, ) + ((MsgPackPinsRenderer, ) if HAS_MSGPACK else ())
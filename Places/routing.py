@@ -0,0 +1,6 @@
+from django.urls import path
+from Places.consumers import PlaceUpdatesConsumer
+
+websocket_urlpatterns = [
+    path('ws/places/', PlaceUpdatesConsumer),
+]
@@ -1,11 +1,52 @@
+from functools import lru_cache
+from operator import itemgetter
+from typing import Callable, Tuple
+from django.conf import settings
 from rest_framework import serializers
-from Places.models import Place, Accept, Rating, PlaceImage
-from ApiRequesters.Media.MediaRequester import MediaRequester
+from rest_framework.permissions import SAFE_METHODS
+from Places.models import Place, Accept, Rating, PlaceImage, PlaceStats, PendingRatingChange, RATING_VALUES, \
+    accept_type_by_cnt
+from Places import aggregates
+from Places.aggregates import trend_score
 from ApiRequesters.Auth.AuthRequester import AuthRequester
 from ApiRequesters.utils import get_token_from_request
 from ApiRequesters.exceptions import BaseApiRequestError
 
 
+class DuplicatePlaceError(serializers.ValidationError):
+    """
+    Ошибка создания места-дубликата, в ответе -- список похожих мест с числовыми полями как есть
+    """
+    def __init__(self, duplicates: list):
+        super().__init__()
+        self.detail = {'duplicates': duplicates}
+
+
+class SparseFieldsMixin:
+    """
+    Миксин сериализатора с выбором полей через query-параметры fields и exclude (имена через запятую)
+    Ненужные поля убираются до сериализации, поэтому их запросы в БД и в другие сервисы не выполняются;
+    работает только на чтение и выключается ключом контекста sparse_fields=False
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request', None)
+        if request is None or request.method not in SAFE_METHODS or not self.context.get('sparse_fields', True):
+            return
+        only = self._get_field_names(request, 'fields')
+        exclude = self._get_field_names(request, 'exclude')
+        for name in list(self.fields):
+            if (only and name not in only) or name in exclude:
+                self.fields.pop(name)
+
+    def _get_field_names(self, request, param: str) -> set:
+        names = {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+        unknown = names - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(f'Неизвестные поля в {param}: {", ".join(sorted(unknown))}')
+        return names
+
+
 class PlaceImageSerializer(serializers.ModelSerializer):
     """
     Сериализатор картинки места
@@ -28,6 +69,8 @@ class PlaceImageSerializer(serializers.ModelSerializer):
         ]
 
     def validate_pic_id(self, value: int):
+        # Нужен только при добавлении картинки, поэтому не грузится при старте воркера
+        from ApiRequesters.Media.MediaRequester import MediaRequester
         r = MediaRequester()
         token = get_token_from_request(self.context['request'])
         try:
@@ -67,7 +110,7 @@ class RatingSerializer(serializers.ModelSerializer):
     created_dt = serializers.DateTimeField(read_only=True)
     deleted_flg = serializers.BooleanField(required=False)
     place_id = serializers.PrimaryKeyRelatedField(source='place', queryset=Place.objects.with_deleted().all())
-    current_rating = serializers.FloatField(read_only=True, source='place.rating')
+    current_rating = serializers.SerializerMethodField()
     created_by = serializers.IntegerField(min_value=1, required=False, default=None, allow_null=True)
 
     class Meta:
@@ -94,16 +137,26 @@ class RatingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Не получается найти user_id по токену, попробуйте позже')
 
     def create(self, validated_data):
-        try:
-            place_id, created_by = validated_data['place'].id, validated_data['created_by']
-            rt = Rating.objects\
-                .get(place_id=place_id, created_by=created_by)
-            rt.soft_delete()
-        except Rating.DoesNotExist:
-            pass
-        new = Rating.objects.create(**validated_data)
+        place = validated_data['place']
+        new, self.old_rating, inserted = Rating.objects.upsert(place.id, validated_data['created_by'],
+                                                               validated_data['rating'])
+        if not inserted and self.old_rating is None:
+            # Проиграли гонку параллельной первой оценке и не знаем старого значения -- пересчитываем место целиком;
+            # пересчет удаляет окна склейки места, поэтому сначала они учитываются
+            aggregates.flush_rating_changes(place.id, due_only=False)
+            aggregates.rebuild([place.id])
+        elif settings.PLACES_RATING_COALESCE_SECONDS <= 0 or \
+                PendingRatingChange.objects.add(place.id, new.created_by, new.rating, new.rating):
+            # Без склейки и для первой оценки окна агрегаты обновляются сразу, переоценки в уже открытом окне
+            # учитываются только при его закрытии
+            place.stats = aggregates.rating_changed(place.id, self.old_rating, new.rating, new.updated_dt)
+        new.place = place
         return new
 
+    def get_current_rating(self, instance: Rating):
+        stats = getattr(instance.place, 'stats', None)
+        return stats.rating_avg if stats is not None else instance.place.rating
+
     def update(self, instance: Rating, validated_data):
         for attr, val in validated_data.items():
             setattr(instance, attr, val)
@@ -117,7 +170,7 @@ class AcceptSerializer(serializers.ModelSerializer):
     """
     created_dt = serializers.DateTimeField(read_only=True)
     deleted_flg = serializers.BooleanField(required=False)
-    current_accept_type = serializers.CharField(read_only=True, source='place.accept_type')
+    current_accept_type = serializers.SerializerMethodField()
     place_id = serializers.PrimaryKeyRelatedField(source='place', queryset=Place.objects.with_deleted().all())
     created_by = serializers.IntegerField(min_value=1, required=False, default=None, allow_null=True)
 
@@ -144,12 +197,17 @@ class AcceptSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Не получается найти user_id по токену, попробуйте позже')
 
     def create(self, validated_data):
-        place_id, created_by = validated_data['place'].id, validated_data['created_by']
-        if Accept.objects.filter(created_by=created_by, place_id=place_id).exists():
-            raise serializers.ValidationError('Вы уже подтвердили существование этого места')
-        new = Accept.objects.create(**validated_data)
+        place = validated_data['place']
+        new, self.inserted = Accept.objects.insert_or_ignore(place.id, validated_data['created_by'])
+        if self.inserted:
+            place.stats = aggregates.accepts_changed(place.id, 1, new.created_dt)
+        new.place = place
         return new
 
+    def get_current_accept_type(self, instance: Accept):
+        stats = getattr(instance.place, 'stats', None)
+        return stats.accept_type if stats is not None else instance.place.accept_type
+
     def update(self, instance: Accept, validated_data):
         for attr, val in validated_data.items():
             setattr(instance, attr, val)
@@ -157,7 +215,7 @@ class AcceptSerializer(serializers.ModelSerializer):
         return instance
 
 
-class PlaceListSerializer(serializers.ModelSerializer):
+class PlaceListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор спискового представления места
     """
@@ -214,10 +272,75 @@ class PlaceListSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Не получается найти user_id по токену, попробуйте позже')
 
     def create(self, validated_data):
+        request = self.context.get('request', None)
+        force = request is not None and request.query_params.get('force', 'False').lower() == 'true'
+        if not force:
+            # Поиск дубликатов нужен только при создании места, поэтому не грузится при старте воркера
+            from Places.dedup import find_duplicate_candidates
+            candidates = find_duplicate_candidates(validated_data['name'], validated_data['latitude'],
+                                                   validated_data['longitude'])
+            if candidates:
+                raise DuplicatePlaceError([{
+                    'id': place.id,
+                    'name': place.name,
+                    'latitude': place.latitude,
+                    'longitude': place.longitude,
+                    'address': place.address,
+                    'distance': round(distance, 1),
+                    'similarity': round(similarity, 2),
+                } for place, distance, similarity in candidates])
         new = Place.objects.create(**validated_data)
         return new
 
 
+# Поля PlaceListSerializer, которые берутся из строки values_list как есть
+PLACE_LIST_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'address': 'address',
+    'deleted_flg': 'deleted_flg',
+    'rating': 'rating_avg',
+    'accepts_cnt': 'accepts_count',
+}
+
+
+@lru_cache(maxsize=64)
+def place_list_row_builder(fields: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Callable]:
+    """
+    Сборщик представлений мест в схеме PlaceListSerializer без сериализатора
+    Для набора полей один раз вычисляются колонки values_list (rating_avg и accepts_count -- из with_aggregates)
+    и функции извлечения значений
+    :return: Колонки для values_list и функция (строки, user_id) -> список словарей
+    """
+    columns = []
+    getters = []
+
+    def column(name: str) -> Callable:
+        if name not in columns:
+            columns.append(name)
+        return itemgetter(columns.index(name))
+
+    for field in fields:
+        if field in PLACE_LIST_COLUMNS:
+            get = column(PLACE_LIST_COLUMNS[field])
+            getters.append((field, lambda row, user_id, get=get: get(row)))
+        elif field == 'accept_type':
+            get = column('accepts_count')
+            getters.append((field, lambda row, user_id, get=get: accept_type_by_cnt(get(row))))
+        elif field == 'is_created_by_me':
+            # Как в PlaceListSerializer.get_is_created_by_me: user_id из query-параметров сравнивается как есть
+            get = column('created_by')
+            getters.append((field, lambda row, user_id, get=get: user_id is not None and get(row) == user_id))
+        else:
+            raise KeyError(field)
+
+    def build(rows, user_id=None) -> list:
+        return [{field: get(row, user_id) for field, get in getters} for row in rows]
+    return tuple(columns), build
+
+
 class PlaceDetailSerializer(PlaceListSerializer):
     """
     Сериализатор детального представления места
@@ -227,6 +350,9 @@ class PlaceDetailSerializer(PlaceListSerializer):
     is_accepted_by_me = serializers.SerializerMethodField()
     created_by = serializers.IntegerField(min_value=1, read_only=True)
 
+    # Поля, зависящие от пользователя запроса, остальные поля одинаковы для всех (см. Places.detail_cache)
+    personal_fields = ('is_created_by_me', 'my_rating', 'is_accepted_by_me')
+
     class Meta(PlaceListSerializer.Meta):
         fields = PlaceListSerializer.Meta.fields + [
             'created_dt',
@@ -234,22 +360,137 @@ class PlaceDetailSerializer(PlaceListSerializer):
             'is_accepted_by_me',
         ]
 
+    @classmethod
+    def shared_data(cls, instance: Place, request) -> dict:
+        """
+        Представление места со всеми полями, кроме полей пользователя: без fields/exclude запроса, чтобы его можно
+        было кэшировать для любых запросов; Auth не вызывается
+        """
+        data = cls(instance, context={'request': request, 'user_id': None, 'sparse_fields': False}).data
+        return {field: value for field, value in data.items() if field not in cls.personal_fields}
+
+    def with_personal_data(self, shared: dict) -> dict:
+        """
+        Представление места из общей части и полей пользователя запроса с учетом fields/exclude этого сериализатора;
+        считаются только запрошенные поля пользователя
+        """
+        instance = Place(id=shared['id'], created_by=shared['created_by'])
+        return {field: getattr(self, f'get_{field}')(instance) if field in self.personal_fields else shared[field]
+                for field in self.fields}
+
+    @staticmethod
+    def get_user_id(context: dict):
+        """
+        id пользователя по токену запроса, Auth вызывается один раз на контекст (на весь ответ)
+        """
+        if 'user_id' not in context:
+            try:
+                _, user_json = AuthRequester().get_user_info(get_token_from_request(context['request']))
+                context['user_id'] = user_json['id']
+            except (KeyError, BaseApiRequestError):
+                context['user_id'] = None
+        return context['user_id']
+
+    @classmethod
+    def preload_mine(cls, context: dict, place_ids: list):
+        """
+        Оценки и подтверждения пользователя для мест по одному запросу на таблицу
+        """
+        user_id = cls.get_user_id(context)
+        if user_id is None:
+            context['my_ratings'], context['my_accepts'] = {}, set()
+            return
+        context['my_ratings'] = dict(Rating.objects.filter(place_id__in=place_ids, created_by=user_id)
+                                     .values_list('place_id', 'rating'))
+        context['my_accepts'] = set(Accept.objects.filter(place_id__in=place_ids, created_by=user_id)
+                                    .values_list('place_id', flat=True))
+
     def get_my_rating(self, instance: Place):
-        try:
-            _, user_json = AuthRequester().get_user_info(get_token_from_request(self.context['request']))
-            return Rating.objects.get(place_id=instance.id, created_by=user_json['id']).rating
-        except (KeyError, Rating.DoesNotExist, BaseApiRequestError):
+        user_id = self.get_user_id(self.context)
+        if user_id is None:
             return 0
+        if 'my_ratings' in self.context:
+            return self.context['my_ratings'].get(instance.id, 0)
+        rating = Rating.objects.filter(place_id=instance.id, created_by=user_id).values_list('rating', flat=True)\
+            .first()
+        return rating if rating is not None else 0
 
     def get_is_accepted_by_me(self, instance: Place):
-        try:
-            _, user_json = AuthRequester().get_user_info(get_token_from_request(self.context['request']))
-            return Accept.objects.filter(place_id=instance.id, created_by=user_json['id']).exists()
-        except (KeyError, BaseApiRequestError):
+        user_id = self.get_user_id(self.context)
+        if user_id is None:
             return False
+        if 'my_accepts' in self.context:
+            return instance.id in self.context['my_accepts']
+        return Accept.objects.filter(place_id=instance.id, created_by=user_id).exists()
 
     def update(self, instance: Place, validated_data):
         for attr, val in validated_data.items():
             setattr(instance, attr, val)
         instance.save()
         return instance
+
+
+class PlaceTopSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор места в топе по предрассчитанным агрегатам
+    """
+    id = serializers.IntegerField(source='place_id', read_only=True)
+    name = serializers.CharField(source='place.name', read_only=True)
+    latitude = serializers.FloatField(source='place.latitude', read_only=True)
+    longitude = serializers.FloatField(source='place.longitude', read_only=True)
+    address = serializers.CharField(source='place.address', read_only=True)
+    rating = serializers.FloatField(source='rating_avg', read_only=True)
+    accept_type = serializers.SerializerMethodField()
+    score = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = PlaceStats
+        fields = [
+            'id',
+            'name',
+            'latitude',
+            'longitude',
+            'address',
+            'rating',
+            'rating_cnt',
+            'accept_type',
+            'accepts_cnt',
+            'score',
+        ]
+        read_only_fields = fields
+
+    def get_accept_type(self, instance: PlaceStats):
+        return accept_type_by_cnt(instance.accepts_cnt)
+
+
+class PlaceTrendingSerializer(PlaceTopSerializer):
+    """
+    Сериализатор места в трендах, score -- затухшее во времени количество оценок и подтверждений
+    """
+    score = serializers.SerializerMethodField()
+
+    def get_score(self, instance: PlaceStats):
+        return trend_score(instance.trend_key)
+
+
+class PlaceRatingStatsSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор распределения оценок места: количество оценок по звездам, среднее и байесовская оценка
+    """
+    place_id = serializers.IntegerField(read_only=True)
+    counts = serializers.SerializerMethodField()
+    mean = serializers.FloatField(source='rating_avg', read_only=True)
+
+    class Meta:
+        model = PlaceStats
+        fields = [
+            'place_id',
+            'counts',
+            'rating_cnt',
+            'mean',
+            'score',
+        ]
+        read_only_fields = fields
+
+    def get_counts(self, instance: PlaceStats):
+        return {str(value): cnt for value, cnt in zip(RATING_VALUES, instance.histogram)}
@@ -1,6 +1,9 @@
+from django.core.signals import request_started
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from Places.models import Place
+from Places.models import Place, Rating, Accept, PlaceImage, PlaceChange
+from Places import aggregates, tiles, detail_cache
+from PlacesService.db_pool import check_persistent_connections
 
 
 @receiver(post_save, sender=Place)
@@ -14,9 +17,97 @@ def delete_all_after_place(sender, instance: Place, created, update_fields, **kw
         return
     if 'deleted_flg' not in update_fields:
         return
+    if instance.deleted_flg:
+        PlaceChange.objects.record(instance.id, PlaceChange.DELETED)
     for accept in instance.accepts.all():
         accept.soft_delete()
     for rating in instance.ratings.all():
         rating.soft_delete()
     for img in instance.images.all():
         img.soft_delete()
+
+
+@receiver(post_save, sender=Place)
+def log_place_change(sender, instance: Place, created, update_fields, **kwargs):
+    """
+    Запись создания или изменения места в журнал изменений (удаление записывает delete_all_after_place)
+    """
+    if created:
+        PlaceChange.objects.record(instance.id, PlaceChange.CREATED)
+    elif update_fields is None or 'deleted_flg' not in update_fields or not instance.deleted_flg:
+        PlaceChange.objects.record(instance.id, PlaceChange.EDITED)
+
+
+@receiver(post_save, sender=PlaceChange)
+def invalidate_tiles_after_change(sender, instance: PlaceChange, created, **kwargs):
+    """
+    Сброс кэша тайлов с местом после любого изменения из журнала (создание, правка, удаление, рейтинг, подтверждения)
+    и кэша места: оценки через Rating.objects.upsert и отложенные оценки сигналов Rating не отправляют
+    """
+    if created:
+        detail_cache.invalidate(instance.place_id)
+        tiles.invalidate_place(instance.place_id)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=Rating)
+@receiver(post_save, sender=Accept)
+def invalidate_place_detail(sender, instance, **kwargs):
+    """
+    Сброс кэша детального представления места после изменения места, его оценок или подтверждений
+    """
+    detail_cache.invalidate(instance.id if sender is Place else instance.place_id)
+
+
+@receiver(post_save, sender=Place)
+def update_stats_after_place(sender, instance: Place, created, **kwargs):
+    """
+    Создание агрегатов нового места и перенос в нужную ячейку сетки при изменении координат
+    """
+    aggregates.place_saved(instance, created)
+
+
+@receiver(post_save, sender=Rating)
+def update_stats_after_rating(sender, instance: Rating, created, update_fields, **kwargs):
+    """
+    Инкрементальное обновление агрегатов места после добавления или мягкого удаления рейтинга
+    """
+    if created:
+        if not instance.deleted_flg:
+            aggregates.rating_changed(instance.place_id, None, instance.rating, instance.created_dt)
+    elif update_fields is not None and 'deleted_flg' in update_fields and instance.deleted_flg:
+        # Удаляемая оценка должна быть учтена в агрегатах, прежде чем ее вычитать
+        aggregates.flush_rating_changes(instance.place_id, instance.created_by, due_only=False)
+        aggregates.rating_changed(instance.place_id, instance.rating, None)
+
+
+@receiver(post_save, sender=Accept)
+def update_stats_after_accept(sender, instance: Accept, created, update_fields, **kwargs):
+    """
+    Инкрементальное обновление агрегатов места после добавления или мягкого удаления подтверждения
+    """
+    if created:
+        if not instance.deleted_flg:
+            aggregates.accepts_changed(instance.place_id, 1, instance.created_dt)
+    elif update_fields is not None and 'deleted_flg' in update_fields and instance.deleted_flg:
+        aggregates.accepts_changed(instance.place_id, -1)
+
+
+@receiver(post_save, sender=PlaceImage)
+def update_stats_after_image(sender, instance: PlaceImage, created, update_fields, **kwargs):
+    """
+    Инкрементальное обновление агрегатов места после добавления или мягкого удаления картинки
+    """
+    if created:
+        if not instance.deleted_flg:
+            aggregates.images_changed(instance.place_id, 1, instance.created_dt)
+    elif update_fields is not None and 'deleted_flg' in update_fields and instance.deleted_flg:
+        aggregates.images_changed(instance.place_id, -1)
+
+
+@receiver(request_started)
+def check_db_connections(sender, **kwargs):
+    """
+    Проверка постоянных соединений с БД перед запросом
+    """
+    check_persistent_connections()
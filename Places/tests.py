@@ -1,5 +1,47 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from threading import Thread
+from unittest import skipUnless
+from unittest.mock import patch
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.db.models import Count
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, DatabaseError
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.urls import ResolverMatch
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient
 from TestUtils.models import BaseTestCase
-from Places.models import Place, Accept, Rating, PlaceImage
+from TestUtils.token import TestMockToken
+from Places.models import Place, Accept, Rating, RatingHistory, PlaceImage, PlaceStats, PlaceChange, \
+    PendingRatingChange, ArchivedRating
+from Places.geo import in_msk_bounds
+from Places.dedup import find_duplicate_clusters
+from PlacesService.db_router import ReplicaPool, ReplicaRouter, get_read_database, read_from
+from PlacesService.middleware import ReplicaRoutingMiddleware, CompressionMiddleware
+from PlacesService.db_pool import ConnectionPool, PoolTimeout
+from Places.renderers import PinsRenderer, MsgPackPinsRenderer, FastJSONRenderer
+from Places.consumers import PlaceUpdatesConsumer
+from Places.geo import cell_of, tile_of, tile_key
+from Places import events, aggregates, tiles
+from Places.serializers import PlaceListSerializer
+from Places.detail_cache import DetailCache, get_detail_cache
+from Places.management.commands.importtime import parse_importtime
+from Places.management.commands.seed_places import Command as SeedCommand
 
 
 class LocalBaseTestCase(BaseTestCase):
@@ -8,6 +50,9 @@ class LocalBaseTestCase(BaseTestCase):
     """
     def setUp(self):
         super().setUp()
+        # Кэши процесса переживают откат транзакции теста, а id мест могут повторяться
+        cache.clear()
+        get_detail_cache().clear()
         self.place = Place.objects.create(name='Test', latitude=56, longitude=37, address='Test',
                                           created_by=self.user.id)
         self.accept = Accept.objects.create(created_by=self.user.id, place=self.place)
@@ -38,7 +83,7 @@ class AcceptsListTestCase(LocalBaseTestCase):
             'created_by': self.user.id,
             'place_id': self.place.id + 10000,
         }
-        self.data_400_3 = {
+        self.data_200 = {
             'place_id': self.place.id,
             'created_by': self.user.id,
         }
@@ -87,8 +132,11 @@ class AcceptsListTestCase(LocalBaseTestCase):
     def testPost400_WrongPlaceId(self):
         _ = self.post_response_and_check_status(url=self.path, data=self.data_400_2, expected_status_code=400)
 
-    def testPost400_SamePlaceAccept(self):
-        _ = self.post_response_and_check_status(url=self.path, data=self.data_400_3, expected_status_code=400)
+    def testPost200_SamePlaceAccept(self):
+        response = self.post_response_and_check_status(url=self.path, data=self.data_200, expected_status_code=200)
+        self.assertEqual(response['id'], self.accept.id, msg='Existing accept was not returned')
+        self.assertEqual(Accept.objects.filter(place=self.place).count(), 1, msg='Duplicate accept was created')
+        self.assertEqual(PlaceStats.objects.get(place=self.place).accepts_cnt, 1, msg='Stats are out of sync')
 
 
 class AcceptTestCase(LocalBaseTestCase):
@@ -118,6 +166,14 @@ class AcceptTestCase(LocalBaseTestCase):
     def testDelete204_OK(self):
         _ = self.delete_response_and_check_status(url=self.path)
 
+    def testDelete_Repeated(self):
+        Accept.objects.create(created_by=self.user.id + 1, place=self.place)
+        _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true')
+        for _ in range(2):
+            _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true', expected_status_code=404)
+        self.assertEqual(PlaceStats.objects.get(place_id=self.place.id).accepts_cnt, 1,
+                         msg='Repeated delete was subtracted from stats')
+
     def testDelete404_WrongId(self):
         _ = self.delete_response_and_check_status(url=self.path_404, expected_status_code=404)
 
@@ -192,6 +248,56 @@ class RatingsListTestCase(LocalBaseTestCase):
     def testPost400_WrongRating(self):
         _ = self.post_response_and_check_status(url=self.path, data=self.data_400_3, expected_status_code=400)
 
+    def testPost201_Repeated(self):
+        for rating in (5, 2):
+            response = self.post_response_and_check_status(url=self.path, data={**self.data_201, 'rating': rating})
+            self.assertEqual(response['id'], self.rating.id, msg='Rating was recreated instead of updated')
+        self.assertEqual(Rating.objects.with_deleted().filter(place=self.place).count(), 1,
+                         msg='Extra rating rows were created')
+        self.assertEqual(list(RatingHistory.objects.filter(place=self.place).values_list('old_rating', 'rating')
+                              .order_by('id')), [(4, 5), (5, 2)], msg='Wrong rating history')
+        self.assertEqual(PlaceStats.objects.get(place=self.place).rating_sum, 2, msg='Stats are out of sync')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Гонки проверяются только на PostgreSQL')
+class ConcurrentWritesTestCase(TransactionTestCase):
+    """
+    Тесты параллельных оценок и подтверждений одного места одним пользователем
+    """
+    def setUp(self):
+        self.place = Place.objects.create(name='Test', latitude=56, longitude=37, address='Test', created_by=1)
+
+    def _upsert(self, rating: int):
+        try:
+            Rating.objects.upsert(self.place.id, 1, rating)
+        finally:
+            connection.close()
+
+    def testUpsert_Concurrent(self):
+        threads = [Thread(target=self._upsert, args=(i % 6,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Rating.objects.filter(place=self.place, created_by=1).count(), 1,
+                         msg='Concurrent upserts created duplicate ratings')
+        self.assertEqual(RatingHistory.objects.filter(place=self.place).count(), 20, msg='Lost rating history')
+
+    def _insert_accept(self):
+        try:
+            Accept.objects.insert_or_ignore(self.place.id, 1)
+        finally:
+            connection.close()
+
+    def testInsertAccept_Concurrent(self):
+        threads = [Thread(target=self._insert_accept) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Accept.objects.filter(place=self.place, created_by=1).count(), 1,
+                         msg='Concurrent inserts created duplicate accepts')
+
 
 class RatingTestCase(LocalBaseTestCase):
     """
@@ -226,6 +332,15 @@ class RatingTestCase(LocalBaseTestCase):
     def testDelete204_OK(self):
         _ = self.delete_response_and_check_status(url=self.path)
 
+    def testDelete_Repeated(self):
+        Rating.objects.create(created_by=self.user.id + 1, place=self.place, rating=2)
+        _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true')
+        for _ in range(2):
+            _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true', expected_status_code=404)
+        stats = PlaceStats.objects.get(place_id=self.place.id)
+        self.assertEqual((stats.rating_cnt, stats.rating_sum, stats.histogram), (1, 2, [0, 0, 1, 0, 0, 0]),
+                         msg='Repeated delete was subtracted from stats')
+
     def testDelete404_WrongId(self):
         _ = self.delete_response_and_check_status(url=self.path_404, expected_status_code=404)
 
@@ -325,6 +440,15 @@ class PlaceImageTestCase(LocalBaseTestCase):
         self.token.set_role(self.token.ROLES.MODERATOR)
         _ = self.delete_response_and_check_status(url=self.path)
 
+    def testDelete_Repeated(self):
+        self.token.set_role(self.token.ROLES.MODERATOR)
+        PlaceImage.objects.create(created_by=self.user.id, place=self.place, pic_id=2)
+        _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true')
+        for _ in range(2):
+            _ = self.delete_response_and_check_status(url=f'{self.path}?with_deleted=true', expected_status_code=404)
+        self.assertEqual(PlaceStats.objects.get(place_id=self.place.id).images_cnt, 1,
+                         msg='Repeated delete was subtracted from stats')
+
     def testDelete401_403_Not_Moderator(self):
         _ = self.delete_response_and_check_status(url=self.path, expected_status_code=[401, 403])
 
@@ -369,6 +493,70 @@ class PlacesListTestCase(LocalBaseTestCase):
                                     'accept_type', 'accepts_cnt', 'rating', 'is_created_by_me'])
         self.list_test(response, Place)
 
+    def testGet200_Fields(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?fields=id,latitude,longitude')
+        self.assertEqual(set(response[0]), {'id', 'latitude', 'longitude'}, msg='Wrong fields')
+        response = self.get_response_and_check_status(url=f'{self.path}?exclude=rating,accept_type')
+        self.assertNotIn('rating', response[0], msg='Excluded field in response')
+        self.assertIn('accepts_cnt', response[0], msg='Not excluded field is missing')
+
+    def testGet200_SameAsSerializer(self):
+        other = Place.objects.create(name='Other', latitude=55.9, longitude=37.5, address='Other', created_by=2)
+        Rating.objects.create(created_by=2, place=other, rating=3)
+        Rating.objects.create(created_by=3, place=other, rating=4)
+        Accept.objects.create(created_by=2, place=other)
+        Place.objects.create(name='Empty', latitude=56, longitude=37, address='Empty', created_by=2, deleted_flg=True)
+        for query in ('', f'?user_id={self.user.id}', '?with_deleted=true', '?fields=id,rating,accept_type',
+                      '?exclude=name&limit=2&offset=1'):
+            response = self.get_response_and_check_status(url=f'{self.path}{query}')
+            request = Request(RequestFactory().get(f'{self.path}{query}'))
+            qs = Place.objects.with_deleted() if 'with_deleted' in query else Place.objects.all()
+            expected = PlaceListSerializer(qs.order_by('id'), many=True, context={'request': request}).data
+            if 'limit' in query:
+                self.assertEqual(response['count'], len(expected), msg='Wrong count')
+                response, expected = response['results'], expected[1:3]
+            self.assertEqual(sorted(response, key=lambda p: p['id']), [dict(p) for p in expected],
+                             msg=f'Fast list differs from serializer for {query!r}')
+
+    def testBenchmark_PlacesList(self):
+        out = StringIO()
+        call_command('benchmark', 'places_list', iterations=1, json=True, stdout=out)
+        cases = [json.loads(line)['case'] for line in out.getvalue().splitlines()]
+        self.assertEqual(cases, ['serializer', 'values'], msg='Wrong benchmark cases')
+
+    def testGet200_Compact(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?compact=true')
+        self.assertEqual(response, [[self.place.id, self.place.latitude, self.place.longitude]])
+
+    def testGet200_Pins(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token.token)
+        response = client.get(self.path, HTTP_ACCEPT=PinsRenderer.media_type)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], PinsRenderer.media_type)
+        pins = PinsRenderer.unpack(response.content)
+        self.assertEqual([(p[0], round(p[1], 4), round(p[2], 4), p[3]) for p in pins],
+                         [(self.place.id, self.place.latitude, self.place.longitude, 4.0)])
+        response = client.get(f'{self.path}?format=pins&ordering=wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('application/json', response['Content-Type'], msg='Error was not rendered as JSON')
+
+    def testRender_MsgPackErrorAsJSON(self):
+        # msgpack для ошибки не нужен, поэтому тест не зависит от того, установлен ли он
+        for status_code in (400, 404):
+            response = Response(status=status_code)
+            response.exception = True
+            content = MsgPackPinsRenderer().render({'detail': 'error'}, renderer_context={'response': response})
+            self.assertEqual(json.loads(content), {'detail': 'error'})
+            self.assertEqual(response['Content-Type'], 'application/json', msg='Error was not rendered as JSON')
+
+    def testGet400_WrongFields(self):
+        _ = self.get_response_and_check_status(url=f'{self.path}?fields=id,secret', expected_status_code=400)
+
+    def testPost201_FieldsIgnored(self):
+        response = self.post_response_and_check_status(url=f'{self.path}?fields=id&force=true', data=self.data_201)
+        self.assertIn('name', response, msg='fields applied to write request')
+
     def testGet200_WithDeletedQueryParam(self):
         deleted = Place.objects.create(name='Test', latitude=56, longitude=37, address='Test',
                                        created_by=self.user.id, deleted_flg=True)
@@ -431,6 +619,15 @@ class PlacesListTestCase(LocalBaseTestCase):
     def testPost400_WrongLatAndLong(self):
         _ = self.post_response_and_check_status(url=self.path, data=self.data_400_2, expected_status_code=400)
 
+    def testPost400_Duplicate(self):
+        data = dict(self.data_201, name='test!', latitude=self.place.latitude + 0.0001)
+        response = self.post_response_and_check_status(url=self.path, data=data, expected_status_code=400)
+        self.assertEqual(response['duplicates'][0]['id'], self.place.id)
+
+    def testPost201_DuplicateForced(self):
+        data = dict(self.data_201, name='test!', latitude=self.place.latitude + 0.0001)
+        _ = self.post_response_and_check_status(url=f'{self.path}?force=true', data=data)
+
 
 class PlaceTestCase(LocalBaseTestCase):
     """
@@ -471,6 +668,61 @@ class PlaceTestCase(LocalBaseTestCase):
     def testGet404_WrongId(self):
         _ = self.get_response_and_check_status(url=self.path_404, expected_status_code=404)
 
+    def testGet200_Cached(self):
+        first = self.get_response_and_check_status(url=self.path)
+        Place.objects.filter(id=self.place.id).update(name='Changed')
+        Rating.objects.filter(id=self.rating.id).update(rating=1)
+        with self.assertNumQueries(2):
+            response = self.get_response_and_check_status(url=self.path)
+        self.assertEqual(response['name'], 'Test', msg='Place was not cached')
+        self.assertEqual((response['rating'], response['my_rating']), (4, 1), msg='Personal fields were cached')
+        self.assertEqual(dict(response, my_rating=4), first)
+        stats = get_detail_cache().stats()
+        self.assertEqual((stats['hits_total'], stats['misses_total'], stats['hit_ratio']), (1, 1, 0.5))
+
+    def testGet200_Invalidated(self):
+        with patch('Places.detail_cache.transaction.on_commit', side_effect=lambda func: func()):
+            _ = self.get_response_and_check_status(url=self.path)
+            Rating.objects.create(created_by=self.user.id + 1, place=self.place, rating=5)
+            self.assertEqual(self.get_response_and_check_status(url=self.path)['rating'], 4.5)
+            Accept.objects.create(created_by=self.user.id + 1, place=self.place)
+            self.assertEqual(self.get_response_and_check_status(url=self.path)['accepts_cnt'], 2)
+            self.place.soft_delete()
+            _ = self.get_response_and_check_status(url=self.path, expected_status_code=404)
+
+    def testGet200_CachedSparseFields(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?fields=id,name')
+        self.assertEqual(response, {'id': self.place.id, 'name': 'Test'})
+        response = self.get_response_and_check_status(url=f'{self.path}?exclude=my_rating,created_by')
+        self.assertNotIn('my_rating', response)
+        self.assertNotIn('created_by', response)
+        self.assertIn('is_accepted_by_me', response)
+        with self.assertNumQueries(0):
+            response = self.get_response_and_check_status(url=f'{self.path}?fields=id,accepts_cnt')
+        self.assertEqual(response, {'id': self.place.id, 'accepts_cnt': 1}, msg='Sparse fields changed cache entry')
+        response = self.get_response_and_check_status(url=self.path)
+        self.assertEqual((response['name'], response['my_rating']), ('Test', 4), msg='Truncated entry was cached')
+
+    def testGet200_InvalidatedByApiAccept(self):
+        with patch('Places.detail_cache.transaction.on_commit', side_effect=lambda func: func()):
+            _ = self.get_response_and_check_status(url=self.path)
+            self.post_response_and_check_status(url=f'{self.url_prefix}accepts/',
+                                                data={'place_id': self.place.id, 'created_by': self.user.id + 1})
+            self.assertEqual(self.get_response_and_check_status(url=self.path)['accepts_cnt'], 2)
+
+    def testDetailCache_LruAndTtl(self):
+        now = [0]
+        detail_cache = DetailCache(max_size=2, ttl=10, clock=lambda: now[0])
+        for place_id in (1, 2, 1, 3):
+            detail_cache.get_or_build(place_id, lambda: {'id': place_id})
+        self.assertEqual(detail_cache.get_or_build(1, lambda: {'id': 'rebuilt'}), {'id': 1}, msg='Used entry evicted')
+        self.assertEqual(detail_cache.get_or_build(2, lambda: {'id': 'rebuilt'}), {'id': 'rebuilt'})
+        now[0] = 11
+        self.assertEqual(detail_cache.get_or_build(1, lambda: {'id': 'expired'}), {'id': 'expired'})
+        stats = detail_cache.stats()
+        self.assertEqual((stats['size'], stats['hits_total'], stats['evictions_total'], stats['stale_total']),
+                         (2, 2, 2, 1))
+
     def testGet404_NoDeletedQueryParam(self):
         deleted = Place.objects.create(name='Test', latitude=56, longitude=37, address='Test',
                                        created_by=self.user.id, deleted_flg=True)
@@ -502,3 +754,907 @@ class PlaceTestCase(LocalBaseTestCase):
     def testDelete404_WrongId(self):
         self.token.set_role(self.token.ROLES.SUPERUSER)
         self.delete_response_and_check_status(url=self.path_404, expected_status_code=404)
+
+
+class SeedPlacesCommandTestCase(TestCase):
+    """
+    Тесты для manage.py seed_places
+    """
+    def testSeed_OK(self):
+        call_command('seed_places', places=30, users=40, max_ratings=10, max_accepts=10, max_images=3, clusters=3,
+                     chunk_size=7, seed=1, no_copy=True, stdout=StringIO())
+        self.assertEqual(Place.objects.count(), 30)
+        self.assertTrue(all(in_msk_bounds(lat, long) for lat, long in
+                            Place.objects.values_list('latitude', 'longitude')), msg='Place out of Moscow bounds')
+        self.assertFalse(Rating.objects.filter(rating__gt=5).exists(), msg='Rating out of range')
+        dups = Rating.objects.values('place_id', 'created_by').annotate(c=Count('id')).filter(c__gt=1)
+        self.assertFalse(dups.exists(), msg='User rated the same place twice')
+        self.assertEqual(PlaceStats.objects.count(), 30, msg='Seeded places have no stats')
+        for stats in PlaceStats.objects.all():
+            self.assertEqual((stats.rating_cnt, stats.accepts_cnt),
+                             (Rating.objects.filter(place_id=stats.place_id).count(),
+                              Accept.objects.filter(place_id=stats.place_id).count()))
+
+    def testCopyColumns_CoverNotNull(self):
+        command = SeedCommand()
+        command.now = timezone.now()
+        for model, fields in command.fields.items():
+            columns = {model._meta.get_field(f).column for f in fields} | \
+                      {column for column, _ in command._default_columns(model)}
+            required = {f.column for f in model._meta.concrete_fields if not f.null and not f.primary_key}
+            self.assertEqual(required - columns, set(), msg=f'{model.__name__} COPY misses NOT NULL columns')
+
+
+class PlacesExportTestCase(LocalBaseTestCase):
+    """
+    Тесты для /places/export/
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'places/export/'
+
+    def _get_lines(self, url: str, expected_status_code: int = 200) -> list:
+        client = self._get_api_client()
+        client.credentials(HTTP_AUTHORIZATION=self.token.token)
+        response = client.get(url)
+        self.assertEqual(response.status_code, expected_status_code)
+        if not response.streaming:
+            return []
+        return b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    def testGet200_NDJSON(self):
+        lines = self._get_lines(f'{self.path}?format=ndjson')
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['id'], self.place.id)
+        self.assertEqual(row['rating'], 4)
+        self.assertEqual(row['accepts_cnt'], 1)
+
+    def testGet200_CSV(self):
+        lines = self._get_lines(f'{self.path}?format=csv')
+        self.assertEqual(len(lines), 2, msg='Expected header and one row')
+        self.assertTrue(lines[0].startswith('id,name,latitude'))
+
+    def testGet200_UpdatedSince(self):
+        lines = self._get_lines(f'{self.path}?format=ndjson&updated_since=2100-01-01T00:00:00')
+        self.assertEqual(len(lines), 0, msg='Place is not updated since 2100')
+
+    def testGet200_UpdatedSinceByAggregates(self):
+        since = timezone.now()
+        Place.objects.filter(id=self.place.id).update(updated_dt=since - timedelta(days=1))
+        PlaceStats.objects.filter(place_id=self.place.id).update(updated_dt=since - timedelta(days=1))
+        self.assertEqual(self._get_lines(f'{self.path}?updated_since={since.isoformat()}'.replace('+', '%2B')), [])
+        Rating.objects.create(created_by=self.user.id + 1, place=self.place, rating=5)
+        lines = self._get_lines(f'{self.path}?format=ndjson&updated_since={since.isoformat()}'.replace('+', '%2B'))
+        self.assertEqual(len(lines), 1, msg='Rating change was not exported')
+        row = json.loads(lines[0])
+        self.assertEqual(row['rating'], 4.5)
+        self.assertGreaterEqual(row['updated_dt'], since.isoformat()[:19])
+
+    def testGet400_WrongUpdatedSince(self):
+        self._get_lines(f'{self.path}?updated_since=yesterday', expected_status_code=400)
+
+
+class ImportPlacesCommandTestCase(TestCase):
+    """
+    Тесты для manage.py import_places
+    """
+    def setUp(self):
+        self.existing = Place.objects.create(name='Кафе Ромашка', latitude=55.75, longitude=37.6, address='Test',
+                                             created_by=1)
+
+    def _import(self, content: str, suffix: str) -> StringIO:
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False) as f:
+            f.write(content)
+        rejects = StringIO()
+        try:
+            call_command('import_places', f.name, created_by=1, chunk_size=2, stdout=StringIO(), stderr=rejects)
+        finally:
+            os.remove(f.name)
+        return rejects
+
+    def testImportCSV_OK(self):
+        rejects = self._import('name,address,latitude,longitude\n'
+                               'Новое место,ул. 1,55.8,37.7\n'
+                               'Далеко,ул. 2,20,20\n'
+                               'кафе  ромашка!,ул. 3,55.7501,37.6001\n', '.csv')
+        self.assertEqual(Place.objects.count(), 2)
+        new = Place.objects.get(name='Новое место')
+        self.assertTrue(PlaceChange.objects.filter(place=new, kind=PlaceChange.CREATED).exists(),
+                        msg='Imported place is not in change log')
+        self.assertEqual(new.tile_key, tile_key(55.8, 37.7))
+        stats = PlaceStats.objects.filter(place=new).first()
+        self.assertIsNotNone(stats, msg='Imported place has no stats')
+        self.assertEqual((stats.accepts_cnt, stats.rating_cnt), (0, 0))
+        self.assertIn('line 3', rejects.getvalue())
+        self.assertIn('line 4', rejects.getvalue())
+
+    def testImportNDJSON_DuplicatesInFile(self):
+        row = json.dumps({'name': 'Новое место', 'address': 'ул. 1', 'latitude': 55.8, 'longitude': 37.7})
+        self._import(f'{row}\n{row}\nnot json\n', '.ndjson')
+        self.assertEqual(Place.objects.filter(name='Новое место').count(), 1)
+
+
+class FindDuplicatePlacesTestCase(TestCase):
+    """
+    Тесты для поиска групп дубликатов
+    """
+    def testClusters_OK(self):
+        a = Place.objects.create(name='Кафе Ромашка', latitude=55.75, longitude=37.6, address='Test', created_by=1)
+        b = Place.objects.create(name='кафе ромашка', latitude=55.7501, longitude=37.6001, address='Test',
+                                 created_by=2)
+        _ = Place.objects.create(name='Кафе Ромашка', latitude=55.8, longitude=37.7, address='Test', created_by=3)
+        _ = Place.objects.create(name='Аптека', latitude=55.75, longitude=37.6, address='Test', created_by=4)
+        self.assertEqual(find_duplicate_clusters(), [[a.id, b.id]])
+
+
+class PlacesRankingTestCase(LocalBaseTestCase):
+    """
+    Тесты для /places/top/ и /places/trending/
+    """
+    def setUp(self):
+        super().setUp()
+        self.top_path = self.url_prefix + 'places/top/'
+        self.trending_path = self.url_prefix + 'places/trending/'
+        self.new_place = Place.objects.create(name='New', latitude=55.6, longitude=37.5, address='Test',
+                                              created_by=self.user.id)
+
+    def testStats_Incremental(self):
+        stats = PlaceStats.objects.get(place=self.place)
+        self.assertEqual((stats.rating_cnt, stats.rating_avg, stats.accepts_cnt), (1, 4, 1))
+        self.rating.soft_delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.rating_cnt, stats.rating_avg), (0, None))
+
+    def testGetTop200_OK(self):
+        Rating.objects.create(created_by=self.user.id, place=self.new_place, rating=1)
+        response = self.get_response_and_check_status(url=self.top_path)
+        self.fields_test(response, ['id', 'name', 'latitude', 'longitude', 'rating', 'accept_type', 'score'])
+        self.assertEqual([x['id'] for x in response], [self.place.id, self.new_place.id])
+
+    def testGetTop200_MapSector(self):
+        response = self.get_response_and_check_status(url=f'{self.top_path}?lat1=55.5&long1=37.4&lat2=55.7&long2=37.6')
+        self.assertEqual([x['id'] for x in response], [self.new_place.id])
+
+    def testGetTop400_WrongLimit(self):
+        _ = self.get_response_and_check_status(url=f'{self.top_path}?limit=100500', expected_status_code=400)
+
+    def testGetTrending200_OK(self):
+        response = self.get_response_and_check_status(url=self.trending_path)
+        self.assertEqual([x['id'] for x in response], [self.place.id])
+        self.assertGreater(response[0]['score'], 0)
+
+    def testRefreshPlaceStats_OK(self):
+        PlaceStats.objects.all().delete()
+        call_command('refresh_place_stats', stdout=StringIO())
+        stats = PlaceStats.objects.get(place=self.place)
+        self.assertEqual((stats.rating_cnt, stats.rating_avg, stats.accepts_cnt), (1, 4, 1))
+        self.assertIsNotNone(stats.trend_key)
+
+    def testIncrementalStats_MatchRefresh(self):
+        Rating.objects.create(created_by=self.user.id + 1, place=self.place, rating=2)
+        other = Rating.objects.create(created_by=self.user.id + 2, place=self.place, rating=5)
+        other.soft_delete()
+        PlaceImage.objects.create(created_by=self.user.id, place=self.place, pic_id=2).soft_delete()
+        self.post_response_and_check_status(url=self.url_prefix + 'ratings/',
+                                            data={'place_id': self.place.id, 'rating': 1})
+        stats = PlaceStats.objects.get(place=self.place)
+        self.assertEqual(stats.histogram, [0, 1, 1, 0, 0, 0], msg='Wrong rating histogram')
+        self.assertEqual(stats.images_cnt, 1, msg='Wrong images count')
+        self.assertIsNotNone(stats.last_activity_dt)
+        call_command('refresh_place_stats', stdout=StringIO())
+        rebuilt = PlaceStats.objects.get(place=self.place)
+        self.assertEqual((rebuilt.histogram, rebuilt.images_cnt, rebuilt.rating_sum),
+                         (stats.histogram, stats.images_cnt, stats.rating_sum), msg='Refresh differs from increments')
+
+
+class PlacesListOrderingTestCase(LocalBaseTestCase):
+    """
+    Тесты сортировки и фильтрации /places/ по агрегатам
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'places/'
+        self.low = Place.objects.create(name='Low', latitude=55.6, longitude=37.5, address='Test', created_by=1)
+        Rating.objects.create(created_by=self.user.id, place=self.low, rating=1)
+        self.unrated = Place.objects.create(name='Unrated', latitude=55.6, longitude=37.5, address='Test',
+                                            created_by=1)
+
+    def testGet200_OrderingByRating(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?ordering=-rating')
+        self.assertEqual([x['id'] for x in response], [self.place.id, self.low.id, self.unrated.id])
+        response = self.get_response_and_check_status(url=f'{self.path}?ordering=rating')
+        self.assertEqual([x['id'] for x in response], [self.low.id, self.place.id, self.unrated.id])
+
+    def testGet200_MinRating(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?min_rating=3')
+        self.assertEqual([x['id'] for x in response], [self.place.id])
+
+    def testGet200_AcceptType(self):
+        response = self.get_response_and_check_status(url=f'{self.path}?accept_type=unchecked&ordering=created_dt')
+        self.assertEqual([x['id'] for x in response], [self.place.id, self.low.id, self.unrated.id])
+        response = self.get_response_and_check_status(url=f'{self.path}?accept_type=checked')
+        self.assertEqual(len(response), 0)
+
+    def testGet200_AcceptTypeWithoutStats(self):
+        PlaceStats.objects.filter(place=self.unrated).delete()
+        response = self.get_response_and_check_status(url=f'{self.path}?accept_type=unchecked&ordering=created_dt')
+        self.assertEqual([x['id'] for x in response], [self.place.id, self.low.id, self.unrated.id])
+        response = self.get_response_and_check_status(url=f'{self.path}?accept_type=weakly_checked')
+        self.assertEqual(len(response), 0)
+
+    def testGet400_WrongOrdering(self):
+        _ = self.get_response_and_check_status(url=f'{self.path}?ordering=name', expected_status_code=400)
+
+    def testGet400_WrongAcceptType(self):
+        _ = self.get_response_and_check_status(url=f'{self.path}?accept_type=best', expected_status_code=400)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """
+    Тесты роутинга чтения на реплики
+    """
+    def setUp(self):
+        self.lags = {'replica_0': 1.0, 'replica_1': 0.5}
+        self.now = 0
+        self.pool = ReplicaPool(['replica_0', 'replica_1'], max_lag=5, check_interval=5, cooldown=30,
+                                probe=self._probe, clock=lambda: self.now)
+
+    def _probe(self, alias):
+        if self.lags[alias] is None:
+            raise DatabaseError('Replica is down')
+        return self.lags[alias]
+
+    def _middleware_read_db(self, method: str, path: str = '/api/places/', **extra):
+        seen = {}
+
+        def get_response(request):
+            seen['db'] = get_read_database()
+            return HttpResponse(status=201 if method == 'POST' else 200)
+
+        request = getattr(RequestFactory(), method.lower())(path, **extra)
+        with patch('PlacesService.middleware.get_replica_pool', return_value=self.pool):
+            response = ReplicaRoutingMiddleware(get_response)(request)
+        return seen['db'], response
+
+    def testChoose_RoundRobin(self):
+        self.assertEqual({self.pool.choose() for _ in range(4)}, {'replica_0', 'replica_1'},
+                         msg='Replicas are not rotated')
+
+    def testChoose_LeastLag(self):
+        self.pool.strategy = 'least_lag'
+        self.assertEqual(self.pool.choose(), 'replica_1', msg='Not the least lagging replica')
+
+    def testChoose_Fallback(self):
+        self.lags = {'replica_0': None, 'replica_1': 100}
+        self.assertIsNone(self.pool.choose(), msg='Unavailable or lagging replica was chosen')
+        self.lags = {'replica_0': 0, 'replica_1': 0}
+        self.now = 10
+        self.assertEqual(self.pool.choose(), 'replica_1', msg='Failed replica was rechecked before cooldown')
+        self.now = 40
+        self.assertEqual(len(self.pool.available()), 2, msg='Failed replica was not rechecked after cooldown')
+
+    def testRouter_OnlyPlacesModels(self):
+        router = ReplicaRouter()
+        with read_from('replica_0'):
+            self.assertEqual(router.db_for_read(Place), 'replica_0', msg='Places read was not routed')
+            self.assertIsNone(router.db_for_read(User), msg='Non-Places read was routed')
+        self.assertIsNone(router.db_for_read(Place), msg='Read outside of request was routed')
+        self.assertEqual(router.db_for_write(Place), 'default', msg='Write was routed to replica')
+
+    def testMiddleware_SafeRequest(self):
+        db, _ = self._middleware_read_db('GET')
+        self.assertIn(db, self.pool.aliases, msg='GET was not routed to replica')
+        db, _ = self._middleware_read_db('GET', path='/admin/')
+        self.assertIsNone(db, msg='Non-API request was routed to replica')
+
+    def testMiddleware_PinAfterWrite(self):
+        db, response = self._middleware_read_db('POST', HTTP_AUTHORIZATION='Bearer pin')
+        self.assertIsNone(db, msg='POST was routed to replica')
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name].value
+        db, _ = self._middleware_read_db('GET', HTTP_COOKIE=f'{ReplicaRoutingMiddleware.cookie_name}={cookie}')
+        self.assertIsNone(db, msg='Client was not pinned to primary by cookie')
+        db, _ = self._middleware_read_db('GET', HTTP_AUTHORIZATION='Bearer pin')
+        self.assertIsNone(db, msg='Client was not pinned to primary by token')
+        db, _ = self._middleware_read_db('GET', HTTP_AUTHORIZATION='Bearer other')
+        self.assertIsNotNone(db, msg='Another client was pinned to primary')
+
+    def testMiddleware_FailoverToPrimary(self):
+        seen = []
+
+        def view(request):
+            seen.append(get_read_database())
+            if get_read_database() is not None:
+                raise DatabaseError('Replica is down')
+            return HttpResponse()
+
+        def get_response(request):
+            # Как обработчик Django: исключение вьюхи передается в process_exception
+            try:
+                return view(request)
+            except DatabaseError as e:
+                return middleware.process_exception(request, e) or HttpResponse(status=500)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        request = RequestFactory().get('/api/places/')
+        request.resolver_match = ResolverMatch(view, (), {})
+        with patch('PlacesService.middleware.get_replica_pool', return_value=self.pool):
+            response = middleware(request)
+        self.assertEqual(response.status_code, 200, msg='Request was not retried on primary')
+        self.assertEqual(len(seen), 2)
+        self.assertIsNone(seen[1], msg='Retry was not routed to primary')
+        self.assertNotIn(seen[0], [alias for alias, _ in self.pool.available()], msg='Failed replica was not excluded')
+
+
+class ConnectionPoolTestCase(TestCase):
+    """
+    Тесты пула соединений с БД
+    """
+    def setUp(self):
+        self.now = 0
+        self.created = []
+        self.broken = set()
+        self.pool = ConnectionPool(self._connect, max_size=2, timeout=0.01, check_interval=30,
+                                   is_usable=lambda conn: conn not in self.broken, close=lambda conn: None,
+                                   clock=lambda: self.now)
+
+    def _connect(self):
+        self.created.append(len(self.created))
+        return self.created[-1]
+
+    def testAcquire_Reuse(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertEqual(self.pool.acquire(), conn, msg='Idle connection was not reused')
+        self.assertEqual(len(self.created), 1, msg='Extra connection was created')
+
+    def testAcquire_Timeout(self):
+        self.pool.clock = time.monotonic
+        self.pool.acquire(), self.pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        stats = self.pool.stats()
+        self.assertEqual((stats['in_use'], stats['saturation'], stats['timeouts_total']), (2, 1.0, 1),
+                         msg='Wrong pool stats')
+
+    def testAcquire_HealthCheck(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.broken.add(conn)
+        self.assertEqual(self.pool.acquire(), conn, msg='Recently used connection was checked')
+        self.pool.release(conn)
+        self.now = 60
+        self.assertNotEqual(self.pool.acquire(), conn, msg='Broken connection was reused')
+        self.assertEqual(self.pool.stats()['size'], 1, msg='Broken connection was not replaced')
+
+    def testMetrics200_Superuser(self):
+        token = TestMockToken()
+        token.set_role(token.ROLES.SUPERUSER)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=token.token)
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('default', response.json()['databases'], msg='No default database in metrics')
+
+    def testMetrics403_User(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=TestMockToken().token)
+        self.assertIn(client.get('/api/metrics/').status_code, [401, 403])
+
+    def testBenchmark_Connections(self):
+        out = StringIO()
+        call_command('benchmark', 'connections', iterations=5, json=True, stdout=out)
+        cases = [json.loads(line)['case'] for line in out.getvalue().splitlines()]
+        self.assertEqual(cases, ['reconnect', 'persistent'], msg='Wrong benchmark cases')
+
+
+class ResponseEncodingTestCase(LocalBaseTestCase):
+    """
+    Тесты рендеринга JSON и сжатия ответов
+    """
+    def _compressed(self, content, content_type='application/json', **extra):
+        middleware = CompressionMiddleware(lambda request: HttpResponse(content, content_type=content_type))
+        return middleware(RequestFactory().get('/api/places/', **extra))
+
+    def testFastJSONRenderer_SameAsJSONRenderer(self):
+        data = [{'id': 1, 'name': 'Тест', 'rating': Decimal('4.5'), 'created_dt': datetime(2020, 3, 1, 12, 30),
+                 'tags': None, 'nested': {'accepted': True}}]
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def testCompression_Gzip(self):
+        content = json.dumps([{'id': i, 'name': 'Test'} for i in range(200)]).encode()
+        response = self._compressed(content, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+
+    def testCompression_Skipped(self):
+        content = json.dumps([{'id': i, 'name': 'Test'} for i in range(200)]).encode()
+        self.assertFalse(self._compressed(b'[]', HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'),
+                         msg='Small response was compressed')
+        self.assertFalse(self._compressed(content).has_header('Content-Encoding'),
+                         msg='Response was compressed without Accept-Encoding')
+        self.assertFalse(self._compressed(content, HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'),
+                         msg='Refused encoding was used')
+        self.assertFalse(self._compressed(content, content_type='image/png',
+                                          HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'),
+                         msg='Incompressible response was compressed')
+
+    def testCompression_Streaming(self):
+        middleware = CompressionMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'{"id": 1}\n'] * 100), content_type='application/x-ndjson'))
+        response = middleware(RequestFactory().get('/api/places/export/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'{"id": 1}\n' * 100)
+
+    @override_settings(PLACES_COMPRESSION_MIN_BYTES=1)
+    def testGet200_PlacesCompressed(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token.token)
+        response = client.get(self.url_prefix + 'places/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))[0]['id'], self.place.id)
+
+    def testBenchmark_Json(self):
+        out = StringIO()
+        call_command('benchmark', 'json', iterations=1, json=True, stdout=out)
+        cases = [json.loads(line)['case'] for line in out.getvalue().splitlines()]
+        self.assertIn('places/json/gzip', cases, msg='No gzip case in benchmark')
+        self.assertIn('ratings/json/identity', cases, msg='No ratings case in benchmark')
+
+
+class ApiSettingsTestCase(LocalBaseTestCase):
+    """
+    Тесты профиля настроек процесса API и его запуска
+    """
+    def setUp(self):
+        super().setUp()
+        from PlacesService import settings_api
+        self.settings_api = settings_api
+
+    def testSettings_NoUnusedApps(self):
+        for app in ('django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages',
+                    'django.contrib.staticfiles'):
+            self.assertNotIn(app, self.settings_api.INSTALLED_APPS, msg=f'{app} in API settings')
+        self.assertFalse([m for m in self.settings_api.MIDDLEWARE if 'session' in m.lower() or 'csrf' in m.lower()],
+                         msg='Session or CSRF middleware in API settings')
+
+    def testGet200_ApiStack(self):
+        with self.settings(MIDDLEWARE=self.settings_api.MIDDLEWARE, ROOT_URLCONF=self.settings_api.ROOT_URLCONF,
+                           REST_FRAMEWORK=self.settings_api.REST_FRAMEWORK):
+            response = self.get_response_and_check_status(url=self.url_prefix + 'places/')
+            self.assertEqual(response[0]['id'], self.place.id)
+            self.assertEqual(self.client.get('/admin/').status_code, 404, msg='Admin is served by API process')
+
+    def testImportTime_Parse(self):
+        output = 'import time: self [us] | cumulative | imported package\n' \
+                 'import time:       120 |        120 |     Places.geo\n' \
+                 'import time:       300 |        420 |   Places.aggregates\n' \
+                 'import time:        50 |        470 | Places.signals\n'
+        rows = parse_importtime(output)
+        self.assertEqual([(row['module'], row['depth']) for row in rows],
+                         [('Places.geo', 2), ('Places.aggregates', 1), ('Places.signals', 0)])
+        self.assertEqual(rows[1]['self_us'], 300)
+
+    def testImportTime_Command(self):
+        out = StringIO()
+        call_command('importtime', top=5, json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertGreater(report['total_us'], 0, msg='Empty import time report')
+        self.assertEqual(len(report['top']), 5)
+
+    def testBenchmark_Middleware(self):
+        out = StringIO()
+        call_command('benchmark', 'middleware', iterations=1, json=True, stdout=out)
+        cases = [json.loads(line)['case'] for line in out.getvalue().splitlines()]
+        self.assertEqual(cases, ['PlacesService.settings', 'PlacesService.settings_api'], msg='Wrong benchmark cases')
+
+
+@override_settings(PLACES_REALTIME_FLUSH_SECONDS=0.05)
+class PlaceUpdatesTestCase(LocalBaseTestCase):
+    """
+    Тесты подписки на изменения мест по WebSocket
+    """
+    def setUp(self):
+        super().setUp()
+        self.layer = get_channel_layer()
+        async_to_sync(self.layer.flush)()
+        self.cell = cell_of(self.place.latitude, self.place.longitude)
+
+    async def _connect(self, subscription: dict) -> WebsocketCommunicator:
+        communicator = WebsocketCommunicator(PlaceUpdatesConsumer, '/ws/places/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to(dict(subscription, action='subscribe'))
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['type'], 'subscribed', msg=response)
+        return communicator
+
+    async def _change(self, place_id: int, cell, **changes):
+        await self.layer.group_send(events.place_group(place_id), {
+            'type': 'place.changed', 'cell': list(cell), 'place': dict(changes, id=place_id),
+        })
+
+    def testSubscribe_Ids(self):
+        async def run():
+            communicator = await self._connect({'ids': [self.place.id]})
+            await self._change(self.place.id, self.cell, rating=4.5, rating_cnt=2)
+            await self._change(self.place.id, self.cell, rating=4.0, rating_cnt=3)
+            await self._change(self.place.id + 1, self.cell, rating=1.0)
+            response = await communicator.receive_json_from(timeout=1)
+            self.assertEqual(response, {'type': 'updates', 'places': [{'id': self.place.id, 'rating': 4.0,
+                                                                       'rating_cnt': 3}]})
+            self.assertTrue(await communicator.receive_nothing(timeout=0.1), msg='Changes were not coalesced')
+            await communicator.disconnect()
+        async_to_sync(run)()
+
+    def testSubscribe_Bbox(self):
+        async def run():
+            communicator = await self._connect({'bbox': {'lat1': 55.99, 'long1': 36.99, 'lat2': 56.01, 'long2': 37.01}})
+            await sync_to_async(events.publish)(self.place.id, self.cell, accept_type='Проверенное место')
+            response = await communicator.receive_json_from(timeout=1)
+            self.assertEqual(response['places'], [{'id': self.place.id, 'accept_type': 'Проверенное место'}])
+            await communicator.disconnect()
+        async_to_sync(run)()
+
+    def testSubscribe_Errors(self):
+        async def run():
+            communicator = WebsocketCommunicator(PlaceUpdatesConsumer, '/ws/places/')
+            await communicator.connect()
+            for message in ({'action': 'wrong'}, {'action': 'subscribe'},
+                            {'action': 'subscribe', 'ids': list(range(1000))},
+                            {'action': 'subscribe', 'bbox': {'lat1': 55.5, 'long1': 37, 'lat2': 56, 'long2': 37.9}}):
+                await communicator.send_json_to(message)
+                response = await communicator.receive_json_from()
+                self.assertEqual(response['type'], 'error', msg=f'No error for {message}')
+            await communicator.disconnect()
+        async_to_sync(run)()
+
+    @override_settings(PLACES_REALTIME_MAX_MESSAGES=2)
+    def testSubscribe_RateLimit(self):
+        async def run():
+            communicator = await self._connect({'ids': [self.place.id]})
+            await communicator.send_json_to({'action': 'unsubscribe'})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'unsubscribed')
+            await communicator.send_json_to({'action': 'subscribe', 'ids': [self.place.id]})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+            await communicator.disconnect()
+        async_to_sync(run)()
+
+    def testPublish_WritePaths(self):
+        with patch('Places.events.publish') as publish:
+            Rating.objects.create(created_by=2, place=self.place, rating=2)
+            publish.assert_called_once_with(self.place.id, self.cell, rating=3.0, rating_cnt=2)
+            publish.reset_mock()
+            Accept.objects.create(created_by=2, place=self.place)
+            publish.assert_not_called()
+            place = Place.objects.create(name='New', latitude=55.9, longitude=37.5, address='New', created_by=2)
+            self.assertTrue(publish.call_args[1]['created'], msg='New place was not published')
+            self.assertEqual(publish.call_args[0], (place.id, cell_of(55.9, 37.5)))
+
+
+@override_settings(PLACES_CHANGES_SETTLE_SECONDS=0)
+class PlaceChangesTestCase(LocalBaseTestCase):
+    """
+    Тесты для /places/changes/
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'places/changes/'
+        self.other = Place.objects.create(name='Other', latitude=55.9, longitude=37.5, address='Other',
+                                          created_by=self.user.id)
+        self.cursor = self.get_response_and_check_status(url=self.path)['cursor']
+
+    def testGet200_Cursor(self):
+        response = self.get_response_and_check_status(url=self.path)
+        self.assertEqual(response, {'cursor': PlaceChange.objects.latest('id').id, 'has_more': False, 'places': []})
+
+    def testGet200_Changes(self):
+        Rating.objects.create(created_by=2, place=self.other, rating=5)
+        self.place.name = 'Edited'
+        self.place.save()
+        response = self.get_response_and_check_status(url=f'{self.path}?since={self.cursor}')
+        self.assertEqual([(p['id'], p['name']) for p in response['places']],
+                         [(self.place.id, 'Edited'), (self.other.id, 'Other')])
+        self.assertEqual(response['places'][1]['rating'], 5)
+        self.assertFalse(response['has_more'])
+        response = self.get_response_and_check_status(url=f'{self.path}?since={response["cursor"]}')
+        self.assertEqual(response['places'], [], msg='Changes were returned twice')
+
+    def testGet200_Deleted(self):
+        self.other.soft_delete()
+        response = self.get_response_and_check_status(url=f'{self.path}?since={self.cursor}')
+        self.assertEqual([(p['id'], p['deleted_flg']) for p in response['places']], [(self.other.id, True)])
+        self.assertTrue(PlaceChange.objects.filter(place=self.other, kind=PlaceChange.DELETED).exists())
+
+    def testGet200_LimitAndBbox(self):
+        for place in (self.place, self.other):
+            place.save()
+        response = self.get_response_and_check_status(url=f'{self.path}?since={self.cursor}&limit=1')
+        self.assertEqual(([p['id'] for p in response['places']], response['has_more']), ([self.place.id], True))
+        response = self.get_response_and_check_status(url=f'{self.path}?since={response["cursor"]}&limit=1')
+        self.assertEqual(([p['id'] for p in response['places']], response['has_more']), ([self.other.id], False))
+        response = self.get_response_and_check_status(
+            url=f'{self.path}?since={self.cursor}&lat1=55.8&long1=37.4&lat2=56.0&long2=37.6')
+        self.assertEqual([p['id'] for p in response['places']], [self.other.id])
+
+    @override_settings(PLACES_CHANGES_SETTLE_SECONDS=60)
+    def testGet200_NotSettled(self):
+        self.other.save()
+        response = self.get_response_and_check_status(url=f'{self.path}?since={self.cursor}')
+        self.assertEqual(response['places'], [], msg='Unsettled change was returned')
+
+    def testGet400_WrongSince(self):
+        _ = self.get_response_and_check_status(url=f'{self.path}?since=abc', expected_status_code=400)
+        _ = self.get_response_and_check_status(url=f'{self.path}?since=-1', expected_status_code=400)
+
+
+@override_settings(PLACES_RATING_COALESCE_SECONDS=60)
+class RatingCoalesceTestCase(LocalBaseTestCase):
+    """
+    Тесты склейки частых переоценок
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'ratings/'
+
+    def _rate(self, rating: int) -> dict:
+        return self.post_response_and_check_status(url=self.path, data={
+            'created_by': self.user.id, 'place_id': self.place.id, 'rating': rating,
+        })
+
+    def _stats(self) -> PlaceStats:
+        return PlaceStats.objects.get(place_id=self.place.id)
+
+    def testPost201_Coalesced(self):
+        self.assertEqual(self._rate(2)['current_rating'], 2, msg='First rating in window was deferred')
+        for rating in (5, 3):
+            _ = self._rate(rating)
+        self.assertEqual(self._stats().rating_avg, 2, msg='Rating in open window was applied')
+        self.assertEqual(Rating.objects.get(id=self.rating.id).rating, 3, msg='Final rating was not saved')
+        self.assertEqual(RatingHistory.objects.filter(place=self.place).count(), 3)
+        self.assertEqual(aggregates.flush_rating_changes(), 0, msg='Open window was flushed')
+        call_command('flush_rating_changes', all=True, stdout=StringIO())
+        stats = self._stats()
+        self.assertEqual((stats.rating_avg, stats.rating_cnt, stats.histogram), (3, 1, [0, 0, 0, 1, 0, 0]))
+        self.assertFalse(PendingRatingChange.objects.exists())
+
+    def testFlush_Due(self):
+        for rating in (2, 5):
+            _ = self._rate(rating)
+        PendingRatingChange.objects.update(updated_dt=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(aggregates.flush_rating_changes(), 1)
+        self.assertEqual(self._stats().rating_avg, 5)
+        for rating in (2, 5, 2):
+            _ = self._rate(rating)
+        PendingRatingChange.objects.update(updated_dt=timezone.now() - timedelta(minutes=2))
+        changes = PlaceChange.objects.count()
+        self.assertEqual(aggregates.flush_rating_changes(), 1)
+        self.assertEqual(PlaceChange.objects.count(), changes, msg='Window without net change was recorded')
+
+    def testPost201_RaceRebuildFlushesWindows(self):
+        other = Rating.objects.create(created_by=self.user.id + 1, place=self.place, rating=1)
+        PendingRatingChange.objects.add(self.place.id, other.created_by, 1, 1)
+        Rating.objects.filter(id=other.id).update(rating=5)
+        PendingRatingChange.objects.add(self.place.id, other.created_by, 1, 5)
+        upsert = Rating.objects.upsert
+
+        def racing_upsert(*args):
+            # Как при проигранной гонке с параллельной первой оценкой: старое значение неизвестно
+            new, _, _ = upsert(*args)
+            return new, None, False
+
+        with patch.object(Rating.objects, 'upsert', side_effect=racing_upsert):
+            _ = self._rate(2)
+        stats = self._stats()
+        self.assertEqual((stats.rating_cnt, stats.rating_sum), (2, 7), msg='Pending windows were lost')
+        self.assertFalse(PendingRatingChange.objects.exists())
+
+    def testPost201_NoInlineFlush(self):
+        for rating in (2, 5):
+            _ = self._rate(rating)
+        PendingRatingChange.objects.update(updated_dt=timezone.now() - timedelta(minutes=2))
+        _ = self.post_response_and_check_status(url=self.path, data={
+            'created_by': self.user.id + 1, 'place_id': self.place.id, 'rating': 1,
+        })
+        self.assertTrue(PendingRatingChange.objects.filter(created_by=self.user.id).exists(),
+                        msg='Closed window was flushed by rating request')
+
+    def testDelete_FlushesPending(self):
+        for rating in (2, 5):
+            _ = self._rate(rating)
+        Rating.objects.get(id=self.rating.id).soft_delete()
+        stats = self._stats()
+        self.assertEqual((stats.rating_cnt, stats.rating_sum, stats.histogram), (0, 0, [0] * 6))
+        self.assertFalse(PendingRatingChange.objects.exists())
+
+
+class CompactDeletedTestCase(LocalBaseTestCase):
+    """
+    Тесты для manage.py compact_deleted
+    """
+    def setUp(self):
+        super().setUp()
+        self.rating.soft_delete()
+        Rating.objects.with_deleted().filter(id=self.rating.id).update(deleted_dt=timezone.now() - timedelta(days=60))
+        self.recent = Rating.objects.create(created_by=self.user.id, place=self.place, rating=2)
+        self.recent.soft_delete()
+
+    def _compact(self, **options) -> str:
+        out = StringIO()
+        call_command('compact_deleted', sleep=0, chunk_size=1, stdout=out, **options)
+        return out.getvalue()
+
+    def testCompact_OK(self):
+        out = self._compact()
+        self.assertEqual(list(Rating.objects.with_deleted().values_list('id', flat=True)), [self.recent.id],
+                         msg='Wrong rows were archived')
+        archived = ArchivedRating.objects.get(id=self.rating.id)
+        self.assertEqual((archived.place_id, archived.rating, archived.deleted_flg), (self.place.id, 4, True))
+        self.assertIn('ratings: перенесено 1 из 2 строк', out)
+        self.assertTrue(Accept.objects.filter(id=self.accept.id).exists(), msg='Live row was archived')
+
+    def testCompact_DryRun(self):
+        self.assertIn('ratings: к переносу 1 строк', self._compact(dry_run=True))
+        self.assertFalse(ArchivedRating.objects.exists())
+
+    def testGet200_WithDeletedReadsArchive(self):
+        self._compact(only=['ratings'])
+        path = self.url_prefix + 'ratings/'
+        response = self.get_response_and_check_status(url=f'{path}?with_deleted=True')
+        self.assertEqual({x['id'] for x in response}, {self.rating.id, self.recent.id})
+        response = self.get_response_and_check_status(url=f'{path}{self.rating.id}/?with_deleted=True')
+        self.assertEqual((response['rating'], response['deleted_flg']), (4, True))
+        _ = self.get_response_and_check_status(url=f'{path}{self.rating.id}/', expected_status_code=404)
+
+
+class PlaceTileTestCase(LocalBaseTestCase):
+    """
+    Тесты для /tiles/<z>/<x>/<y>/
+    """
+    def setUp(self):
+        super().setUp()
+        self.near = Place.objects.create(name='Near', latitude=56.001, longitude=37.001, address='Near',
+                                         created_by=self.user.id)
+
+    def _path(self, zoom: int, latitude: float = 56, longitude: float = 37) -> str:
+        x, y = tile_of(latitude, longitude, zoom)
+        return f'{self.url_prefix}tiles/{zoom}/{x}/{y}/'
+
+    def testTileKey(self):
+        self.assertEqual(self.place.tile_key, tile_key(56, 37))
+        self.place.latitude = 55.9
+        self.place.save(update_fields=['latitude'])
+        self.assertEqual(Place.objects.get(id=self.place.id).tile_key, tile_key(55.9, 37))
+
+    def testGet200_Points(self):
+        response = self.get_response_and_check_status(url=self._path(18))
+        self.assertEqual((response['type'], response['z']), ('points', 18))
+        self.assertEqual(response['points'], [[self.place.id, 56, 37, 4, 1]])
+
+    def testGet200_Clusters(self):
+        response = self.get_response_and_check_status(url=self._path(10))
+        self.assertEqual(response['type'], 'clusters')
+        self.assertEqual([count for count, _, _ in response['points']], [2])
+        self.assertAlmostEqual(response['points'][0][1], 56.0005)
+        self.place.soft_delete()
+        cache.clear()
+        response = self.get_response_and_check_status(url=self._path(10))
+        self.assertEqual(response['points'], [[1, 56.001, 37.001]], msg='Deleted place is in tile')
+
+    def testGet200_Invalidated(self):
+        with patch('Places.tiles.transaction.on_commit', side_effect=lambda func: func()):
+            _ = self.get_response_and_check_status(url=self._path(18))
+            Rating.objects.create(created_by=2, place=self.place, rating=5)
+            response = self.get_response_and_check_status(url=self._path(18))
+            self.assertEqual(response['points'][0][3], 4.5, msg='Tile was not invalidated after rating')
+            self.post_response_and_check_status(url=f'{self.url_prefix}accepts/',
+                                                data={'place_id': self.place.id, 'created_by': self.user.id + 1})
+            response = self.get_response_and_check_status(url=self._path(18))
+            self.assertEqual(response['points'][0][4], 2, msg='Tile was not invalidated after accept')
+            self.place.latitude = 55.9
+            self.place.save()
+            response = self.get_response_and_check_status(url=self._path(18))
+            self.assertEqual(response['points'], [], msg='Tile was not invalidated after move')
+
+    def testGet200_BuildRacesInvalidation(self):
+        build = tiles.build
+        x, y = tile_of(56, 37, 18)
+
+        def racing_build(*args):
+            data = build(*args)
+            # Оценка закоммичена между сборкой тайла и его сохранением в кэш
+            Rating.objects.create(created_by=2, place=self.place, rating=5)
+            return data
+
+        with patch('Places.tiles.transaction.on_commit', side_effect=lambda func: func()):
+            with patch('Places.tiles.build', side_effect=racing_build):
+                _, etag = tiles.get(18, x, y)
+            response = self.get_response_and_check_status(url=self._path(18))
+        self.assertEqual(response['points'][0][3], 4.5, msg='Tile built before the write was served')
+        self.assertNotEqual(tiles.get(18, x, y)[1], etag)
+
+    def testGet304_ETag(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token.token)
+        response = client.get(self._path(12))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(client.get(self._path(12), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(client.get(self._path(12), HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        self.assertEqual(client.get(self._path(12), HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def testGet400_WrongTile(self):
+        _ = self.get_response_and_check_status(url=f'{self.url_prefix}tiles/25/0/0/', expected_status_code=400)
+        _ = self.get_response_and_check_status(url=f'{self.url_prefix}tiles/2/4/0/', expected_status_code=400)
+
+
+class PlaceRatingStatsTestCase(LocalBaseTestCase):
+    """
+    Тесты для /places/<id>/rating_stats/ и /places/rating_stats/
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'places/rating_stats/'
+        self.other = Place.objects.create(name='Other', latitude=56, longitude=37.5, address='Test',
+                                          created_by=self.user.id)
+        for created_by, rating in ((1, 5), (2, 5), (3, 2)):
+            Rating.objects.create(created_by=created_by, place=self.other, rating=rating)
+
+    def testGet200_OK(self):
+        response = self.get_response_and_check_status(url=f'{self.url_prefix}places/{self.place.id}/rating_stats/')
+        self.fields_test(response, ['place_id', 'counts', 'rating_cnt', 'mean', 'score'])
+        self.assertEqual(response['counts'], {'0': 0, '1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+        self.assertEqual(response['mean'], 4)
+
+    def testGet404_WrongId(self):
+        _ = self.get_response_and_check_status(url=f'{self.url_prefix}places/{self.place.id + 1000}/rating_stats/',
+                                               expected_status_code=404)
+
+    def testGet200_Bulk(self):
+        PlaceStats.objects.filter(place=self.other).delete()
+        response = self.get_response_and_check_status(url=f'{self.path}?ids={self.other.id},1000,{self.place.id}')
+        self.assertEqual([x['place_id'] for x in response], [self.other.id, self.place.id], msg='Wrong order')
+        self.assertEqual((response[0]['counts']['5'], response[0]['counts']['2'], response[0]['rating_cnt']),
+                         (2, 1, 3), msg='Wrong counts for place without stats row')
+        self.assertEqual(response[0]['mean'], 4)
+
+    def testGet400_WrongIds(self):
+        _ = self.get_response_and_check_status(url=f'{self.path}?ids=1,a', expected_status_code=400)
+        ids = ','.join(str(i) for i in range(1, 102))
+        _ = self.get_response_and_check_status(url=f'{self.path}?ids={ids}', expected_status_code=400)
+
+
+class PlacesBatchTestCase(LocalBaseTestCase):
+    """
+    Тесты для /places/?ids=
+    """
+    def setUp(self):
+        super().setUp()
+        self.path = self.url_prefix + 'places/'
+        self.other = Place.objects.create(name='Other', latitude=56, longitude=37.5, address='Test',
+                                          created_by=self.user.id)
+        Rating.objects.create(created_by=self.user.id + 1, place=self.other, rating=2)
+
+    def testGet200_OK(self):
+        with self.assertNumQueries(3):
+            response = self.get_response_and_check_status(
+                url=f'{self.path}?ids={self.other.id},{self.place.id + 1000},{self.place.id}')
+        self.assertEqual([x['id'] for x in response], [self.other.id, self.place.id], msg='Wrong order')
+        self.fields_test(response, ['rating', 'accepts_cnt', 'my_rating', 'is_accepted_by_me', 'created_dt'])
+        self.assertEqual((response[0]['rating'], response[0]['my_rating'], response[0]['is_accepted_by_me']),
+                         (2, 0, False))
+        self.assertEqual((response[1]['rating'], response[1]['accepts_cnt'], response[1]['my_rating'],
+                          response[1]['is_accepted_by_me']), (4, 1, 4, True))
+
+    def testGet200_BatchFields(self):
+        with self.assertNumQueries(1):
+            response = self.get_response_and_check_status(url=f'{self.path}?ids={self.place.id}&fields=id,name')
+        self.assertEqual(response, [{'id': self.place.id, 'name': self.place.name}])
+
+    def testGet400_TooManyIds(self):
+        ids = ','.join(str(i) for i in range(1, 102))
+        _ = self.get_response_and_check_status(url=f'{self.path}?ids={ids}', expected_status_code=400)
@@ -0,0 +1,92 @@
+"""
+Тайлы карты мест в сетке web-mercator z/x/y
+На крупных зумах тайл содержит сами места, на мелких -- кластеры: места тайла группируются по подтайлам
+на PLACES_TILE_CLUSTER_BITS зумов глубже (при 3 -- сетка 8x8) со средними координатами и количеством мест
+Готовое тело тайла и его ETag кэшируются в общем для процессов кэше Django (см. CACHES) под версией тайла; любое
+изменение места в тайле, в том числе его accepts_cnt, увеличивает версию после коммита (см. Places.signals
+и aggregates.accepts_changed), поэтому тайл, собранный одновременно с записью, сохраняется под старой версией
+и не отдается
+"""
+import hashlib
+from typing import Iterable
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, F, IntegerField
+from django.db.models.expressions import ExpressionWrapper
+from Places.geo import TILE_KEY_ZOOM, tile_key_range, tile_ancestors
+from Places.models import Place
+from Places.renderers import FastJSONRenderer
+
+POINT_FIELDS = ['id', 'latitude', 'longitude', 'rating', 'accepts_cnt']
+CLUSTER_FIELDS = ['count', 'latitude', 'longitude']
+
+
+def version_key(zoom: int, x: int, y: int) -> str:
+    return f'places:tile:version:{zoom}:{x}:{y}'
+
+
+def cache_key(zoom: int, x: int, y: int, version: int) -> str:
+    return f'places:tile:{zoom}:{x}:{y}:{version}'
+
+
+def build(zoom: int, x: int, y: int) -> dict:
+    """
+    Содержимое тайла: точки -- списки значений в порядке fields
+    """
+    start, end = tile_key_range(zoom, x, y)
+    places = Place.objects.filter(tile_key__gte=start, tile_key__lt=end)
+    if zoom >= settings.PLACES_TILE_RAW_MIN_ZOOM:
+        rows = places.order_by('id').values_list('id', 'latitude', 'longitude', 'stats__rating_avg',
+                                                 'stats__accepts_cnt')
+        return {'type': 'points', 'fields': POINT_FIELDS, 'points': [list(row) for row in rows]}
+    cluster_zoom = min(zoom + settings.PLACES_TILE_CLUSTER_BITS, TILE_KEY_ZOOM)
+    cluster = ExpressionWrapper(F('tile_key') / (1 << 2 * (TILE_KEY_ZOOM - cluster_zoom)),
+                                output_field=IntegerField())
+    rows = places.annotate(cluster=cluster).values('cluster').order_by('cluster') \
+        .annotate(cnt=Count('id'), lat=Avg('latitude'), long=Avg('longitude')).values_list('cnt', 'lat', 'long')
+    return {'type': 'clusters', 'fields': CLUSTER_FIELDS, 'points': [list(row) for row in rows]}
+
+
+def get(zoom: int, x: int, y: int) -> (bytes, str):
+    """
+    Тело тайла в JSON и его ETag, из кэша или только что собранные
+    Версия читается до сборки, поэтому изменение во время сборки только сделает собранный тайл устаревшим
+    """
+    version = cache.get(version_key(zoom, x, y), 0)
+    key = cache_key(zoom, x, y, version)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    body = FastJSONRenderer().render(dict(build(zoom, x, y), z=zoom, x=x, y=y))
+    cached = body, f'"{version}-{hashlib.md5(body).hexdigest()}"'
+    cache.set(key, cached, settings.PLACES_TILE_CACHE_SECONDS)
+    return cached
+
+
+def invalidate_many(keys: Iterable[int]):
+    """
+    Увеличение версий тайлов всех зумов, в которые попадают точки с ключами keys, после коммита текущей транзакции
+    """
+    tiles = {version_key(*tile) for key in keys if key is not None
+             for tile in tile_ancestors(key, settings.PLACES_TILE_MAX_ZOOM)}
+
+    def bump():
+        for key in tiles:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+    if tiles:
+        transaction.on_commit(bump)
+
+
+def invalidate(key: int):
+    invalidate_many([key])
+
+
+def invalidate_place(place_id: int):
+    """
+    Сброс кэша тайлов с местом по его id
+    """
+    invalidate(Place.objects.with_deleted().filter(id=place_id).values_list('tile_key', flat=True).first())
@@ -4,11 +4,19 @@ from Places import views
 
 urlpatterns = [
     url(r'^places/$', views.PlacesListView.as_view()),
+    url(r'^places/export/$', views.PlacesExportView.as_view()),
+    url(r'^places/changes/$', views.PlaceChangesView.as_view()),
+    url(r'^places/top/$', views.PlacesTopView.as_view()),
+    url(r'^places/trending/$', views.PlacesTrendingView.as_view()),
+    url(r'^places/rating_stats/$', views.PlacesRatingStatsView.as_view()),
     url(r'^places/(?P<pk>\d+)/$', views.PlaceDetailView.as_view()),
+    url(r'^places/(?P<pk>\d+)/rating_stats/$', views.PlaceRatingStatsView.as_view()),
     url(r'^accepts/$', views.AcceptsListView.as_view()),
     url(r'^accepts/(?P<pk>\d+)/$', views.AcceptDetailView.as_view()),
     url(r'^ratings/$', views.RatingsListView.as_view()),
     url(r'^ratings/(?P<pk>\d+)/$', views.RatingDetailView.as_view()),
     url(r'^place_images/$', views.PlaceImagesListView.as_view()),
     url(r'^place_images/(?P<pk>\d+)/$', views.PlaceImageDetailView.as_view()),
+    url(r'^tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)/$', views.PlaceTileView.as_view()),
+    url(r'^metrics/$', views.MetricsView.as_view()),
 ]
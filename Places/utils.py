@@ -0,0 +1,14 @@
+from itertools import islice
+from typing import Iterable
+
+
+def chunked(iterable: Iterable, size: int) -> Iterable[list]:
+    """
+    Разбиение итерируемого объекта на списки длиной не больше size
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,11 +1,30 @@
-from rest_framework.exceptions import ValidationError
-from rest_framework.generics import ListCreateAPIView, RetrieveDestroyAPIView, RetrieveUpdateDestroyAPIView
+import csv
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce, Greatest
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.generics import ListCreateAPIView, RetrieveDestroyAPIView, RetrieveUpdateDestroyAPIView, \
+    GenericAPIView, ListAPIView
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework import status
 from Places.serializers import AcceptSerializer, RatingSerializer, PlaceImageSerializer, PlaceListSerializer, \
-    PlaceDetailSerializer
-from Places.models import Accept, Rating, PlaceImage, Place
+    PlaceDetailSerializer, PlaceTopSerializer, PlaceTrendingSerializer, PlaceRatingStatsSerializer, \
+    place_list_row_builder
+from Places.models import Accept, Rating, PlaceImage, Place, PlaceStats, PlaceChange, AcceptWithArchive, \
+    RatingWithArchive, PlaceImageWithArchive, ACCEPT_TYPES, accept_type_by_cnt, accepts_cnt_range
+from Places.geo import cell_of
+from Places import aggregates, tiles
+from Places.detail_cache import get_detail_cache
+from Places.renderers import NDJSONRenderer, CSVRenderer, EchoBuffer, PIN_RENDERERS
+from PlacesService.db_pool import connection_stats
 from Places.permissions import WriteOnlyBySuperuser, WriteOnlyByModerator, WriteOnlyByAuthenticated
-from ApiRequesters.Auth.permissions import IsAuthenticated
+from ApiRequesters.Auth.permissions import IsAuthenticated, IsSuperuser
 from ApiRequesters.Auth.AuthRequester import AuthRequester
 from ApiRequesters.utils import get_token_from_request
 from ApiRequesters.exceptions import BaseApiRequestError
@@ -18,12 +37,17 @@ class BaseListCreateView(ListCreateAPIView, CollectStatsMixin):
     Базовый класс для ListCreate для Accept, Rating, PlaceImage
     """
     model_class = None
+    # Представление живых и архивных строк (см. manage.py compact_deleted) для with_deleted
+    archive_model_class = None
+    select_related = ()
 
     def get_queryset(self):
         place_id = self.request.query_params.get('place_id', None)
         with_deleted = self.request.query_params.get('with_deleted', 'False')
         with_deleted = with_deleted.lower() == 'true'
-        all_ = self.model_class.objects.with_deleted() if with_deleted else self.model_class.objects
+        all_ = self.archive_model_class.objects if with_deleted else self.model_class.objects
+        if self.select_related:
+            all_ = all_.select_related(*self.select_related)
         if place_id is None:
             return all_.all()
         else:
@@ -39,11 +63,15 @@ class BaseRetrieveDestroyView(RetrieveDestroyAPIView, CollectStatsMixin):
     Базовый класс для RetriveDestroy для Accept, Rating, PlaceImage
     """
     model_class = None
+    archive_model_class = None
 
     def get_queryset(self):
         with_deleted = self.request.query_params.get('with_deleted', 'False')
         with_deleted = with_deleted.lower() == 'true'
-        return self.model_class.objects.with_deleted().all() if with_deleted else self.model_class.objects.all()
+        # Удаленные и архивные строки только читаются: повторное удаление -- 404
+        if with_deleted and self.request.method in SAFE_METHODS:
+            return self.archive_model_class.objects.all()
+        return self.model_class.objects.all()
 
     @collect_request_stats_decorator()
     def get(self, request, *args, **kwargs):
@@ -62,21 +90,27 @@ class AcceptsListView(BaseListCreateView):
     Вьюха для просмотра списка подтверждений
     """
     model_class = Accept
+    archive_model_class = AcceptWithArchive
     permission_classes = (IsAuthenticated, )
     serializer_class = AcceptSerializer
     pagination_class = LimitOffsetPagination
+    select_related = ('place__stats', )
 
     @collect_request_stats_decorator(another_stats_funcs=[CollectStatsMixin.collect_accept_stats])
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
-        add_kwargs = []
-        if serializer.is_valid():
-            add_kwargs.append({
-                'action': StatsRequester.ACCEPTS_ACTIONS.ACCEPTED,
-                'place_id': request.data['place_id'],
-                'request': request,
-            })
-        return super().post(request, *args, **kwargs), add_kwargs
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        if not serializer.inserted:
+            # Место уже подтверждено этим пользователем -- отдаем существующее подтверждение без событий статистики
+            return Response(serializer.data, status=status.HTTP_200_OK), []
+        add_kwargs = [{
+            'action': StatsRequester.ACCEPTS_ACTIONS.ACCEPTED,
+            'place_id': serializer.instance.place_id,
+            'request': request,
+        }]
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers), add_kwargs
 
 
 class AcceptDetailView(BaseRetrieveDestroyView):
@@ -84,6 +118,7 @@ class AcceptDetailView(BaseRetrieveDestroyView):
     Вьюха для получения и удаления определенного подтверждения
     """
     model_class = Accept
+    archive_model_class = AcceptWithArchive
     permission_classes = (IsAuthenticated, )
     serializer_class = AcceptSerializer
 
@@ -106,28 +141,26 @@ class RatingsListView(BaseListCreateView):
     Вьюха для просмотра списка рейтингов
     """
     model_class = Rating
+    archive_model_class = RatingWithArchive
     permission_classes = (IsAuthenticated, )
     serializer_class = RatingSerializer
     pagination_class = LimitOffsetPagination
+    select_related = ('place__stats', )
 
     @collect_request_stats_decorator(another_stats_funcs=[CollectStatsMixin.collect_rating_stats])
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
-        add_kwargs = []
         serializer.is_valid(raise_exception=True)
-        fst_old_rating = Rating.objects\
-            .with_deleted()\
-            .filter(created_by=serializer['created_by'].value, place_id=request.data['place_id'])\
-            .order_by('-created_dt')\
-            .first()
-        old_rating = fst_old_rating.rating if fst_old_rating is not None else 0
-        add_kwargs.append({
-            'old_rating': old_rating,
-            'new_rating': request.data['rating'],
-            'place_id': request.data['place_id'],
+        self.perform_create(serializer)
+        # Статистика отправляется на каждую оценку, склеиваются только обновления агрегатов
+        add_kwargs = [{
+            'old_rating': serializer.old_rating or 0,
+            'new_rating': serializer.instance.rating,
+            'place_id': serializer.instance.place_id,
             'request': request,
-        })
-        return super().post(request, *args, **kwargs), add_kwargs
+        }]
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers), add_kwargs
 
 
 class RatingDetailView(BaseRetrieveDestroyView):
@@ -135,6 +168,7 @@ class RatingDetailView(BaseRetrieveDestroyView):
     Вьюха для получения и удаления рейтинга
     """
     model_class = Rating
+    archive_model_class = RatingWithArchive
     permission_classes = (IsAuthenticated,)
     serializer_class = RatingSerializer
 
@@ -144,6 +178,7 @@ class PlaceImagesListView(BaseListCreateView):
     Вьюха для получения списка изображений места
     """
     model_class = PlaceImage
+    archive_model_class = PlaceImageWithArchive
     permission_classes = (WriteOnlyByModerator, )
     serializer_class = PlaceImageSerializer
     pagination_class = LimitOffsetPagination
@@ -158,20 +193,68 @@ class PlaceImageDetailView(BaseRetrieveDestroyView):
     Вьюха для получения и удаления картинки места
     """
     model_class = PlaceImage
+    archive_model_class = PlaceImageWithArchive
     permission_classes = (WriteOnlyByModerator,)
     serializer_class = PlaceImageSerializer
 
 
-class PlacesListView(ListCreateAPIView, CollectStatsMixin):
+def get_bbox_from_request(request):
     """
-    Вьюха для получения списка мест
+    Сектор карты из query-параметров lat1, long1, lat2, long2
+    :return: (мин. широта, макс. широта, мин. долгота, макс. долгота) или None, если сектор не задан
     """
-    permission_classes = (WriteOnlyByAuthenticated, )
-    serializer_class = PlaceListSerializer
-    pagination_class = LimitOffsetPagination
+    latitude_1 = request.query_params.get('lat1', None)
+    longitude_1 = request.query_params.get('long1', None)
+    latitude_2 = request.query_params.get('lat2', None)
+    longitude_2 = request.query_params.get('long2', None)
+    llll = (latitude_1, latitude_2, longitude_1, longitude_2)
+    if all(llll):
+        try:
+            return min(float(latitude_1), float(latitude_2)), max(float(latitude_1), float(latitude_2)), \
+                min(float(longitude_1), float(longitude_2)), max(float(longitude_1), float(longitude_2))
+        except (ValueError, TypeError):
+            raise ValidationError('Для фильтрации по сектору карты параметры должны быть числами')
+    elif len(list(filter(lambda x: x is not None, llll))) != 0:
+        raise ValidationError('Для фильтрации по сектору карты нужны 4 координаты')
+    return None
+
 
+def get_ids_from_request(request, max_count: int) -> list:
+    """
+    id из query-параметра ids через запятую, без повторов и в порядке запроса
+    """
+    try:
+        ids = [int(x) for x in request.query_params.get('ids', '').split(',') if x.strip()]
+    except ValueError:
+        raise ValidationError('ids должен быть списком чисел через запятую')
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValidationError('Нужен параметр ids')
+    if len(ids) > max_count:
+        raise ValidationError(f'В ids можно передать не больше {max_count} id')
+    return ids
+
+
+def place_list_rows(serializer: PlaceListSerializer, qs) -> tuple:
+    """
+    Строки values_list мест для полей сериализатора (с агрегатами, если они нужны) и функция сборки из них
+    словарей в схеме PlaceListSerializer
+    """
+    fields = tuple(name for name, field in serializer.fields.items() if not field.write_only)
+    columns, build = place_list_row_builder(fields)
+    if {'rating_avg', 'accepts_count'} & set(columns):
+        qs = qs.with_aggregates()
+    return qs.values_list(*columns), build
+
+
+class PlacesFilterMixin:
+    """
+    Миксин с фильтрацией мест по query-параметрам with_deleted, only_mine, name, сектору карты,
+    min_rating и accept_type
+    """
     def get_queryset(self):
         lookup_fields = {}
+        conditions = []
         with_deleted = self.request.query_params.get('with_deleted', 'False')
         with_deleted = with_deleted.lower() == 'true'
         all_ = Place.objects.with_deleted() if with_deleted else Place.objects
@@ -191,26 +274,122 @@ class PlacesListView(ListCreateAPIView, CollectStatsMixin):
         if name:
             lookup_fields['name__contains'] = name
 
-        latitude_1 = self.request.query_params.get('lat1', None)
-        longitude_1 = self.request.query_params.get('long1', None)
-        latitude_2 = self.request.query_params.get('lat2', None)
-        longitude_2 = self.request.query_params.get('long2', None)
-        llll = (latitude_1, latitude_2, longitude_1, longitude_2)
-        if all(llll):
+        bbox = get_bbox_from_request(self.request)
+        if bbox is not None:
+            lat_min, lat_max, long_min, long_max = bbox
+            lookup_fields.update(latitude__gte=lat_min, latitude__lte=lat_max,
+                                 longitude__gte=long_min, longitude__lte=long_max)
+
+        min_rating = self.request.query_params.get('min_rating', None)
+        if min_rating:
             try:
-                lookup_fields['latitude__gte'] = min(float(latitude_1), float(latitude_2))
-                lookup_fields['longitude__gte'] = min(float(longitude_1), float(longitude_2))
-                lookup_fields['latitude__lte'] = max(float(latitude_1), float(latitude_2))
-                lookup_fields['longitude__lte'] = max(float(longitude_1), float(longitude_2))
-            except (ValueError, TypeError):
-                raise ValidationError('Для фильтрации по сектору карты параметры должны быть числами')
-        elif len(list(filter(lambda x: x is not None, llll))) != 0:
-            raise ValidationError('Для фильтрации по сектору карты нужны 4 координаты')
-        return all_.filter(**lookup_fields)
+                lookup_fields['stats__rating_avg__gte'] = float(min_rating)
+            except ValueError:
+                raise ValidationError('min_rating должен быть числом')
+
+        accept_type = self.request.query_params.get('accept_type', None)
+        if accept_type:
+            try:
+                min_cnt, max_cnt = accepts_cnt_range(accept_type)
+            except KeyError:
+                raise ValidationError(f'accept_type должен быть одним из: {", ".join(x[0] for x in ACCEPT_TYPES)}')
+            # Место без строки PlaceStats (например, созданное до 0008_placestats) считается без подтверждений
+            accepts_cnt = Q(stats__accepts_cnt__gte=min_cnt)
+            if max_cnt is not None:
+                accepts_cnt &= Q(stats__accepts_cnt__lt=max_cnt)
+            conditions.append(accepts_cnt | Q(stats__isnull=True) if min_cnt == 0 else accepts_cnt)
+        return all_.filter(*conditions, **lookup_fields)
+
+
+class PlacesListView(PlacesFilterMixin, ListCreateAPIView, CollectStatsMixin):
+    """
+    Вьюха для получения списка мест
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    serializer_class = PlaceListSerializer
+    pagination_class = LimitOffsetPagination
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + PIN_RENDERERS
+    # Допустимые значения ordering и поля, по которым сортируется (агрегаты берутся из индексированного PlaceStats)
+    orderings = {
+        'rating': 'stats__rating_avg',
+        'accepts_cnt': 'stats__accepts_cnt',
+        'created_dt': 'created_dt',
+    }
+    # Сколько мест можно запросить за раз через ids
+    max_batch_ids = 100
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        ordering = self.request.query_params.get('ordering', None)
+        if not ordering:
+            return qs
+        descending = ordering.startswith('-')
+        try:
+            field = F(self.orderings[ordering.lstrip('-')])
+        except KeyError:
+            raise ValidationError(f'ordering должен быть одним из: {", ".join(self.orderings)} (с - для убывания)')
+        field = field.desc(nulls_last=True) if descending else field.asc(nulls_last=True)
+        return qs.order_by(field, '-id' if descending else 'id')
+
+    def list_batch(self, request):
+        """
+        Детальные представления мест по query-параметру ids в порядке запроса, несуществующие места пропускаются
+        """
+        ids = get_ids_from_request(request, self.max_batch_ids)
+        context = self.get_serializer_context()
+        serializer = PlaceDetailSerializer(many=True, context=context)
+        fields = set(serializer.child.fields)
+        qs = self.get_queryset().filter(id__in=ids)
+        if fields & {'rating', 'accepts_cnt', 'accept_type'}:
+            qs = qs.with_aggregates()
+        places = {place.id: place for place in qs}
+        if fields & {'my_rating', 'is_accepted_by_me'}:
+            PlaceDetailSerializer.preload_mine(context, list(places))
+        serializer.instance = [places[i] for i in ids if i in places]
+        return Response(serializer.data)
+
+    def list_pins(self, request):
+        """
+        Места как строки (id, широта, долгота, рейтинг) для бинарных рендереров слоев карты,
+        без моделей и сериализатора; рейтинг берется из PlaceStats
+        """
+        qs = self.get_queryset().values_list('id', 'latitude', 'longitude', 'stats__rating_avg')
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            return Response(list(page), headers={'X-Total-Count': str(self.paginator.count)})
+        return Response(list(qs))
+
+    def list_fast(self, request):
+        """
+        Списковое представление мест без моделей и сериализатора: словари в схеме PlaceListSerializer
+        собираются из строк values_list, агрегаты считаются в том же запросе
+        """
+        qs, build = place_list_rows(self.get_serializer(), self.get_queryset())
+        user_id = request.query_params.get('user_id', None)
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            return self.get_paginated_response(build(page, user_id))
+        return Response(build(qs, user_id))
+
+    def list_compact(self, request):
+        """
+        Места как списки [id, широта, долгота] для слоев карты, без сериализатора
+        """
+        qs = self.get_queryset().values_list('id', 'latitude', 'longitude')
+        page = self.paginate_queryset(qs)
+        if page is not None:
+            return self.get_paginated_response([list(row) for row in page])
+        return Response([list(row) for row in qs])
 
     @collect_request_stats_decorator()
     def get(self, request, *args, **kwargs):
-        return super().get(request, *args, **kwargs)
+        if 'ids' in request.query_params:
+            return self.list_batch(request)
+        if isinstance(request.accepted_renderer, PIN_RENDERERS):
+            return self.list_pins(request)
+        if request.query_params.get('compact', 'False').lower() == 'true':
+            return self.list_compact(request)
+        return self.list_fast(request)
 
     @collect_request_stats_decorator(another_stats_funcs=[CollectStatsMixin.collect_place_stats])
     def post(self, request, *args, **kwargs):
@@ -224,9 +403,203 @@ class PlacesListView(ListCreateAPIView, CollectStatsMixin):
         resp = super().post(request, *args, **kwargs)
         if resp.status_code == 201:
             add_kwargs[0]['place_id'] = resp.data['id']
+        else:
+            add_kwargs = []
         return resp, add_kwargs
 
 
+class PlaceChangesView(GenericAPIView, CollectStatsMixin):
+    """
+    Вьюха для ленты изменений мест после курсора since: текущие представления мест (в том числе удаленных),
+    которые были созданы, изменены, удалены или у которых изменились рейтинг или уровень проверенности
+    Без since отдается только текущий курсор -- с него начинается синхронизация после полной загрузки
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    serializer_class = PlaceListSerializer
+    default_limit = 500
+    max_limit = 1000
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        changes = PlaceChange.objects.settled()
+        since = request.query_params.get('since', None)
+        if since is None:
+            cursor = changes.order_by('-id').values_list('id', flat=True).first()
+            return Response({'cursor': cursor or 0, 'has_more': False, 'places': []})
+        try:
+            since = int(since)
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError('since и limit должны быть числами')
+        if since < 0 or limit < 1:
+            raise ValidationError('since должен быть неотрицательным, limit -- положительным')
+        changes = changes.filter(id__gt=since)
+        bbox = get_bbox_from_request(request)
+        if bbox is not None:
+            lat_min, lat_max, long_min, long_max = bbox
+            changes = changes.filter(place__latitude__gte=lat_min, place__latitude__lte=lat_max,
+                                     place__longitude__gte=long_min, place__longitude__lte=long_max)
+        rows = list(changes.order_by('id').values_list('id', 'place_id')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # Место с несколькими изменениями отдается один раз, в текущем состоянии
+        place_ids = {place_id for _, place_id in rows}
+        qs, build = place_list_rows(self.get_serializer(),
+                                    Place.objects.with_deleted().filter(id__in=place_ids).order_by('id'))
+        return Response({
+            'cursor': rows[-1][0] if rows else since,
+            'has_more': has_more,
+            'places': build(qs, request.query_params.get('user_id', None)),
+        })
+
+
+class PlacesExportView(PlacesFilterMixin, GenericAPIView, CollectStatsMixin):
+    """
+    Вьюха для потоковой выгрузки всех мест с агрегатами в NDJSON или CSV
+    updated_dt -- время последнего изменения места или его агрегатов (рейтинга, подтверждений), по нему же
+    фильтрует updated_since
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    renderer_classes = (NDJSONRenderer, CSVRenderer)
+    chunk_size = 2000
+    fields = ('id', 'name', 'latitude', 'longitude', 'address', 'created_by', 'created_dt', 'changed_dt',
+              'deleted_flg', 'rating_avg', 'accepts_count')
+    header = ('id', 'name', 'latitude', 'longitude', 'address', 'created_by', 'created_dt', 'updated_dt',
+              'deleted_flg', 'rating', 'accepts_cnt', 'accept_type')
+
+    def get_queryset(self):
+        # Оценки и подтверждения не трогают Place.updated_dt, но меняют PlaceStats.updated_dt
+        qs = super().get_queryset().annotate(changed_dt=Greatest('updated_dt', Coalesce('stats__updated_dt',
+                                                                                        'updated_dt')))
+        updated_since = self.request.query_params.get('updated_since', None)
+        if updated_since:
+            dt = parse_datetime(updated_since)
+            if dt is None:
+                raise ValidationError('updated_since должен быть датой-временем в формате ISO 8601')
+            if timezone.is_naive(dt):
+                dt = timezone.make_aware(dt, timezone.utc)
+            qs = qs.filter(changed_dt__gte=dt)
+        return qs.with_aggregates().order_by('id').values_list(*self.fields)
+
+    def iter_rows(self, queryset):
+        dates = [self.fields.index('created_dt'), self.fields.index('changed_dt')]
+        accepts = self.fields.index('accepts_count')
+        for row in queryset.iterator(chunk_size=self.chunk_size):
+            row = list(row)
+            for i in dates:
+                row[i] = row[i].isoformat()
+            row.append(accept_type_by_cnt(row[accepts]))
+            yield row
+
+    def iter_ndjson(self, queryset):
+        for row in self.iter_rows(queryset):
+            yield NDJSONRenderer.render_row(dict(zip(self.header, row)))
+
+    def iter_csv(self, queryset):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.header)
+        for row in self.iter_rows(queryset):
+            yield writer.writerow(row)
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        # Фильтры разбираем до начала стрима, чтобы ошибки валидации вернулись нормальным ответом
+        queryset = self.get_queryset()
+        renderer = request.accepted_renderer
+        rows = self.iter_csv(queryset) if renderer.format == CSVRenderer.format else self.iter_ndjson(queryset)
+        response = StreamingHttpResponse(rows, content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="places.{renderer.format}"'
+        return response
+
+
+class BasePlacesRankingView(ListAPIView, CollectStatsMixin):
+    """
+    Базовый класс для топов мест по предрассчитанным агрегатам, опционально в секторе карты
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    ordering = None
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self) -> int:
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError('limit должен быть числом')
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError(f'limit должен быть от 1 до {self.max_limit}')
+        return limit
+
+    def get_ranked_queryset(self):
+        return PlaceStats.objects.filter(place__deleted_flg=False).select_related('place')
+
+    def get_queryset(self):
+        qs = self.get_ranked_queryset()
+        bbox = get_bbox_from_request(self.request)
+        if bbox is not None:
+            lat_min, lat_max, long_min, long_max = bbox
+            row_min, col_min = cell_of(lat_min, long_min)
+            row_max, col_max = cell_of(lat_max, long_max)
+            qs = qs.filter(cell_row__gte=row_min, cell_row__lte=row_max, cell_col__gte=col_min, cell_col__lte=col_max,
+                           place__latitude__gte=lat_min, place__latitude__lte=lat_max,
+                           place__longitude__gte=long_min, place__longitude__lte=long_max)
+        return qs.order_by(self.ordering, 'place_id')[:self.get_limit()]
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class PlacesTopView(BasePlacesRankingView):
+    """
+    Вьюха для лучших по байесовской оценке рейтинга мест
+    """
+    serializer_class = PlaceTopSerializer
+    ordering = '-score'
+
+
+class PlacesTrendingView(BasePlacesRankingView):
+    """
+    Вьюха для мест с наибольшей активностью за последнее время
+    """
+    serializer_class = PlaceTrendingSerializer
+    ordering = '-trend_key'
+
+    def get_ranked_queryset(self):
+        return super().get_ranked_queryset().filter(trend_key__isnull=False)
+
+
+class PlaceRatingStatsView(GenericAPIView, CollectStatsMixin):
+    """
+    Вьюха для распределения оценок места
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    serializer_class = PlaceRatingStatsSerializer
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        place_id = int(self.kwargs['pk'])
+        if not Place.objects.filter(id=place_id).exists():
+            raise NotFound('Место не найдено')
+        return Response(self.get_serializer(aggregates.rating_stats([place_id])[place_id]).data)
+
+
+class PlacesRatingStatsView(GenericAPIView, CollectStatsMixin):
+    """
+    Вьюха для распределения оценок нескольких мест по query-параметру ids, несуществующие места пропускаются
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+    serializer_class = PlaceRatingStatsSerializer
+    max_ids = 100
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        ids = get_ids_from_request(request, self.max_ids)
+        existing = set(Place.objects.filter(id__in=ids).values_list('id', flat=True))
+        stats = aggregates.rating_stats(existing)
+        return Response(self.get_serializer([stats[i] for i in ids if i in existing], many=True).data)
+
+
 class PlaceDetailView(RetrieveUpdateDestroyAPIView, CollectStatsMixin):
     """
     Вьюха для получения, изменения и удаления места
@@ -242,6 +615,18 @@ class PlaceDetailView(RetrieveUpdateDestroyAPIView, CollectStatsMixin):
     def perform_destroy(self, instance: Place):
         instance.soft_delete()
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Общая для всех пользователей часть живого места берется из кэша процесса, поля пользователя
+        добавляются к ней на каждый запрос
+        """
+        if request.query_params.get('with_deleted', 'False').lower() == 'true':
+            return super().retrieve(request, *args, **kwargs)
+        serializer = self.get_serializer()
+        shared = get_detail_cache().get_or_build(
+            int(self.kwargs['pk']), lambda: serializer.shared_data(self.get_object(), request))
+        return Response(serializer.with_personal_data(shared))
+
     @collect_request_stats_decorator(another_stats_funcs=[CollectStatsMixin.collect_place_stats])
     def get(self, request, *args, **kwargs):
         add_kwargs = [{
@@ -274,3 +659,39 @@ class PlaceDetailView(RetrieveUpdateDestroyAPIView, CollectStatsMixin):
             'request': request,
         }]
         return super().delete(request, *args, **kwargs), add_kwargs
+
+
+class PlaceTileView(GenericAPIView, CollectStatsMixin):
+    """
+    Вьюха для тайла карты z/x/y (см. Places.tiles): на крупных зумах места, на мелких кластеры
+    Ответ кэшируется клиентом и CDN на PLACES_TILE_MAX_AGE_SECONDS и проверяется по ETag
+    """
+    permission_classes = (WriteOnlyByAuthenticated, )
+
+    @collect_request_stats_decorator()
+    def get(self, request, *args, **kwargs):
+        zoom, x, y = int(self.kwargs['z']), int(self.kwargs['x']), int(self.kwargs['y'])
+        if zoom > settings.PLACES_TILE_MAX_ZOOM:
+            raise ValidationError(f'Зум тайла не может быть больше {settings.PLACES_TILE_MAX_ZOOM}')
+        if x >= 1 << zoom or y >= 1 << zoom:
+            raise ValidationError(f'На зуме {zoom} x и y тайла должны быть меньше {1 << zoom}')
+        body, etag = tiles.get(zoom, x, y)
+        # Сравнение слабое: после сжатия CompressionMiddleware клиент присылает ETag с префиксом W/
+        if_none_match = {tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')}
+        if etag in if_none_match or 'W/' + etag in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.PLACES_TILE_MAX_AGE_SECONDS}'
+        return response
+
+
+class MetricsView(GenericAPIView):
+    """
+    Вьюха для метрик соединений с БД, заполненности пулов соединений и кэша мест текущего процесса
+    """
+    permission_classes = (IsSuperuser, )
+
+    def get(self, request, *args, **kwargs):
+        return Response({'databases': connection_stats(), 'place_detail_cache': get_detail_cache().stats()})
@@ -2,15 +2,18 @@
 ASGI config for PlacesService project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP and WebSocket are routed by channels, see PlacesService.routing.
 
 For more information on this file, see
-https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+https://channels.readthedocs.io/en/2.4.0/deploying.html
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from channels.routing import get_default_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'PlacesService.settings')
 
-application = get_asgi_application()
+django.setup()
+application = get_default_application()
@@ -0,0 +1,62 @@
+"""
+PostgreSQL с внутрипроцессным пулом соединений
+Настройки пула -- в ключе POOL настроек БД: MAX_SIZE, TIMEOUT и CHECK_INTERVAL (в секундах)
+Закрытие соединения Django (в конце запроса при CONN_MAX_AGE = 0) возвращает его в пул
+"""
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+from PlacesService.db_pool import get_pool, PoolTimeout
+
+Database = base.Database
+
+
+def _is_usable(conn) -> bool:
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except Database.Error:
+        return False
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_pool(self):
+        params = self.get_connection_params()
+        pool_settings = self.settings_dict.get('POOL', {})
+        return get_pool(self.alias, lambda: Database.connect(**params),
+                        max_size=pool_settings.get('MAX_SIZE', 10),
+                        timeout=pool_settings.get('TIMEOUT', 5),
+                        check_interval=pool_settings.get('CHECK_INTERVAL', 30),
+                        is_usable=_is_usable)
+
+    def get_new_connection(self, conn_params):
+        try:
+            connection = self.get_pool().acquire()
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            conn = self.connection
+            # Соединение с незавершенной транзакцией или разорванное в пул не возвращается
+            status = conn.get_transaction_status() if not conn.closed else extensions.TRANSACTION_STATUS_UNKNOWN
+            if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR) \
+                    and not self.in_atomic_block:
+                conn.rollback()
+                status = extensions.TRANSACTION_STATUS_IDLE
+            self.get_pool().release(conn, discard=self.in_atomic_block or status != extensions.TRANSACTION_STATUS_IDLE)
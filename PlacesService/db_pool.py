@@ -0,0 +1,194 @@
+"""
+Соединения с БД: проверка постоянных соединений и внутрипроцессный пул для ASGI
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+from django.conf import settings
+from django.db import connections
+
+
+class PoolTimeout(Exception):
+    """
+    Не дождались свободного соединения в пуле
+    """
+    pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений с ограничением размера
+    Соединения создаются по требованию и отдаются в порядке LIFO, чтобы в работе оставались самые свежие;
+    соединение, простоявшее в пуле дольше check_interval секунд, перед выдачей проверяется через is_usable
+    """
+    def __init__(self, connect: Callable[[], Any], max_size: int, timeout: float = 5,
+                 check_interval: float = 30, is_usable: Callable[[Any], bool] = None,
+                 close: Callable[[Any], None] = None, clock: Callable[[], float] = time.monotonic):
+        self._connect = connect
+        self._is_usable = is_usable or (lambda conn: True)
+        self._close = close or (lambda conn: conn.close())
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.clock = clock
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._max_in_use = 0
+        self._acquired_total = 0
+        self._waits_total = 0
+        self._wait_seconds_total = 0.0
+        self._timeouts_total = 0
+        self._discarded_total = 0
+
+    def acquire(self):
+        """
+        Соединение из пула, новое соединение, если пул не заполнен, или ожидание освобождения до timeout секунд
+        """
+        start = self.clock()
+        with self._cond:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = self.timeout - (self.clock() - start)
+                if remaining <= 0:
+                    self._timeouts_total += 1
+                    raise PoolTimeout(f'Нет свободных соединений в пуле за {self.timeout} с')
+                if not waited:
+                    self._waits_total += 1
+                    waited = True
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            if waited:
+                self._wait_seconds_total += self.clock() - start
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._size += 1
+            self._in_use += 1
+            self._acquired_total += 1
+            self._max_in_use = max(self._max_in_use, self._in_use)
+        try:
+            if conn is not None and self.clock() - released_at > self.check_interval and not self._is_usable(conn):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """
+        Возврат соединения в пул или его закрытие, если оно в непонятном состоянии
+        """
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, self.clock()))
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    def close_idle(self):
+        """
+        Закрытие всех простаивающих соединений
+        """
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        with self._cond:
+            self._discarded_total += 1
+        try:
+            self._close(conn)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Метрики пула: занятость, ожидания и таймауты
+        """
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'max_in_use': self._max_in_use,
+                'saturation': self._in_use / self.max_size if self.max_size else 0.0,
+                'acquired_total': self._acquired_total,
+                'waits_total': self._waits_total,
+                'wait_seconds_total': round(self._wait_seconds_total, 6),
+                'timeouts_total': self._timeouts_total,
+                'discarded_total': self._discarded_total,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, connect: Callable[[], Any], **kwargs) -> ConnectionPool:
+    """
+    Общий на процесс пул соединений для алиаса БД, создается при первом обращении
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(connect, **kwargs)
+        return pool
+
+
+def connection_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Состояние соединений текущего потока и пулов по алиасам БД
+    """
+    result = {}
+    for alias in connections:
+        connection = connections[alias]
+        pool = _pools.get(alias)
+        result[alias] = {
+            'vendor': connection.vendor,
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'connected': connection.connection is not None,
+            'pool': pool.stats() if pool is not None else None,
+        }
+    return result
+
+
+def check_persistent_connections(**kwargs):
+    """
+    Проверка постоянных соединений перед запросом не чаще раза в PLACES_DB_HEALTH_CHECK_SECONDS:
+    соединение, разорванное сервером или балансировщиком, закрывается до того, как на нем упадет запрос
+    """
+    interval = settings.PLACES_DB_HEALTH_CHECK_SECONDS
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if connection.settings_dict['CONN_MAX_AGE'] == 0:
+            continue
+        checked_at = getattr(connection, 'places_checked_at', None)
+        if checked_at is not None and now - checked_at < interval:
+            continue
+        connection.places_checked_at = now
+        if not connection.is_usable():
+            connection.close()
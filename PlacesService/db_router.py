@@ -0,0 +1,161 @@
+"""
+Роутинг чтения моделей Places на реплики БД
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS, DatabaseError
+from django.db.utils import ConnectionDoesNotExist
+
+_state = threading.local()
+
+
+def get_read_database() -> Optional[str]:
+    """
+    БД для чтения в текущем потоке, None -- primary
+    """
+    return getattr(_state, 'read_db', None)
+
+
+@contextmanager
+def read_from(alias: Optional[str]):
+    """
+    Чтение моделей Places из указанной БД в пределах блока
+    """
+    prev = get_read_database()
+    _state.read_db = alias
+    try:
+        yield
+    finally:
+        _state.read_db = prev
+
+
+def probe_replica(alias: str) -> float:
+    """
+    Проверка доступности реплики
+    :return: Отставание реплики в секундах (0 для СУБД, где его не узнать)
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Реплика, которая проиграла все полученные WAL, не отстает, даже если на primary давно не было записи
+            cursor.execute("""
+                SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+            """)
+        else:
+            cursor.execute('SELECT 0')
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaPool:
+    """
+    Набор реплик с периодической проверкой доступности и отставания
+    Недоступная реплика не проверяется повторно cooldown секунд, доступная -- check_interval секунд
+    """
+    STRATEGIES = ('round_robin', 'least_lag')
+
+    def __init__(self, aliases: Iterable[str], strategy: str = 'round_robin', check_interval: float = 5,
+                 cooldown: float = 30, max_lag: Optional[float] = None,
+                 probe: Callable[[str], float] = probe_replica, clock: Callable[[], float] = time.monotonic):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f'Неизвестная стратегия выбора реплики: {strategy}')
+        self.aliases = list(aliases)
+        self.strategy = strategy
+        self.check_interval = check_interval
+        self.cooldown = cooldown
+        self.max_lag = max_lag
+        self.probe = probe
+        self.clock = clock
+        self._health = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def _status(self, alias: str, now: float) -> Tuple[bool, Optional[float]]:
+        with self._lock:
+            status = self._health.get(alias)
+        if status is not None:
+            ok, lag, checked_at = status
+            if now - checked_at < (self.check_interval if ok else self.cooldown):
+                return ok, lag
+        try:
+            ok, lag = True, self.probe(alias)
+        except (DatabaseError, ConnectionDoesNotExist):
+            ok, lag = False, None
+        with self._lock:
+            self._health[alias] = (ok, lag, now)
+        return ok, lag
+
+    def mark_failed(self, alias: str):
+        """
+        Исключение реплики из выбора на cooldown секунд
+        """
+        with self._lock:
+            self._health[alias] = (False, None, self.clock())
+
+    def available(self) -> List[Tuple[str, float]]:
+        """
+        Доступные реплики с отставанием не больше max_lag
+        """
+        now = self.clock()
+        result = []
+        for alias in self.aliases:
+            ok, lag = self._status(alias, now)
+            if ok and (self.max_lag is None or lag <= self.max_lag):
+                result.append((alias, lag))
+        return result
+
+    def choose(self) -> Optional[str]:
+        """
+        Реплика для чтения или None, если читать нужно с primary
+        """
+        if not self.aliases:
+            return None
+        available = self.available()
+        if not available:
+            return None
+        if self.strategy == 'least_lag':
+            return min(available, key=lambda item: item[1])[0]
+        return available[next(self._counter) % len(available)][0]
+
+
+@lru_cache(maxsize=None)
+def get_replica_pool() -> ReplicaPool:
+    """
+    Общий на процесс набор реплик из настроек
+    """
+    return ReplicaPool(settings.PLACES_REPLICA_DATABASES,
+                       strategy=settings.PLACES_REPLICA_SELECTION,
+                       check_interval=settings.PLACES_REPLICA_CHECK_INTERVAL_SECONDS,
+                       cooldown=settings.PLACES_REPLICA_COOLDOWN_SECONDS,
+                       max_lag=settings.PLACES_REPLICA_MAX_LAG_SECONDS)
+
+
+class ReplicaRouter:
+    """
+    Роутер БД: чтение моделей Places из выбранной для запроса реплики, все остальное -- через primary
+    """
+    app_labels = {'Places'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.app_labels:
+            return get_read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и primary
+        if obj1._meta.app_label in self.app_labels and obj2._meta.app_label in self.app_labels:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.PLACES_REPLICA_DATABASES:
+            return False
+        return None
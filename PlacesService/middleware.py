@@ -0,0 +1,151 @@
+"""
+Middleware сервиса
+"""
+import gzip
+import hashlib
+import re
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.permissions import SAFE_METHODS
+from PlacesService.db_router import get_read_database, get_replica_pool, read_from
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Сжимаемые типы ответов
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/', 'application/x-msgpack',
+                      'application/x-places-pins')
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Чтение безопасных запросов к API с реплик
+    После успешного изменяющего запроса клиент на PLACES_PRIMARY_PIN_SECONDS закрепляется за primary, чтобы видеть
+    свои изменения: через cookie и через общий кэш (см. CACHES) по заголовку Authorization для клиентов без cookie
+    Если безопасный запрос упал на реплике с ошибкой БД, реплика исключается из выбора, а запрос повторяется на primary
+    """
+    path_prefix = '/api/'
+    cookie_name = 'places_primary_pin'
+    cache_prefix = 'places:primary_pin:'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+        if request.method in SAFE_METHODS:
+            request.read_database = None if self.is_pinned(request) else get_replica_pool().choose()
+            with read_from(request.read_database):
+                response = self.get_response(request)
+            if request.read_database is not None and response.streaming:
+                response.streaming_content = self._stream_from(request.read_database, response.streaming_content)
+            return response
+        response = self.get_response(request)
+        if response.status_code < 400 and get_replica_pool().aliases:
+            self.pin(request, response)
+        return response
+
+    def process_exception(self, request, exception):
+        alias = get_read_database()
+        if alias is None or request.method not in SAFE_METHODS or not isinstance(exception, DatabaseError):
+            return None
+        get_replica_pool().mark_failed(alias)
+        request.read_database = None
+        callback, callback_args, callback_kwargs = request.resolver_match
+        with read_from(None):
+            response = callback(request, *callback_args, **callback_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+        return response
+
+    @staticmethod
+    def _stream_from(alias, content):
+        # Потоковые ответы читают БД уже после выхода из middleware
+        with read_from(alias):
+            yield from content
+
+    def _cache_key(self, request):
+        auth = request.META.get('HTTP_AUTHORIZATION')
+        if not auth:
+            return None
+        return self.cache_prefix + hashlib.sha1(auth.encode()).hexdigest()
+
+    def is_pinned(self, request) -> bool:
+        try:
+            if float(request.COOKIES.get(self.cookie_name, 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        key = self._cache_key(request)
+        return key is not None and cache.get(key) is not None
+
+    def pin(self, request, response):
+        window = settings.PLACES_PRIMARY_PIN_SECONDS
+        if window <= 0:
+            return
+        response.set_cookie(self.cookie_name, str(time.time() + window), max_age=int(window) or 1, httponly=True)
+        key = self._cache_key(request)
+        if key is not None:
+            cache.set(key, 1, timeout=window)
+
+
+def accepted_encodings(request) -> list:
+    """
+    Поддерживаемые сервисом кодировки из Accept-Encoding в порядке предпочтения сервиса
+    """
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = {part.split(';')[0].strip().lower() for part in header.split(',')
+                if not re.search(r';\s*q=0(\.0*)?\s*$', part)}
+    return [encoding for encoding in ('br', 'gzip') if encoding in accepted and (encoding != 'br' or brotli)]
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    """
+    Сжатие тела ответа в gzip или brotli
+    """
+    if encoding == 'br':
+        return brotli.compress(content, quality=settings.PLACES_BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=settings.PLACES_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов brotli (если установлен) или gzip
+    Ответы меньше PLACES_COMPRESSION_MIN_BYTES не сжимаются: выигрыш меньше затрат CPU; потоковые ответы сжимаются
+    только gzip по мере отдачи
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding') or not response.get('Content-Type', '').startswith(
+                COMPRESSIBLE_TYPES):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        encodings = accepted_encodings(request)
+        if response.streaming:
+            if 'gzip' not in encodings:
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            encoding = 'gzip'
+        else:
+            if not encodings or len(response.content) < settings.PLACES_COMPRESSION_MIN_BYTES:
+                return response
+            encoding = encodings[0]
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,9 @@
+"""
+Маршрутизация ASGI (channels): HTTP обрабатывает Django, WebSocket -- консьюмеры Places
+"""
+from channels.routing import ProtocolTypeRouter, URLRouter
+from Places.routing import websocket_urlpatterns
+
+application = ProtocolTypeRouter({
+    'websocket': URLRouter(websocket_urlpatterns),
+})
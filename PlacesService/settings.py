@@ -11,8 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
-import sys
-import dotenv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +42,7 @@ DJANGO_APPS = [
 
 THIRD_PARTY_APPS = [
     'rest_framework',
+    'channels',
 ]
 
 DEV_APPS = [
@@ -53,8 +53,10 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + DEV_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'PlacesService.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'PlacesService.middleware.ReplicaRoutingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -65,7 +67,7 @@ ROOT_URLCONF = 'PlacesService.urls'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'Places.renderers.FastJSONRenderer',
     ]
 }
 
@@ -87,6 +89,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'PlacesService.wsgi.application'
 
+ASGI_APPLICATION = 'PlacesService.routing.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -98,6 +102,8 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['PlacesService.db_router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -155,7 +161,7 @@ except ImportError as e:
 
 if DEBUG:
     REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = [
-        'rest_framework.renderers.JSONRenderer',
+        'Places.renderers.FastJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ]
 
@@ -164,8 +170,123 @@ APP_SECRET = ENV['PLACES_SECRET']
 
 ALLOW_REQUESTS = True
 
+# Поиск дубликатов мест: радиус в метрах и минимальная похожесть названий (0..1)
+PLACES_DUPLICATE_RADIUS_M = float(os.getenv('PLACES_DUPLICATE_RADIUS_M', '50'))
+PLACES_DUPLICATE_NAME_SIMILARITY = float(os.getenv('PLACES_DUPLICATE_NAME_SIMILARITY', '0.7'))
+
+# Топы мест: априорное среднее и вес для байесовской оценки, период полураспада трендов в часах
+PLACES_RATING_PRIOR_MEAN = float(os.getenv('PLACES_RATING_PRIOR_MEAN', '3.0'))
+PLACES_RATING_PRIOR_WEIGHT = float(os.getenv('PLACES_RATING_PRIOR_WEIGHT', '5'))
+PLACES_TRENDING_HALF_LIFE_HOURS = float(os.getenv('PLACES_TRENDING_HALF_LIFE_HOURS', '72'))
+
+# Реплики для чтения: URL через запятую в REPLICA_DATABASE_URLS или БД replica_* в settings_local
+for i, replica_url in enumerate(filter(None, os.getenv('REPLICA_DATABASE_URLS', '').split(','))):
+    import dj_database_url
+    DATABASES[f'replica_{i}'] = dj_database_url.parse(replica_url)
+PLACES_REPLICA_DATABASES = [alias for alias in DATABASES if alias.startswith('replica')]
+for alias in PLACES_REPLICA_DATABASES:
+    DATABASES[alias].setdefault('TEST', {'MIRROR': 'default'})
+
+# Выбор реплики (round_robin или least_lag), допустимое отставание, частота проверок, время исключения
+# недоступной реплики и время закрепления клиента за primary после записи, все в секундах
+PLACES_REPLICA_SELECTION = os.getenv('PLACES_REPLICA_SELECTION', 'round_robin')
+PLACES_REPLICA_MAX_LAG_SECONDS = float(os.getenv('PLACES_REPLICA_MAX_LAG_SECONDS', '10'))
+PLACES_REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv('PLACES_REPLICA_CHECK_INTERVAL_SECONDS', '5'))
+PLACES_REPLICA_COOLDOWN_SECONDS = float(os.getenv('PLACES_REPLICA_COOLDOWN_SECONDS', '30'))
+PLACES_PRIMARY_PIN_SECONDS = float(os.getenv('PLACES_PRIMARY_PIN_SECONDS', '10'))
+
+# Сжатие ответов: минимальный размер ответа в байтах и уровни сжатия gzip (1-9) и brotli (0-11)
+PLACES_COMPRESSION_MIN_BYTES = int(os.getenv('PLACES_COMPRESSION_MIN_BYTES', '1024'))
+PLACES_GZIP_LEVEL = int(os.getenv('PLACES_GZIP_LEVEL', '6'))
+PLACES_BROTLI_QUALITY = int(os.getenv('PLACES_BROTLI_QUALITY', '5'))
+
+# Изменения мест по WebSocket: слой каналов в Redis, если задан REDIS_URL, иначе в памяти процесса (годится только
+# когда записи и подписчики в одном процессе -- для разработки и тестов)
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.getenv('REDIS_URL')]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Общий для всех процессов кэш Django: закрепление клиентов за primary, тайлы карты и версии детальных представлений
+# мест. Без REDIS_URL кэш в памяти процесса: инвалидация в нем не видна другим воркерам, а закрепление за primary
+# по заголовку Authorization не работает, поэтому с репликами на Heroku REDIS_URL обязателен
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Склейка изменений: не чаще одной отправки подписчику в секунды; не больше сообщений от клиента за окно в секундах;
+# ограничения размера подписки
+PLACES_REALTIME_FLUSH_SECONDS = float(os.getenv('PLACES_REALTIME_FLUSH_SECONDS', '1'))
+PLACES_REALTIME_MAX_MESSAGES = int(os.getenv('PLACES_REALTIME_MAX_MESSAGES', '20'))
+PLACES_REALTIME_WINDOW_SECONDS = float(os.getenv('PLACES_REALTIME_WINDOW_SECONDS', '10'))
+PLACES_REALTIME_MAX_IDS = int(os.getenv('PLACES_REALTIME_MAX_IDS', '100'))
+PLACES_REALTIME_MAX_CELLS = int(os.getenv('PLACES_REALTIME_MAX_CELLS', '400'))
+
+# Лента изменений мест: записи моложе этого числа секунд не отдаются, чтобы успели закоммититься транзакции
+# с меньшими id
+PLACES_CHANGES_SETTLE_SECONDS = float(os.getenv('PLACES_CHANGES_SETTLE_SECONDS', '2'))
+
+# Тайлы карты: максимальный зум; зум, начиная с которого отдаются сами места, а не кластеры; на сколько зумов глубже
+# тайла считаются кластеры; время жизни собранного тайла в кэше и в кэше клиентов и CDN в секундах
+PLACES_TILE_MAX_ZOOM = int(os.getenv('PLACES_TILE_MAX_ZOOM', '20'))
+PLACES_TILE_RAW_MIN_ZOOM = int(os.getenv('PLACES_TILE_RAW_MIN_ZOOM', '14'))
+PLACES_TILE_CLUSTER_BITS = int(os.getenv('PLACES_TILE_CLUSTER_BITS', '3'))
+PLACES_TILE_CACHE_SECONDS = int(os.getenv('PLACES_TILE_CACHE_SECONDS', '3600'))
+PLACES_TILE_MAX_AGE_SECONDS = int(os.getenv('PLACES_TILE_MAX_AGE_SECONDS', '60'))
+
+# Кэш детальных представлений мест в памяти процесса: кол-во мест (0 -- без кэша) и время жизни записи в секундах
+PLACES_DETAIL_CACHE_SIZE = int(os.getenv('PLACES_DETAIL_CACHE_SIZE', '1000'))
+PLACES_DETAIL_CACHE_SECONDS = float(os.getenv('PLACES_DETAIL_CACHE_SECONDS', '30'))
+
+# Склейка частых переоценок места пользователем: первая оценка учитывается сразу, следующие в течение этого числа
+# секунд после последней -- одним изменением агрегатов при закрытии окна (manage.py flush_rating_changes); 0 -- выкл.
+PLACES_RATING_COALESCE_SECONDS = float(os.getenv('PLACES_RATING_COALESCE_SECONDS', '0'))
+
+# Сколько дней мягко удаленные подтверждения, оценки и картинки хранятся в живых таблицах до переноса в архив
+# (manage.py compact_deleted)
+PLACES_ARCHIVE_RETENTION_DAYS = float(os.getenv('PLACES_ARCHIVE_RETENTION_DAYS', '30'))
+
 ON_HEROKU = not (os.getenv('ON_HEROKU', '0') == '0')
+if ON_HEROKU and PLACES_REPLICA_DATABASES and not os.getenv('REDIS_URL'):
+    raise ImproperlyConfigured('С репликами на Heroku нужен REDIS_URL: без общего кэша закрепление клиента за primary '
+                               'видит только один воркер')
 
 if not DEBUG:
     import django_heroku
     django_heroku.settings(locals(), databases=ON_HEROKU, test_runner=False, secret_key=False)
+
+# Соединения с БД: время жизни постоянного соединения в секундах (0 -- новое соединение на каждый запрос) и как
+# часто проверять его перед запросом; при DB_POOL_MAX_SIZE > 0 PostgreSQL работает через внутрипроцессный пул,
+# в который соединения возвращаются в конце каждого запроса
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+PLACES_DB_HEALTH_CHECK_SECONDS = float(os.getenv('PLACES_DB_HEALTH_CHECK_SECONDS', '30'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '0'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+for db_settings in DATABASES.values():
+    if DB_POOL_MAX_SIZE > 0 and db_settings['ENGINE'] in ('django.db.backends.postgresql',
+                                                          'django.db.backends.postgresql_psycopg2'):
+        db_settings['ENGINE'] = 'PlacesService.db_backends.pooled_postgresql'
+        db_settings['CONN_MAX_AGE'] = 0
+        db_settings['POOL'] = {'MAX_SIZE': DB_POOL_MAX_SIZE, 'TIMEOUT': DB_POOL_TIMEOUT,
+                               'CHECK_INTERVAL': PLACES_DB_HEALTH_CHECK_SECONDS}
+    else:
+        db_settings['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
@@ -0,0 +1,34 @@
+"""
+Настройки процесса, который обслуживает только /api/
+
+API аутентифицируется токеном через ApiRequesters и отдает только JSON, поэтому здесь нет админки, сессий,
+сообщений, статики и их middleware. Админка работает отдельным приложением Heroku с PlacesService.settings
+(см. bin/web)
+"""
+from PlacesService.settings import *
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'PlacesService.middleware.CompressionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'PlacesService.middleware.ReplicaRoutingMiddleware',
+]
+
+ROOT_URLCONF = 'PlacesService.urls_api'
+
+# Пользователи Django в API не используются: без аутентификации DRF запросу не нужны сессии
+REST_FRAMEWORK = dict(REST_FRAMEWORK, **{
+    'DEFAULT_RENDERER_CLASSES': [
+        'Places.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+})
+
+TEMPLATES = [dict(TEMPLATES[0], OPTIONS={'context_processors': []})]
@@ -0,0 +1,9 @@
+"""
+URL процесса API (PlacesService.settings_api): только /api/, без админки и статики
+"""
+from django.conf.urls import url, include
+
+
+urlpatterns = [
+    url(r'^api/', include('Places.urls')),
+]
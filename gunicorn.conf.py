@@ -0,0 +1,22 @@
+"""
+Настройки gunicorn (читаются из текущей директории автоматически)
+
+Приложение, настройки и все вьюхи загружаются один раз в мастере до fork, поэтому новые воркеры при
+масштабировании начинают обслуживать запросы сразу, а не импортируют Django и приложение заново
+"""
+import os
+
+preload_app = True
+
+# Heartbeat воркеров в памяти, а не на диске: на Heroku /tmp может подтормаживать
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+def when_ready(server):
+    # Вьюхи и сериализаторы Django грузит при первом запросе: загружаем их в мастере, чтобы воркеры получили
+    # их после fork; соединения с БД, открытые при загрузке, воркерам не передаются
+    from django.db import connections
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    connections.close_all()